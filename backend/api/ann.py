@@ -0,0 +1,126 @@
+"""
+Approximate nearest-neighbour search for catalogs too large to scan per request.
+
+``IVFIndex`` is an inverted-file index: a spherical k-means coarse quantizer
+splits the (unit-length) embeddings into ``n_lists`` cells, stored as CSR
+arrays (``offsets`` into a cell-sorted ``ids`` array). A query scores only the
+rows of its ``nprobe`` closest cells, so ``nprobe`` trades recall for latency;
+``nprobe == n_lists`` is an exact scan.
+"""
+import time
+
+import numpy as np
+
+from .engine import normalize_rows, top_k
+
+ARRAY_NAMES = ('ivf_centroids', 'ivf_offsets', 'ivf_ids')
+
+
+def default_n_lists(rows):
+    return int(max(1, min(rows // 39, round(4 * np.sqrt(rows)))))
+
+
+def _assign(embeddings, centroids, chunk_size=65536):
+    assignments = np.empty(embeddings.shape[0], dtype=np.int32)
+    for start in range(0, embeddings.shape[0], chunk_size):
+        chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(embeddings, n_lists, iterations=10, sample_size=None, seed=0):
+    """Spherical k-means on a random sample of rows."""
+    rng = np.random.default_rng(seed)
+    rows = embeddings.shape[0]
+    sample_size = min(rows, sample_size or max(n_lists * 64, 10000))
+    sample = normalize_rows(embeddings[np.sort(rng.choice(rows, sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=n_lists)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        non_empty = counts > 0
+        sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+        centroids[non_empty] = normalize_rows(sums)
+        # re-seed cells that lost all their points
+        empty = np.flatnonzero(~non_empty)
+        if empty.size:
+            centroids[empty] = sample[rng.choice(sample_size, empty.size, replace=False)]
+    return centroids
+
+
+class IVFIndex:
+
+    def __init__(self, embeddings, centroids, offsets, ids, nprobe=16):
+        self.embeddings = embeddings
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.offsets = offsets
+        self.ids = ids
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, iterations=10, sample_size=None, seed=0, nprobe=16):
+        """Trains the quantizer and files every row under its closest centroid."""
+        n_lists = n_lists or default_n_lists(embeddings.shape[0])
+        centroids = train_centroids(embeddings, n_lists, iterations, sample_size, seed)
+        assignments = _assign(embeddings, centroids)
+        ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+        return cls(embeddings, centroids, offsets, ids, nprobe)
+
+    @classmethod
+    def from_catalog(cls, catalog, nprobe=16):
+        """The catalog's IVF index, or None if it was built without one."""
+        if not all(name in catalog.arrays for name in ARRAY_NAMES):
+            return None
+        return cls(
+            catalog.embeddings,
+            catalog.arrays['ivf_centroids'],
+            catalog.arrays['ivf_offsets'],
+            catalog.arrays['ivf_ids'],
+            nprobe,
+        )
+
+    def to_arrays(self):
+        return {'ivf_centroids': self.centroids, 'ivf_offsets': self.offsets, 'ivf_ids': self.ids}
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        cells, _ = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+
+    def search(self, query_embedding, k=6, nprobe=None, timings=None):
+        """Returns (indices, scores) of the best k rows within the probed cells."""
+        start = time.perf_counter()
+        query = normalize_rows(np.reshape(query_embedding, (-1,)))
+        ids = np.sort(self.candidates(query, nprobe))
+        candidate_scores = self.embeddings[ids] @ query
+        if timings is not None:
+            start = timings.since('similarity', start)
+        positions, scores = top_k(candidate_scores, k)
+        if timings is not None:
+            timings.since('topk', start)
+        return ids[positions], scores
+
+    def search_batch(self, query_embeddings, k=6, nprobe=None, timings=None):
+        """
+        Per-query (indices, scores) lists. Rows can be shorter than k when the
+        probed cells hold fewer than k movies.
+        """
+        queries = np.reshape(query_embeddings, (-1, self.dim))
+        results = [self.search(q, k, nprobe, timings) for q in queries]
+        return [i for i, _ in results], [s for _, s in results]
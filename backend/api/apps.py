@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+
+        from .loader import install_reload_signal, loader, should_load_on_startup
+        from .threads import configure
+
+        if should_load_on_startup():
+            # size the thread pools before numpy/torch load and start theirs
+            configure()
+            loader.start()
+            install_reload_signal(settings.RECOMMENDER_RELOAD_SIGNAL)
@@ -0,0 +1,395 @@
+"""
+On-disk catalog artifacts.
+
+A catalog is a directory per build version, next to a ``CURRENT`` file that
+names the active one:
+
+    catalog/
+        CURRENT
+        <version>/
+            manifest.json
+            embeddings.npy          float32, L2-normalised rows
+            columns/<name>.npy      numeric metadata columns
+            columns/<name>.bin      utf-8 string data ...
+            columns/<name>.offsets.npy   ... and its row offsets (int64)
+            arrays/<name>.npy       auxiliary build outputs (vocabulary vectors, indexes, ...)
+
+Everything is opened with ``mmap_mode='r'``, so every worker process maps the
+same page-cache pages instead of holding its own unpickled copy.
+"""
+import hashlib
+import json
+import os
+import shutil
+import struct
+import time
+
+import numpy as np
+
+from .engine import normalize_rows
+
+FORMAT_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+CURRENT_NAME = 'CURRENT'
+EMBEDDINGS_NAME = 'embeddings.npy'
+COLUMNS_DIR = 'columns'
+ARRAYS_DIR = 'arrays'
+NPY_HEADER_SIZE = 128
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StringColumn:
+    """Read-only sequence of strings backed by a utf-8 blob and row offsets."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def raw(self, index):
+        """The utf-8 bytes of a row, without decoding."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def _npy_header(dtype, shape):
+    # fixed-size header, so it can be written after the data once the row count is known
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': tuple(shape)})
+    body = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(body)) + body.encode('latin1')
+
+
+class _NpyAppender:
+    """Appends rows to a ``.npy`` file whose header is written on close."""
+
+    def __init__(self, path, dtype, row_shape=()):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(b'\0' * NPY_HEADER_SIZE)
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        if values.shape[1:] != self.row_shape:
+            raise ArtifactError(f"{self.path}: rows of shape {values.shape[1:]}, expected {self.row_shape}")
+        self._file.write(values.tobytes())
+        self.rows += values.shape[0]
+
+    def view(self):
+        """Read-only memmap of the rows written so far."""
+        self._file.flush()
+        if self.rows == 0:
+            return np.empty((0,) + self.row_shape, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode='r', offset=NPY_HEADER_SIZE,
+                         shape=(self.rows,) + self.row_shape)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, (self.rows,) + self.row_shape))
+        self._file.close()
+
+
+class _StringAppender:
+    """Appends strings to a utf-8 blob plus an int64 offsets ``.npy``."""
+
+    def __init__(self, columns_dir, name):
+        self._data = open(os.path.join(columns_dir, f'{name}.bin'), 'wb')
+        self._offsets = _NpyAppender(os.path.join(columns_dir, f'{name}.offsets.npy'), np.int64)
+        self._offsets.append([0])
+        self._end = 0
+
+    @property
+    def rows(self):
+        return self._offsets.rows - 1
+
+    def append(self, values):
+        encoded = [str(v).encode('utf-8') for v in values]
+        self._data.write(b''.join(encoded))
+        offsets = self._end + np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        self._offsets.append(offsets)
+        if len(offsets):
+            self._end = int(offsets[-1])
+
+    def close(self):
+        self._data.close()
+        self._offsets.close()
+
+
+def new_version():
+    # microseconds, so back-to-back (incremental) builds in the same second get distinct, still sortable names
+    now = time.time()
+    return time.strftime('%Y%m%d-%H%M%S', time.gmtime(now)) + f'-{int(now * 1e6) % 1000000:06d}'
+
+
+class CatalogWriter:
+    """
+    Writes a catalog version in chunks, so catalogs larger than RAM can be
+    built with constant memory. Rows go straight to disk; nothing becomes
+    visible until ``finish`` renames the version into place and makes it
+    current.
+    """
+
+    def __init__(self, root, model_name, dim, version=None):
+        self.root = root
+        self.model_name = model_name
+        self.dim = dim
+        self.version = version or new_version()
+        self.final_dir = os.path.join(root, self.version)
+        if os.path.exists(self.final_dir):
+            raise ArtifactError(f"Catalog version {self.version} already exists in {root}")
+
+        os.makedirs(root, exist_ok=True)
+        self.tmp_dir = os.path.join(root, f'.tmp-{self.version}')
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        self.columns_dir = os.path.join(self.tmp_dir, COLUMNS_DIR)
+        os.makedirs(self.columns_dir)
+
+        self._embeddings = _NpyAppender(os.path.join(self.tmp_dir, EMBEDDINGS_NAME), np.float32, (dim,))
+        self._columns = {}
+        self._column_specs = {}
+        self._arrays = {}
+
+    @property
+    def rows(self):
+        return self._embeddings.rows
+
+    def embeddings(self):
+        """Memmap of the embeddings written so far (e.g. to train indexes on)."""
+        return self._embeddings.view()
+
+    def column(self, name):
+        """Memmap of a numeric column written so far."""
+        return self._columns[name].view()
+
+    def array(self, name, dtype, row_shape=()):
+        """
+        Appender (``append(rows)``) for an auxiliary array that is written
+        chunk by chunk instead of being passed to ``finish`` in one piece.
+        """
+        arrays_dir = os.path.join(self.tmp_dir, ARRAYS_DIR)
+        os.makedirs(arrays_dir, exist_ok=True)
+        self._arrays[name] = _NpyAppender(os.path.join(arrays_dir, f'{name}.npy'), dtype, row_shape)
+        return self._arrays[name]
+
+    def append(self, embeddings, columns, normalized=False):
+        """
+        Appends a chunk of rows. ``columns`` maps a column name to a sequence of
+        values; numpy arrays with a numeric dtype become ``.npy`` columns,
+        anything else a string column. ``normalized=True`` stores float32
+        unit-length embeddings as given, so rows copied from an earlier
+        version stay bit-identical.
+        """
+        if normalized:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        else:
+            embeddings = normalize_rows(embeddings)
+        rows = embeddings.shape[0]
+
+        if self.rows and set(columns) != set(self._columns):
+            raise ArtifactError(f"Chunk columns {sorted(columns)} differ from {sorted(self._columns)}")
+        for name, values in columns.items():
+            if len(values) != rows:
+                raise ArtifactError(f"Column '{name}' has {len(values)} rows, expected {rows}")
+            if name not in self._columns:
+                if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+                    path = os.path.join(self.columns_dir, f'{name}.npy')
+                    self._columns[name] = _NpyAppender(path, values.dtype)
+                    self._column_specs[name] = {'kind': 'numeric', 'dtype': values.dtype.str}
+                else:
+                    self._columns[name] = _StringAppender(self.columns_dir, name)
+                    self._column_specs[name] = {'kind': 'string'}
+            self._columns[name].append(values)
+
+        self._embeddings.append(embeddings)
+
+    def finish(self, arrays=None, metadata=None):
+        """
+        Writes auxiliary ``arrays`` (any shape) and the manifest (with the
+        JSON-serialisable ``metadata``), then publishes the version.
+        Returns the path of the version directory.
+        """
+        for column in self._columns.values():
+            column.close()
+        self._embeddings.close()
+
+        array_specs = {}
+        for name, appender in self._arrays.items():
+            appender.close()
+            array_specs[name] = {'dtype': appender.dtype.str, 'shape': [appender.rows, *appender.row_shape]}
+        if arrays:
+            arrays_dir = os.path.join(self.tmp_dir, ARRAYS_DIR)
+            os.makedirs(arrays_dir, exist_ok=True)
+            for name, values in arrays.items():
+                values = np.ascontiguousarray(values)
+                np.save(os.path.join(arrays_dir, f'{name}.npy'), values)
+                array_specs[name] = {'dtype': values.dtype.str, 'shape': list(values.shape)}
+
+        emb_path = os.path.join(self.tmp_dir, EMBEDDINGS_NAME)
+        manifest = {
+            'format': FORMAT_VERSION,
+            'version': self.version,
+            'model_name': self.model_name,
+            'dim': int(self.dim),
+            'rows': int(self.rows),
+            'normalized': True,
+            'embeddings': {'file': EMBEDDINGS_NAME, 'dtype': 'float32', 'sha256': file_sha256(emb_path)},
+            'columns': self._column_specs,
+            'arrays': array_specs,
+            'metadata': metadata or {},
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
+        with open(os.path.join(self.tmp_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        os.rename(self.tmp_dir, self.final_dir)
+        set_current_version(self.root, self.version)
+        return self.final_dir
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def write_catalog(root, embeddings, columns, model_name, version=None, arrays=None, metadata=None,
+                  normalized=False):
+    """
+    Writes a whole catalog version in one go (see ``CatalogWriter``) and
+    makes it current. Returns the path of the written version directory.
+    """
+    writer = CatalogWriter(root, model_name, np.shape(embeddings)[1], version)
+    try:
+        writer.append(embeddings, columns, normalized=normalized)
+        return writer.finish(arrays, metadata)
+    except Exception:
+        writer.abort()
+        raise
+
+
+def set_current_version(root, version):
+    tmp_path = os.path.join(root, f'.{CURRENT_NAME}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version + '\n')
+    os.replace(tmp_path, os.path.join(root, CURRENT_NAME))
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, CURRENT_NAME)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise ArtifactError(f"No catalog found in {root}. Run 'python scripts/build_sbert_model.py' first.")
+
+
+def list_versions(root):
+    """Versions under ``root`` that have a manifest, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, MANIFEST_NAME))
+    )
+
+
+class Catalog:
+    """A loaded catalog version: manifest, mmapped embeddings and metadata columns."""
+
+    def __init__(self, path, manifest, embeddings, columns, arrays):
+        self.path = path
+        self.manifest = manifest
+        self.embeddings = embeddings
+        self.columns = columns
+        self.arrays = arrays
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def model_name(self):
+        return self.manifest['model_name']
+
+    @property
+    def metadata(self):
+        return self.manifest.get('metadata', {})
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+
+def _map_bytes(path):
+    # np.memmap refuses empty files
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def load_catalog(root, version=None, verify=False):
+    """
+    Opens a catalog version (the current one by default) without copying it
+    into process memory. ``verify`` re-hashes the embedding file against the
+    manifest, which reads the whole file and is meant for offline checks.
+    """
+    version = version or current_version(root)
+    path = os.path.join(root, version)
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise ArtifactError(f"Catalog version {version} has no manifest at {manifest_path}")
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ArtifactError(f"Unsupported catalog format {manifest.get('format')} (expected {FORMAT_VERSION})")
+
+    emb_path = os.path.join(path, manifest['embeddings']['file'])
+    if verify and file_sha256(emb_path) != manifest['embeddings']['sha256']:
+        raise ArtifactError(f"Checksum mismatch for {emb_path}")
+
+    embeddings = np.load(emb_path, mmap_mode='r')
+    if embeddings.shape != (manifest['rows'], manifest['dim']):
+        raise ArtifactError(f"Embeddings shape {embeddings.shape} does not match manifest")
+
+    columns_dir = os.path.join(path, COLUMNS_DIR)
+    columns = {}
+    for name, spec in manifest['columns'].items():
+        if spec['kind'] == 'string':
+            data = _map_bytes(os.path.join(columns_dir, f'{name}.bin'))
+            offsets = np.load(os.path.join(columns_dir, f'{name}.offsets.npy'), mmap_mode='r')
+            columns[name] = StringColumn(data, offsets)
+        else:
+            columns[name] = np.load(os.path.join(columns_dir, f'{name}.npy'), mmap_mode='r')
+
+    arrays_dir = os.path.join(path, ARRAYS_DIR)
+    arrays = {
+        name: np.load(os.path.join(arrays_dir, f'{name}.npy'), mmap_mode='r')
+        for name in manifest.get('arrays', {})
+    }
+
+    return Catalog(path, manifest, embeddings, columns, arrays)
@@ -0,0 +1,122 @@
+"""
+Dynamic micro-batching in front of the sentence encoder.
+
+Concurrent requests would otherwise each call ``model.encode`` with a batch of
+one. ``MicroBatchEncoder`` queues their texts, waits up to ``max_wait_ms`` after
+the first arrival (or until ``max_batch_size`` texts are queued), encodes them
+in one call on a single worker thread and hands each caller its rows back.
+It exposes the same ``encode(texts)`` method as ``SentenceTransformer``.
+``close`` stops the worker thread (e.g. when a catalog reload swapped in
+another encoder); calls after that encode inline, without batching.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .metrics import Histogram
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128]
+WAIT_SECONDS_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+# queued by close() after the pending texts
+_STOP = object()
+
+
+class MicroBatchEncoder:
+
+    def __init__(self, model, max_wait_ms=3, max_batch_size=32):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.wait_seconds = Histogram(WAIT_SECONDS_BUCKETS)
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='micro-batch-encoder', daemon=True)
+        self._thread.start()
+
+    def encode(self, texts):
+        """Blocks until the texts have been encoded as part of some batch."""
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        texts = list(texts)
+        if not texts:
+            return self.model.encode(texts)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return np.asarray(self.model.encode(texts))
+            self._queue.put((texts, future, time.perf_counter()))
+        return future.result()
+
+    def close(self, timeout=5):
+        """Encodes what is already queued, then stops the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _collect(self):
+        """(batch, stop): the next batch of queued requests, and whether close() was called."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        size = len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            self.queue_depth.observe(self._queue.qsize())
+            texts = [text for item in batch for text in item[0]]
+            self.batch_size.observe(len(texts))
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.wait_seconds.observe(started - enqueued)
+
+            try:
+                embeddings = np.asarray(self.model.encode(texts))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for item_texts, future, _ in batch:
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_wait_ms': self.max_wait * 1000,
+            'max_batch_size': self.max_batch_size,
+            'batch_size_histogram': self.batch_size.to_dict(),
+            'queue_depth_histogram': self.queue_depth.to_dict(),
+            'wait_seconds_histogram': self.wait_seconds.to_dict(),
+        }
@@ -0,0 +1,197 @@
+"""
+Build-time helpers shared by scripts/build_sbert_model.py.
+
+Kept free of Django (and of torch) so they can be imported from scripts.
+"""
+import hashlib
+import json
+import time
+from ast import literal_eval
+from collections import OrderedDict
+
+import numpy as np
+
+from .engine import normalize_rows
+
+CSV_COLUMNS = ['id', 'title', 'genres', 'overview', 'keywords', 'release_date', 'vote_average', 'runtime']
+
+
+def parse_json_col(x):
+    """'[{"id": 28, "name": "Action"}, ...]' -> 'Action ...'"""
+    if not isinstance(x, str):
+        return ""
+    try:
+        # TMDB columns are valid JSON; literal_eval is only the slow fallback
+        items = json.loads(x)
+    except ValueError:
+        try:
+            items = literal_eval(x)
+        except (ValueError, SyntaxError):
+            return str(x)
+    if not isinstance(items, list):
+        return ""
+    try:
+        return " ".join([i['name'] for i in items])
+    except (TypeError, KeyError):
+        # items that are not {"name": ...} objects: keep the raw value, like the old bare except did
+        return str(x)
+
+
+def semantic_text(title, genres_str, overview):
+    #  "Rich Context String", that the transformer reads
+    return f"Title: {title}. Genre: {genres_str}. Plot: {overview}"
+
+
+def _text(values):
+    return ['' if not isinstance(v, str) else v for v in values]
+
+
+def parse_year(release_date):
+    # "2009-12-10" -> 2009, unknown -> 0
+    head = release_date.split("-")[0] if "-" in release_date else ""
+    return int(head) if head.isdigit() else 0
+
+
+def payload_fragment(movie_id, title, overview, genres, year, rating, runtime):
+    """
+    The movie's recommend response object, pre-serialised without its closing
+    brace so the API only has to append the per-request score.
+    """
+    item = {
+        "id": int(movie_id),
+        "title": title,
+        "overview": overview,
+        "genres": genres,
+        "year": str(year) if year else "N/A",
+        "rating": round(float(rating), 2),
+        "runtime": int(runtime),
+    }
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':'))[:-1]
+
+
+def prepare_records(records, model_name):
+    """
+    Turns raw CSV columns (a dict of lists) into typed catalog columns, the
+    pre-serialised response fragment, semantic text and content hash of
+    every row. Runs in pool workers.
+    """
+    title = _text(records['title'])
+    overview = _text(records['overview'])
+    genres_str = [parse_json_col(v) for v in records['genres']]
+    texts = [semantic_text(t, g, o) for t, g, o in zip(records['title'], genres_str, overview)]
+
+    ids = np.asarray(records['id'], dtype=np.int32)
+    year = np.array([parse_year(d) for d in _text(records['release_date'])], dtype=np.int16)
+    rating = np.nan_to_num(np.asarray(records['vote_average'], dtype=np.float32))
+    runtime = np.clip(np.nan_to_num(np.asarray(records['runtime'], dtype=np.float64)), 0, 32767).astype(np.int16)
+
+    return {
+        'id': ids,
+        'title': title,
+        'overview': overview,
+        'genres_str': genres_str,
+        'keywords_str': [parse_json_col(v) for v in records['keywords']],
+        'year': year,
+        'rating': rating,
+        'runtime': runtime,
+        'payload_json': [
+            payload_fragment(*row) for row in zip(ids, title, overview, genres_str, year, rating, runtime)
+        ],
+        'content_hash': content_hashes(texts, model_name),
+        'semantic_text': texts,
+    }
+
+
+class Interner:
+    """Maps repeated strings to small integer ids (e.g. a movie's genre string)."""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def __call__(self, values):
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = self.ids.get(value)
+            if code is None:
+                code = self.ids[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+
+class StageTimer:
+    """Accumulates wall time and row counts per build stage."""
+
+    def __init__(self):
+        self.seconds = OrderedDict()
+        self.rows = OrderedDict()
+
+    def add(self, stage, seconds, rows):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+        self.rows[stage] = self.rows.get(stage, 0) + rows
+
+    def time(self, stage, rows, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.add(stage, time.perf_counter() - start, rows)
+        return result
+
+    def report(self):
+        lines = []
+        for stage, seconds in self.seconds.items():
+            rate = self.rows[stage] / seconds if seconds else float('inf')
+            lines.append(f"   {stage:<10} {self.rows[stage]:>10} rows  {seconds:8.2f}s  {rate:12.0f} rows/s")
+        return "\n".join(lines)
+
+
+def content_hash(text, model_name):
+    """64-bit hash of everything that determines a movie's embedding."""
+    digest = hashlib.blake2b(f"{model_name}\x00{text}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def content_hashes(texts, model_name):
+    return np.fromiter((content_hash(t, model_name) for t in texts), dtype=np.uint64, count=len(texts))
+
+
+class IncrementalPlan:
+    """
+    Matches new rows against a previous catalog by movie id and content hash,
+    so unchanged movies can reuse their embedding instead of being encoded.
+    Ids missing from the new data are simply not carried over.
+    """
+
+    def __init__(self, previous):
+        self.previous = previous
+        self.old_rows = {}
+        if previous is not None and 'content_hash' in previous:
+            self.old_rows = {int(movie_id): row for row, movie_id in enumerate(previous['id'])}
+
+    def plan(self, ids, hashes):
+        """
+        (reuse_from, encode_rows): ``reuse_from[i]`` is the previous row whose
+        embedding row i can reuse, or -1; ``encode_rows`` lists the -1 rows.
+        """
+        reuse_from = np.full(len(ids), -1, dtype=np.int64)
+        if self.old_rows:
+            old_hashes = self.previous['content_hash']
+            for row, (movie_id, h) in enumerate(zip(ids, hashes)):
+                old_row = self.old_rows.get(int(movie_id))
+                if old_row is not None and old_hashes[old_row] == h:
+                    reuse_from[row] = old_row
+        return reuse_from, np.flatnonzero(reuse_from < 0)
+
+
+def assemble_embeddings(previous, reuse_from, encode_rows, encoded, dim):
+    """
+    Normalised float32 matrix for the new catalog: reused rows are copied
+    bit-for-bit from the previous catalog, the rest come from ``encoded``.
+    """
+    embeddings = np.empty((len(reuse_from), dim), dtype=np.float32)
+    reused = np.flatnonzero(reuse_from >= 0)
+    if reused.size:
+        embeddings[reused] = previous.embeddings[reuse_from[reused]]
+    if len(encode_rows):
+        embeddings[encode_rows] = normalize_rows(encoded)
+    return embeddings
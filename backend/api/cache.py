@@ -0,0 +1,331 @@
+"""
+Bounded caches for query embeddings and ranked results.
+
+``LRUCache`` lives inside one process; ``TTLCache`` adds a size cap and idle
+expiry for the paging cursors; ``SQLiteCache`` is a small file-backed store
+that every worker on the host can share. ``QueryEmbeddingCache`` puts the
+LRU and sqlite caches together so a repeated wizard selection never reaches
+the encoder.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    return " ".join(str(text).lower().split())
+
+
+class LRUCache:
+    """Thread-safe in-process cache that evicts the least recently used entry."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache bounded by entries, by total size and by
+    idle time: an entry not read or written for ``ttl`` seconds expires.
+    ``set`` takes the entry's size in bytes; least recently used entries are
+    evicted until both caps hold again. Since every access refreshes an entry,
+    recency order is also expiry order and expired entries are purged from
+    the old end on each write.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024, ttl=600, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._clock = clock
+        # key -> (last used, size, value)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _drop(self, key):
+        self.bytes -= self._data.pop(key)[1]
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data[key] = (now, entry[1], entry[2])
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, size=0):
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        now = self._clock()
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (now, size, value)
+            self.bytes += size
+            while self._data:
+                oldest_key, (last_used, _, _) = next(iter(self._data.items()))
+                if now - last_used > self.ttl:
+                    self.expirations += 1
+                elif len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                    self.evictions += 1
+                else:
+                    break
+                self._drop(oldest_key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    Byte-value cache in a sqlite file, shared by every process that opens it.
+
+    Entries carry a last-used timestamp; when the table grows past
+    ``max_entries`` the oldest ones are deleted. Reads stay read-only: the
+    timestamps of hit keys are buffered and written in one transaction every
+    ``touch_batch`` hits (or ``touch_seconds``), and the size is only checked
+    every ``evict_every`` writes of this process, so the table can run that
+    far over ``max_entries`` in between. Counters are per process.
+    """
+
+    def __init__(self, path, max_entries=10000, touch_batch=64, touch_seconds=5.0, evict_every=None):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.touch_seconds = touch_seconds
+        self.evict_every = evict_every or max(1, max_entries // 100)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # key -> last used, not yet written
+        self._touched = {}
+        self._touched_since = 0.0
+        self._writes = 0
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._connect().execute('CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def _touch(self, key):
+        now = time.time()
+        with self._lock:
+            if not self._touched:
+                self._touched_since = now
+            self._touched[key] = now
+            if len(self._touched) < self.touch_batch and now - self._touched_since < self.touch_seconds:
+                return
+        self.flush()
+
+    def flush(self):
+        """Writes the buffered last-used timestamps."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        conn = self._connect()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany('UPDATE cache SET last_used = ? WHERE key = ?', [(t, k) for k, t in touched.items()])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def get(self, key, default=None):
+        row = self._connect().execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self._touch(key)
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, last_used) VALUES (?, ?, ?)', (key, value, time.time()))
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries beyond ``max_entries``."""
+        self.flush()
+        conn = self._connect()
+        overflow = conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used LIMIT ?)', (overflow,)
+            )
+            self.evictions += overflow
+
+    def clear(self):
+        with self._lock:
+            self._touched = {}
+        self._connect().execute('DELETE FROM cache')
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class QueryEmbeddingCache:
+    """
+    Query text -> embedding, keyed on the normalised text, the catalog
+    version and the encoder (backend and model), so neither a rebuilt catalog
+    nor a worker with another RECOMMENDER_ENCODER reads vectors it did not
+    encode from the shared cache.
+
+    Lookups hit the in-process LRU first and fall back to the optional shared
+    backend; shared hits are promoted into the local LRU.
+    """
+
+    def __init__(self, version, max_entries=1024, shared=None, encoder=''):
+        self.version = version
+        self.encoder = encoder
+        self.local = LRUCache(max_entries)
+        self.shared = shared
+
+    def key(self, query):
+        raw = f"{self.version}\x00{self.encoder}\x00{normalize_query(query)}".encode('utf-8')
+        return hashlib.sha1(raw).hexdigest()
+
+    def get(self, query):
+        key = self.key(query)
+        embedding = self.local.get(key)
+        if embedding is not None or self.shared is None:
+            return embedding
+
+        blob = self.shared.get(key)
+        if blob is None:
+            return None
+        embedding = np.frombuffer(blob, dtype=np.float32)
+        self.local.set(key, embedding)
+        return embedding
+
+    def set(self, query, embedding):
+        key = self.key(query)
+        embedding = np.array(embedding, dtype=np.float32).reshape(-1)
+        embedding.flags.writeable = False
+        self.local.set(key, embedding)
+        if self.shared is not None:
+            self.shared.set(key, embedding.tobytes())
+        return embedding
+
+    def get_or_encode(self, query, encode):
+        """Cached embedding for ``query``; ``encode(query)`` is only called on a miss."""
+        embedding = self.get(query)
+        if embedding is None:
+            embedding = self.set(query, encode(query))
+        return embedding
+
+    def stats(self):
+        stats = {'local': self.local.stats()}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
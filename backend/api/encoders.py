@@ -0,0 +1,251 @@
+"""
+Sentence encoders the API can load, selected with RECOMMENDER_ENCODER.
+
+All backends expose ``encode(sentences, batch_size=..., ...)`` returning a
+float32 array and ``get_sentence_embedding_dimension()``, like
+``SentenceTransformer``, and are created with ``cls.load(model_name, ...)``.
+
+- 'sbert': the catalog's SentenceTransformer model in fp32 on the CPU.
+- 'torch-int8': the same model with its Linear layers dynamically quantized
+  to int8 (no export needed).
+- 'onnx' / 'onnx-int8': the transformer exported to ONNX (see
+  ``export_onnx``, run by ``build_sbert_model.py --export-onnx``), run by
+  ONNX Runtime with mean pooling and normalisation done in numpy.
+- 'hash': a deterministic bag-of-words stand-in: every token maps to a fixed
+  random vector seeded from its hash, so it needs no download and no torch
+  and gives identical vectors in every process. It is meant for benchmarks
+  and offline development, not for real recommendations.
+
+``threads`` caps the intra-op threads of torch / ONNX Runtime (None keeps
+the library default, usually one per core).
+"""
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+HASH_MODEL_NAME = 'hash-bow'
+ONNX_CONFIG_NAME = 'encoder.json'
+
+_TOKEN = re.compile(r"\w+")
+
+
+class HashEncoder:
+
+    def __init__(self, model_name=HASH_MODEL_NAME, dim=384):
+        self.model_name = model_name
+        self.dim = dim
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, model_name, threads=None, export_dir=None):
+        return cls(model_name)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _token_vector(self, token):
+        vector = self._tokens.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            with self._lock:
+                self._tokens[token] = vector
+        return vector
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode([sentences])[0]
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for row, text in enumerate(sentences):
+            for token in _TOKEN.findall(text.lower()):
+                out[row] += self._token_vector(token)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+class TorchEncoder:
+    """SentenceTransformer on the CPU, optionally with int8 dynamic quantization."""
+
+    quantize = False
+
+    def __init__(self, model, model_name):
+        self.model = model
+        self.model_name = model_name
+
+    @classmethod
+    def load(cls, model_name, threads=None, export_dir=None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device='cpu')
+        model.eval()
+        if cls.quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return cls(model, model_name)
+
+    def get_sentence_embedding_dimension(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        import torch
+
+        with torch.inference_mode():
+            embeddings = self.model.encode(sentences, batch_size=batch_size,
+                                           show_progress_bar=show_progress_bar, convert_to_numpy=True, **kwargs)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class QuantizedTorchEncoder(TorchEncoder):
+    quantize = True
+
+
+def onnx_dir(export_dir, model_name):
+    return os.path.join(str(export_dir), model_name.replace('/', '__'))
+
+
+class OnnxEncoder:
+    """The exported transformer on ONNX Runtime; pooling and normalisation in numpy."""
+
+    model_file = 'model.onnx'
+
+    def __init__(self, session, tokenizer, config, model_name):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.config = config
+        self.model_name = model_name
+        self.input_names = [i.name for i in session.get_inputs()]
+
+    @classmethod
+    def load(cls, model_name, threads=None, export_dir=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = onnx_dir(export_dir, model_name)
+        model_path = os.path.join(path, cls.model_file)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found, run build_sbert_model.py --export-onnx first")
+        with open(os.path.join(path, ONNX_CONFIG_NAME)) as f:
+            config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        return cls(session, AutoTokenizer.from_pretrained(path), config, model_name)
+
+    def get_sentence_embedding_dimension(self):
+        return self.config['dim']
+
+    def _encode_batch(self, sentences):
+        tokens = self.tokenizer(sentences, padding=True, truncation=True,
+                                max_length=self.config['max_length'], return_tensors='np')
+        inputs = {name: tokens[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(None, inputs)[0]
+        # mean pooling over the real (unpadded) tokens
+        mask = tokens['attention_mask'][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config['normalize']:
+            pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        if isinstance(sentences, str):
+            return self.encode([sentences])[0]
+        sentences = list(sentences)
+        if not sentences:
+            return np.empty((0, self.config['dim']), dtype=np.float32)
+        return np.concatenate([
+            self._encode_batch(sentences[start:start + batch_size])
+            for start in range(0, len(sentences), batch_size)
+        ])
+
+
+class QuantizedOnnxEncoder(OnnxEncoder):
+    model_file = 'model_int8.onnx'
+
+
+def export_onnx(model_name, export_dir, quantize=True, opset=14):
+    """
+    Exports the SentenceTransformer's transformer to ONNX (plus an int8
+    dynamically quantized copy) with its tokenizer and pooling config.
+    Uses the locally cached model when HF_HUB_OFFLINE=1. Returns the directory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    st = SentenceTransformer(model_name, device='cpu')
+    pooling = [m for m in st if isinstance(m, Pooling)]
+    if pooling and not pooling[0].pooling_mode_mean_tokens:
+        raise ValueError(f"{model_name} does not use mean pooling, which the ONNX backend implements")
+
+    path = onnx_dir(export_dir, model_name)
+    os.makedirs(path, exist_ok=True)
+    transformer = st[0].auto_model.eval()
+    sample = st.tokenizer(["A Action movie. Mood: dark. About: heist."], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs)))[0]
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['last_hidden_state']}
+    with torch.inference_mode():
+        torch.onnx.export(
+            LastHiddenState(transformer), tuple(sample[name] for name in input_names),
+            os.path.join(path, OnnxEncoder.model_file),
+            input_names=input_names, output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes, opset_version=opset,
+        )
+    st.tokenizer.save_pretrained(path)
+    with open(os.path.join(path, ONNX_CONFIG_NAME), 'w') as f:
+        json.dump({
+            'model_name': model_name,
+            'dim': st.get_sentence_embedding_dimension(),
+            'max_length': st.max_seq_length,
+            'normalize': any(isinstance(m, Normalize) for m in st),
+        }, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(os.path.join(path, OnnxEncoder.model_file),
+                         os.path.join(path, QuantizedOnnxEncoder.model_file), weight_type=QuantType.QInt8)
+    return path
+
+
+# name -> (class, modules its backend needs)
+ENCODERS = {
+    'sbert': (TorchEncoder, ('torch', 'sentence_transformers')),
+    'torch-int8': (QuantizedTorchEncoder, ('torch', 'sentence_transformers')),
+    'onnx': (OnnxEncoder, ('onnxruntime', 'transformers')),
+    'onnx-int8': (QuantizedOnnxEncoder, ('onnxruntime', 'transformers')),
+    'hash': (HashEncoder, ()),
+}
+
+
+def encoder_class(name):
+    """The encoder class for a RECOMMENDER_ENCODER name, with its backend imported."""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{name}' (expected one of {', '.join(sorted(ENCODERS))})")
+    cls, modules = ENCODERS[name]
+    for module in modules:
+        importlib.import_module(module)
+    return cls
+
+
+def load_encoder(name, model_name, threads=None, export_dir=None):
+    return encoder_class(name).load(model_name, threads=threads, export_dir=export_dir)
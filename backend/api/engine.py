@@ -0,0 +1,130 @@
+import time
+
+import numpy as np
+
+# subsets larger than this fraction of the catalog are cheaper to score with a
+# full scan (keeping only their scores) than by gathering their rows
+FULL_SCAN_RATIO = 0.15
+
+
+def normalize_rows(matrix):
+    # L2-normalise in float32; zero rows stay zero instead of turning into NaN
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_rows(scores, k):
+    """Row-wise top k of a 2D score matrix: (indices, scores), each (rows, k), best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    if k < scores.shape[1]:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind='stable')
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(candidate_scores, order, axis=1)
+
+
+def top_k(scores, k):
+    """Indices and scores of the k best entries of a 1D score array, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if k < scores.shape[0]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[0])
+
+    order = np.argsort(-scores[candidates], kind='stable')
+    indices = candidates[order]
+    return indices, scores[indices]
+
+
+class RetrievalEngine:
+    """
+    Exact cosine-similarity search over the movie embeddings.
+
+    The catalog is normalised once when the engine is built, so scoring a query
+    is a single matrix-vector product followed by a partial top-k selection.
+    Pass ``normalized=True`` for matrices that are already unit-length float32
+    (e.g. a memory-mapped catalog); those are used as-is, without a copy.
+    """
+
+    def __init__(self, embeddings, normalized=False):
+        if normalized:
+            self.embeddings = embeddings
+        else:
+            self.embeddings = normalize_rows(embeddings)
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    def score(self, query_embedding):
+        query = normalize_rows(np.reshape(query_embedding, (-1,)))
+        return self.embeddings @ query
+
+    def search(self, query_embedding, k=6):
+        """Returns (indices, scores) of the k most similar movies."""
+        return top_k(self.score(query_embedding), k)
+
+    def search_batch(self, query_embeddings, k=6, timings=None):
+        """Scores many queries with one matrix-matrix product; row i belongs to query i."""
+        start = time.perf_counter()
+        queries = normalize_rows(np.reshape(query_embeddings, (-1, self.dim)))
+        scores = queries @ self.embeddings.T
+        if timings is not None:
+            start = timings.since('similarity', start)
+        result = top_k_rows(scores, k)
+        if timings is not None:
+            timings.since('topk', start)
+        return result
+
+    def search_excluding(self, query_embeddings, excluded, k=6, rows=None, timings=None):
+        """
+        Like ``search_batch`` (or ``search_rows`` when ``rows`` is given), but
+        rows set in the packed bitset ``excluded`` are masked out before the
+        top k. Masked rows come back with a score of -inf when fewer than k
+        rows are left.
+        """
+        mask = np.unpackbits(excluded, count=len(self)).view(bool)
+        if rows is not None:
+            return self.search_rows(query_embeddings, rows[~mask[rows]], k, timings=timings)
+        start = time.perf_counter()
+        queries = normalize_rows(np.reshape(query_embeddings, (-1, self.dim)))
+        scores = queries @ self.embeddings.T
+        scores[:, mask] = -np.inf
+        if timings is not None:
+            start = timings.since('similarity', start)
+        result = top_k_rows(scores, k)
+        if timings is not None:
+            timings.since('topk', start)
+        return result
+
+    def search_rows(self, query_embeddings, rows, k=6, timings=None):
+        """Like ``search_batch``, but only over the given sorted row ids (e.g. a filter result)."""
+        start = time.perf_counter()
+        queries = normalize_rows(np.reshape(query_embeddings, (-1, self.dim)))
+        if rows.size > FULL_SCAN_RATIO * len(self):
+            scores = (queries @ self.embeddings.T)[:, rows]
+        else:
+            scores = queries @ np.asarray(self.embeddings[rows], dtype=np.float32).T
+        if timings is not None:
+            start = timings.since('similarity', start)
+        positions, top_scores = top_k_rows(scores, k)
+        result = rows[positions], top_scores
+        if timings is not None:
+            timings.since('topk', start)
+        return result
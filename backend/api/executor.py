@@ -0,0 +1,77 @@
+"""
+Bounded thread pool for the CPU-bound part of the async views.
+
+Under ASGI the event loop must never encode or score itself, or every other
+request (options, health checks) waits behind it. The async views hand that
+work to this pool instead. It runs at most ``workers`` jobs and queues at
+most ``max_queue`` more; past that ``run`` raises ``Overloaded`` right away
+and the view answers 503, so a burst is shed instead of piling up latency.
+
+Threads rather than processes: the model and catalog live in this process,
+and torch / numpy release the GIL inside the heavy calls.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .threads import get_budget
+
+
+class Overloaded(Exception):
+    pass
+
+
+class BoundedExecutor:
+
+    def __init__(self, workers=None, max_queue=64):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='recommend')
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return max(self.pending - self.workers, 0)
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the pool and awaits its result."""
+        with self._lock:
+            if self.pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded()
+            self.pending += 1
+        # counted down when the job finishes, even if the request was cancelled
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'pending': self.pending,
+            'queued': self.queued,
+            'rejected': self.rejected,
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BoundedExecutor(get_budget().executor, settings.RECOMMENDER_EXECUTOR_QUEUE)
+    return _executor
@@ -0,0 +1,149 @@
+"""
+Structured filters for the recommend API ("Comedy from the 90s, under 2
+hours, rated above 7").
+
+``FilterIndex`` is built with the catalog. It stores one packed bitset of
+rows per genre, and the row ids of every range column sorted by value, so a
+range is two ``searchsorted`` calls and a slice. ``rows(filters)`` ANDs
+everything into the sorted ids of the rows that survive; the engine then
+scores only those rows.
+"""
+import re
+from collections import namedtuple
+
+import numpy as np
+
+from .cache import LRUCache
+from .vocabulary import GENRES
+
+RANGE_COLUMNS = ('year', 'runtime', 'rating')
+# 0 means "unknown" for these, so any range on them excludes it
+UNKNOWN_IS_ZERO = ('year', 'runtime')
+
+Filters = namedtuple('Filters', ['genres', 'year', 'runtime', 'rating'])
+
+
+def _bound(data, name):
+    value = data.get(name)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"'filters.{name}' must be a number.")
+    return value
+
+
+def parse_filters(data):
+    """
+    Filters from a request's ``filters`` object, or None when it is empty:
+    {"genres": ["Comedy"], "year_min": 1990, "year_max": 1999,
+     "runtime_max": 120, "rating_min": 7}. Bounds are inclusive.
+    """
+    if data is None:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError("'filters' must be a JSON object.")
+    unknown = set(data) - {'genres'} - {f'{c}_{end}' for c in RANGE_COLUMNS for end in ('min', 'max')}
+    if unknown:
+        raise ValueError(f"Unknown filter '{sorted(unknown)[0]}'.")
+
+    genres = data.get('genres') or []
+    if isinstance(genres, str):
+        genres = [genres]
+    if not isinstance(genres, list) or any(g not in GENRES for g in genres):
+        raise ValueError(f"'filters.genres' must be a list of: {', '.join(GENRES)}.")
+
+    ranges = {}
+    for column in RANGE_COLUMNS:
+        low, high = _bound(data, f'{column}_min'), _bound(data, f'{column}_max')
+        ranges[column] = None if low is None and high is None else (low, high)
+
+    filters = Filters(tuple(sorted(set(genres))), **ranges)
+    if not filters.genres and all(ranges[c] is None for c in RANGE_COLUMNS):
+        return None
+    return filters
+
+
+def genre_membership(genre_strings):
+    """(len(genre_strings), len(GENRES)) bool matrix: which genres each interned string names."""
+    patterns = [re.compile(r'(?<!\w)' + re.escape(g) + r'(?!\w)') for g in GENRES]
+    membership = [[bool(p.search(s)) for p in patterns] for s in genre_strings]
+    return np.array(membership, dtype=bool).reshape(-1, len(GENRES))
+
+
+class FilterIndex:
+
+    def __init__(self, rows, genre_bits, orders, sorted_values, cache_size=128):
+        self.n_rows = rows
+        self.genre_bits = genre_bits
+        self.orders = orders
+        self.sorted_values = sorted_values
+        self._cache = LRUCache(cache_size)
+
+    @classmethod
+    def build(cls, genre_ids, genre_strings, year, runtime, rating):
+        membership = genre_membership(genre_strings)[np.asarray(genre_ids)]
+        genre_bits = np.packbits(membership.T, axis=1)
+        orders, sorted_values = {}, {}
+        for column, values in zip(RANGE_COLUMNS, (year, runtime, rating)):
+            values = np.asarray(values)
+            order = np.argsort(values, kind='stable').astype(np.int32)
+            orders[column] = order
+            sorted_values[column] = values[order]
+        return cls(len(genre_ids), genre_bits, orders, sorted_values)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """The catalog's filter index; rebuilt from its columns when it was stored without one."""
+        arrays = catalog.arrays
+        if 'filter_genres' in arrays and all(f'{c}_order' in arrays for c in RANGE_COLUMNS):
+            return cls(
+                len(catalog),
+                arrays['filter_genres'],
+                {c: arrays[f'{c}_order'] for c in RANGE_COLUMNS},
+                {c: arrays[f'{c}_sorted'] for c in RANGE_COLUMNS},
+            )
+        print(" Catalog has no filter index, building it from the columns.")
+        return cls.build(catalog['genre_id'], catalog.metadata['genres'],
+                         catalog['year'], catalog['runtime'], catalog['rating'])
+
+    def to_arrays(self):
+        arrays = {'filter_genres': self.genre_bits}
+        for column in RANGE_COLUMNS:
+            arrays[f'{column}_order'] = self.orders[column]
+            arrays[f'{column}_sorted'] = self.sorted_values[column]
+        return arrays
+
+    def _range_mask(self, column, low, high):
+        values = self.sorted_values[column]
+        if column in UNKNOWN_IS_ZERO:
+            low = max(low, 1) if low is not None else 1
+        if values.dtype.kind == 'f':
+            # compare in the column's precision: float64(7.2) > float32(7.2), which dropped the bound itself
+            low = None if low is None else values.dtype.type(low)
+            high = None if high is None else values.dtype.type(high)
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right')
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.orders[column][start:end]] = True
+        return mask
+
+    def rows(self, filters):
+        """Sorted int64 ids of the rows matching every filter."""
+        cached = self._cache.get(filters)
+        if cached is not None:
+            return cached
+
+        mask = None
+        for genre in filters.genres:
+            bits = np.unpackbits(self.genre_bits[GENRES.index(genre)], count=self.n_rows).view(bool)
+            mask = bits if mask is None else mask & bits
+        for column in RANGE_COLUMNS:
+            bounds = getattr(filters, column)
+            if bounds is not None:
+                selected = self._range_mask(column, *bounds)
+                mask = selected if mask is None else mask & selected
+
+        rows = np.flatnonzero(mask)
+        rows.flags.writeable = False
+        self._cache.set(filters, rows)
+        return rows
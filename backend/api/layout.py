@@ -0,0 +1,200 @@
+"""
+2D map of the whole catalog, computed once at build time.
+
+t-SNE on a million rows is out of the question, so ``catalog_map`` lays the
+catalog out in two levels:
+
+1. spherical k-means (the IVF trainer, on a sample) splits the embeddings
+   into clusters; the cluster centres are placed by a PCA of the centroids
+   and drawn as discs sized by membership, pushed apart until they no longer
+   overlap;
+2. inside each disc its members are placed by a PCA of their offsets from
+   the centroid.
+
+Both steps are linear in the rows. Coordinates are quantised to a 65536 x
+65536 grid (uint16) and the points are stored in Morton (Z-order) order of
+their coordinates, so every square tile of the map at any zoom level is one
+contiguous slice of the arrays, found with a binary search on ``map_codes``.
+``CatalogMap`` serves those slices as little-endian binary tiles.
+"""
+import struct
+
+import numpy as np
+
+from .ann import _assign, train_centroids
+
+ARRAY_NAMES = ('map_ids', 'map_xy', 'map_clusters', 'map_codes', 'map_centres', 'map_sizes')
+GRID = 65535
+MAX_ZOOM = 16
+# magic, points in this response, points in the tile before sampling
+TILE_HEADER = struct.Struct('<4sII')
+TILE_MAGIC = b'CMAP'
+
+
+def default_clusters(rows):
+    return int(np.clip(round(np.sqrt(rows) / 4), 1, 256))
+
+
+def _pca_2d(matrix, iterations=8, seed=0):
+    """
+    (coordinates, axes) of the rows of ``matrix`` (already centred) on its two
+    main axes, by subspace iteration: a few thin products instead of a full SVD.
+    """
+    if matrix.shape[0] < 2:
+        return np.zeros((matrix.shape[0], 2), dtype=np.float32), np.zeros((2, matrix.shape[1]), dtype=np.float32)
+    basis = np.random.default_rng(seed).standard_normal((matrix.shape[1], 2)).astype(matrix.dtype)
+    for _ in range(iterations):
+        basis, _ = np.linalg.qr(matrix.T @ (matrix @ basis))
+    axes = basis.T.astype(np.float32)
+    return matrix @ axes.T, axes
+
+
+def _place_clusters(centroids, sizes, iterations=200, seed=0):
+    """(centres, radii) of the cluster discs: PCA of the centroids, then overlaps pushed apart."""
+    rng = np.random.default_rng(seed)
+    centres, _ = _pca_2d(centroids - centroids.mean(axis=0))
+    centres = centres.astype(np.float64)
+    spread = centres.std() or 1.0
+    # coincident centroids would have no direction to be pushed in
+    centres = centres / spread + rng.normal(scale=1e-3, size=centres.shape)
+    # discs cover about half of a 4 x 4 square, by area proportional to membership
+    radii = np.sqrt(sizes / sizes.sum() * 8.0 / np.pi)
+
+    n = len(centres)
+    for _ in range(iterations if n > 1 else 0):
+        delta = centres[:, None] - centres[None]
+        distance = np.linalg.norm(delta, axis=2) + np.eye(n)
+        overlap = np.clip(radii[:, None] + radii[None] - distance, 0, None)
+        np.fill_diagonal(overlap, 0)
+        if overlap.max() < 1e-3 * radii.min():
+            break
+        centres += (delta / distance[..., None] * overlap[..., None]).sum(axis=1) / 2
+    return centres, radii
+
+
+def _local_layout(members, centroid, sample_size, rng):
+    """Member positions inside a unit disc: PCA of their offsets from the centroid."""
+    offsets = np.asarray(members, dtype=np.float32) - centroid
+    sample = offsets if len(offsets) <= sample_size else offsets[rng.choice(len(offsets), sample_size, replace=False)]
+    _, axes = _pca_2d(sample - sample.mean(axis=0))
+    coords = offsets @ axes.T
+    radius = np.percentile(np.linalg.norm(coords, axis=1), 95) if len(coords) else 0
+    return coords / radius if radius > 0 else coords
+
+
+def morton_codes(xy):
+    """Z-order codes (uint32) of uint16 (x, y) coordinates: x bits even, y bits odd."""
+    def spread(v):
+        v = v.astype(np.uint32)
+        v = (v | (v << 8)) & 0x00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F
+        v = (v | (v << 2)) & 0x33333333
+        return (v | (v << 1)) & 0x55555555
+    return spread(xy[..., 0]) | (spread(xy[..., 1]) << 1)
+
+
+def cluster_names(labels, genre_ids, genres, n_clusters):
+    """The most common main genre (first word of the genre string) of every cluster."""
+    mains = sorted({(g.split(' ')[0] if g else 'Unknown') for g in genres})
+    main_of = np.array([mains.index(g.split(' ')[0] if g else 'Unknown') for g in genres], dtype=np.int64)
+    pairs = labels.astype(np.int64) * len(mains) + main_of[genre_ids]
+    counts = np.bincount(pairs, minlength=n_clusters * len(mains)).reshape(n_clusters, len(mains))
+    return [mains[i] for i in counts.argmax(axis=1)]
+
+
+def catalog_map(embeddings, ids, n_clusters=None, iterations=10, sample_size=2000, seed=0):
+    """
+    (arrays, labels): the map arrays of a catalog, in Morton order, and the
+    cluster of every catalog row. ``embeddings`` must be unit length; ``ids``
+    are the movie ids of its rows.
+    """
+    rows = embeddings.shape[0]
+    n_clusters = min(n_clusters or default_clusters(rows), rows)
+    centroids = train_centroids(embeddings, n_clusters, iterations, seed=seed)
+    labels = _assign(embeddings, centroids)
+    sizes = np.bincount(labels, minlength=n_clusters)
+    centres, radii = _place_clusters(centroids, np.maximum(sizes, 1), seed=seed)
+
+    rng = np.random.default_rng(seed)
+    points = np.empty((rows, 2), dtype=np.float64)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    for cluster in range(n_clusters):
+        members = np.sort(order[offsets[cluster]:offsets[cluster + 1]])
+        if members.size:
+            local = _local_layout(embeddings[members], centroids[cluster], sample_size, rng)
+            points[members] = centres[cluster] + local * radii[cluster]
+
+    low, high = points.min(axis=0), points.max(axis=0)
+    scale = GRID / max(float((high - low).max()), 1e-9)
+    xy = np.clip(np.round((points - low) * scale), 0, GRID).astype(np.uint16)
+    codes = morton_codes(xy)
+    order = np.argsort(codes, kind='stable')
+    arrays = {
+        'map_ids': np.asarray(ids, dtype=np.int32)[order],
+        'map_xy': xy[order],
+        'map_clusters': labels.astype(np.uint16)[order],
+        'map_codes': codes[order],
+        'map_centres': ((centres - low) * scale).astype(np.float32),
+        'map_sizes': sizes.astype(np.int64),
+    }
+    return arrays, labels
+
+
+class CatalogMap:
+
+    def __init__(self, ids, xy, clusters, codes, centres, sizes, names=None):
+        self.ids = ids
+        self.xy = xy
+        self.clusters = clusters
+        self.codes = codes
+        self.centres = centres
+        self.sizes = sizes
+        self.names = names or [''] * len(sizes)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """The catalog's map, or None if it was built without one."""
+        if not all(name in catalog.arrays for name in ARRAY_NAMES):
+            return None
+        arrays = catalog.arrays
+        return cls(arrays['map_ids'], arrays['map_xy'], arrays['map_clusters'], arrays['map_codes'],
+                   arrays['map_centres'], arrays['map_sizes'], catalog.metadata.get('map_clusters'))
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def clusters_json(self):
+        return [
+            {'id': i, 'name': name, 'size': int(size), 'x': round(float(x), 1), 'y': round(float(y), 1)}
+            for i, (name, size, (x, y)) in enumerate(zip(self.names, self.sizes, self.centres))
+        ]
+
+    def tile_range(self, z, x, y):
+        """(start, stop) of the points in tile (z, x, y); tiles split the grid into 2**z x 2**z squares."""
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            raise ValueError(f"No tile {z}/{x}/{y} (zoom 0 to {MAX_ZOOM}, x and y below 2**zoom).")
+        shift = 2 * (MAX_ZOOM - z)
+        prefix = int(morton_codes(np.array([x, y], dtype=np.uint16)))
+        low, high = prefix << shift, (prefix + 1) << shift
+        start = int(np.searchsorted(self.codes, low, side='left'))
+        stop = len(self) if high > 0xFFFFFFFF else int(np.searchsorted(self.codes, high, side='left'))
+        return start, stop
+
+    def tile(self, z, x, y, limit):
+        """
+        Binary tile: TILE_HEADER, then int32 movie ids, uint16 (x, y) pairs and
+        uint16 cluster ids of its points. Tiles with more than ``limit``
+        points send an even sample; Morton order keeps it spread over the tile.
+        """
+        start, stop = self.tile_range(z, x, y)
+        total = stop - start
+        step = -(-total // limit) if limit and total > limit else 1
+        picked = slice(start, stop, step)
+        ids, xy, clusters = self.ids[picked], self.xy[picked], self.clusters[picked]
+        return b''.join([
+            TILE_HEADER.pack(TILE_MAGIC, len(ids), total),
+            np.ascontiguousarray(ids, dtype='<i4').tobytes(),
+            np.ascontiguousarray(xy, dtype='<u2').tobytes(),
+            np.ascontiguousarray(clusters, dtype='<u2').tobytes(),
+        ])
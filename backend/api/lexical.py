@@ -0,0 +1,223 @@
+"""
+BM25 keyword retrieval and rank fusion with the dense SBERT results.
+
+Sentence embeddings are weak at exact keyword matches ("zombie", "high
+school"), so the hybrid mode also looks the query's content/element words up
+in an inverted index over each movie's keywords, genres and overview.
+
+The index is stored as CSR arrays: ``lex_terms`` (sorted, fixed-width bytes),
+``lex_offsets`` into ``lex_rows``/``lex_weights``. The weights already hold
+the full BM25 contribution (idf included) of a term in a movie, so a query
+only sums the postings of its own terms.
+"""
+import re
+import time
+
+import numpy as np
+
+from .engine import normalize_rows, top_k
+
+ARRAY_NAMES = ('lex_terms', 'lex_offsets', 'lex_rows', 'lex_weights')
+MAX_TERM_BYTES = 24
+FIELD_WEIGHTS = {'keywords': 3.0, 'genres': 2.0, 'overview': 1.0}
+RRF_K = 60
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has he her his in is it its of on or she that the their they this to was
+were who with about after into movie film story
+""".split())
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Lower-cased word terms as bytes, without stopwords."""
+    return [
+        word.encode('utf-8')[:MAX_TERM_BYTES]
+        for word in _WORD.findall(str(text).lower()) if word not in STOPWORDS
+    ]
+
+
+class LexicalIndexBuilder:
+    """Collects weighted term counts chunk by chunk; ``finish`` turns them into CSR arrays."""
+
+    def __init__(self):
+        self.term_ids = {}
+        self.lengths = []
+        self._postings = []
+
+    def add(self, keywords, genres, overview):
+        term_ids = self.term_ids
+        chunk_terms, chunk_rows, chunk_tfs = [], [], []
+        for fields in zip(keywords, genres, overview):
+            row = len(self.lengths)
+            counts = {}
+            for text, weight in zip(fields, FIELD_WEIGHTS.values()):
+                for term in tokenize(text):
+                    counts[term] = counts.get(term, 0.0) + weight
+            for term, tf in counts.items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(term_ids)
+                chunk_terms.append(term_id)
+                chunk_rows.append(row)
+                chunk_tfs.append(tf)
+            self.lengths.append(sum(counts.values()))
+        self._postings.append((
+            np.asarray(chunk_terms, dtype=np.int64),
+            np.asarray(chunk_rows, dtype=np.int32),
+            np.asarray(chunk_tfs, dtype=np.float32),
+        ))
+
+    def finish(self, k1=1.2, b=0.75):
+        terms = sorted(self.term_ids)
+        # old term id -> position in the sorted vocabulary
+        remap = np.empty(len(terms), dtype=np.int64)
+        remap[[self.term_ids[t] for t in terms]] = np.arange(len(terms))
+
+        term_ids = remap[np.concatenate([p[0] for p in self._postings])]
+        rows = np.concatenate([p[1] for p in self._postings])
+        tfs = np.concatenate([p[2] for p in self._postings])
+        order = np.lexsort((rows, term_ids))
+        term_ids, rows, tfs = term_ids[order], rows[order], tfs[order]
+
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        n_docs = max(len(lengths), 1)
+        avgdl = max(float(lengths.mean()), 1.0) if len(lengths) else 1.0
+        df = np.bincount(term_ids, minlength=len(terms))
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths[rows] / avgdl)
+        weights = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+        return {
+            'lex_terms': np.array(terms, dtype=f'S{MAX_TERM_BYTES}'),
+            'lex_offsets': offsets,
+            'lex_rows': rows,
+            'lex_weights': weights,
+        }
+
+
+class LexicalIndex:
+
+    def __init__(self, terms, offsets, rows, weights):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """The catalog's BM25 index, or None if it was built without one."""
+        if not all(name in catalog.arrays for name in ARRAY_NAMES):
+            return None
+        return cls(*(catalog.arrays[name] for name in ARRAY_NAMES))
+
+    def postings(self, term):
+        position = np.searchsorted(self.terms, term)
+        if position >= len(self.terms) or self.terms[position] != term:
+            return None
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.rows[start:end], self.weights[start:end]
+
+    def search(self, text, k=50, allowed=None):
+        """
+        (rows, scores) of the k best BM25 matches for the terms in ``text``;
+        ``allowed`` optionally restricts them to a sorted array of rows.
+        """
+        found = [self.postings(term) for term in dict.fromkeys(tokenize(text))]
+        found = [p for p in found if p is not None]
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows = np.concatenate([p[0] for p in found])
+        weights = np.concatenate([p[1] for p in found])
+        if allowed is not None:
+            positions = np.minimum(np.searchsorted(allowed, rows), len(allowed) - 1)
+            keep = allowed[positions] == rows if len(allowed) else np.zeros(len(rows), dtype=bool)
+            rows, weights = rows[keep], weights[keep]
+            if not len(rows):
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        order = np.argsort(rows, kind='stable')
+        rows, weights = rows[order], weights[order]
+        starts = np.flatnonzero(np.concatenate(([True], rows[1:] != rows[:-1])))
+        unique_rows = rows[starts]
+        scores = np.add.reduceat(weights, starts)
+        best, best_scores = top_k(scores, k)
+        return unique_rows[best].astype(np.int64), best_scores
+
+
+def reciprocal_rank_fusion(rankings, weights, k=RRF_K):
+    """Rows ordered by sum(weight / (k + rank)) over the given rankings (best first)."""
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, row in enumerate(ranking.tolist()):
+            fused[row] = fused.get(row, 0.0) + weight / (k + rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+def weighted_fusion(results, weights):
+    """Rows ordered by the weighted sum of their min-max normalised scores per result list."""
+    fused = {}
+    for (rows, scores), weight in zip(results, weights):
+        if not len(rows):
+            continue
+        low, high = float(scores.min()), float(scores.max())
+        span = high - low or 1.0
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            fused[row] = fused.get(row, 0.0) + weight * (score - low) / span
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+FUSIONS = ('rrf', 'weighted')
+
+
+def fuse(dense, lexical, fusion='rrf', lexical_weight=1.0):
+    """Fused row order of a dense and a lexical (rows, scores) result."""
+    if fusion == 'rrf':
+        return reciprocal_rank_fusion([dense[0], lexical[0]], [1.0, lexical_weight])
+    if fusion == 'weighted':
+        return weighted_fusion([dense, lexical], [1.0, lexical_weight])
+    raise ValueError(f"Unknown fusion '{fusion}'")
+
+
+class HybridRetriever:
+    """
+    Fuses the dense top ``depth`` of a query with its BM25 top ``depth``.
+    Results are ordered by the fused rank but keep their cosine similarity
+    as the reported score.
+    """
+
+    def __init__(self, index, embeddings, fusion='rrf', lexical_weight=1.0, depth=50):
+        if fusion not in FUSIONS:
+            raise ValueError(f"Unknown fusion '{fusion}'")
+        self.index = index
+        self.embeddings = embeddings
+        self.fusion = fusion
+        self.lexical_weight = lexical_weight
+        self.depth = depth
+
+    @classmethod
+    def from_catalog(cls, catalog, fusion='rrf', lexical_weight=1.0, depth=50):
+        index = LexicalIndex.from_catalog(catalog)
+        if index is None:
+            return None
+        return cls(index, catalog.embeddings, fusion, lexical_weight, depth)
+
+    def combine(self, text, dense, query_embedding, k, allowed=None, timings=None):
+        """(rows, scores) of the fused top k; ``dense`` is the (rows, scores) of the dense search."""
+        start = time.perf_counter()
+        lexical = self.index.search(text, self.depth, allowed)
+        if timings is not None:
+            start = timings.since('lexical', start)
+        if not len(lexical[0]):
+            return dense[0][:k], dense[1][:k]
+
+        rows = np.asarray(fuse(dense, lexical, self.fusion, self.lexical_weight)[:k], dtype=np.int64)
+        query = normalize_rows(np.reshape(query_embedding, (-1,)))
+        scores = np.asarray(self.embeddings[rows], dtype=np.float32) @ query
+        if timings is not None:
+            timings.since('fusion', start)
+        return rows, scores
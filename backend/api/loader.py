@@ -0,0 +1,368 @@
+"""
+Background loading of the catalog and sentence encoder, and hot reloads.
+
+``ApiConfig.ready`` starts the load on a daemon thread, so importing the views
+(and serving /api/options/ or the admin) never pays for torch or the model.
+The loader records how long each stage took and finishes with a warmup
+query through the new recommender so the first real request does not pay
+first-call costs.
+
+A rebuilt catalog is picked up without restarting the worker: ``reload``
+opens the new version next to the serving one (reusing the loaded encoder
+when the model is the same), validates it with a query and then swaps
+``loader.recommender`` in one assignment. Views read that reference once per
+request, so requests already running finish on the old version, which is
+freed when the last of them drops it. Reloads are triggered by
+RECOMMENDER_RELOAD_SIGNAL, by ``manage.py reload_catalog`` or by the build
+script moving the catalog's CURRENT file, which a thread polls every
+RECOMMENDER_RELOAD_POLL_SECONDS.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+
+IDLE = 'idle'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+# (genre, mood, content, element)
+WARMUP_QUERIES = [
+    ('Action', 'Exciting', 'heist', 'robot'),
+    ('', '', 'a family on a road trip', 'dog'),
+]
+
+
+def should_load_on_startup(argv=None):
+    """
+    True when this process is going to serve requests: a WSGI/ASGI server or
+    the serving child of ``runserver``. Other management commands skip it.
+    """
+    if not settings.RECOMMENDER_LOAD_ON_STARTUP:
+        return False
+    argv = sys.argv if argv is None else argv
+    if not argv or os.path.basename(argv[0]) not in ('manage.py', 'django-admin'):
+        return True
+    if len(argv) < 2 or argv[1] != 'runserver':
+        return False
+    # with the autoreloader only the child process (RUN_MAIN) serves requests
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+
+
+def validate(recommender):
+    """Runs the warmup queries through a freshly built recommender; raises ArtifactError if they fail."""
+    import numpy as np
+
+    from .artifacts import ArtifactError
+    from .recommender import DEFAULT_K, WizardQuery
+
+    expected = min(DEFAULT_K, len(recommender.catalog))
+    for ranked in recommender.rank_batch([WizardQuery(*q) for q in WARMUP_QUERIES], DEFAULT_K):
+        if len(ranked) != expected or not np.all(np.isfinite(ranked.scores)):
+            raise ArtifactError(f"Validation query returned {len(ranked)} results (expected {expected})")
+        ranked.to_json()
+
+
+class ModelLoader:
+
+    def __init__(self):
+        self.state = IDLE
+        self.error = None
+        self.recommender = None
+        self.stages = OrderedDict()
+        self.started_at = None
+        self.finished_at = None
+        self.reloads = 0
+        self.last_reload = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self._watcher = None
+        # replaced recommenders that in-flight requests may still hold
+        self._retired = weakref.WeakSet()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def engine_error(self):
+        """Why the serving search engine is down (a failed shard), or None."""
+        recommender = self.recommender
+        return getattr(recommender.engine, 'error', None) if recommender is not None else None
+
+    @property
+    def healthy(self):
+        """Ready and searching with the configured engine, not a fallback."""
+        return self.ready and self.engine_error is None
+
+    def start(self):
+        """Starts loading in the background; later calls are no-ops."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.state = LOADING
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Blocks until loading finished (or failed); returns True if ready."""
+        self.start()
+        self._done.wait(timeout)
+        return self.ready
+
+    def _stage(self, name, fn, stages=None):
+        start = time.perf_counter()
+        result = fn()
+        (self.stages if stages is None else stages)[name] = time.perf_counter() - start
+        return result
+
+    def _run(self):
+        try:
+            self.recommender = self._load()
+            self.state = READY
+            total = sum(self.stages.values())
+            print(f" Model & Data loaded in {total:.2f}s ({self.recommender.version}).")
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = FAILED
+            print(f" Critical Error loading model: {self.error}")
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+        # also after a failed load, so a catalog built later is picked up without a restart
+        if settings.RECOMMENDER_RELOAD_POLL_SECONDS:
+            self._watcher = threading.Thread(target=self.watch, args=(settings.RECOMMENDER_RELOAD_POLL_SECONDS,),
+                                             name='catalog-watcher', daemon=True)
+            self._watcher.start()
+
+    def _load(self, version=None):
+        from .artifacts import load_catalog
+
+        print(f"--- INIT: Loading S-BERT catalog from: {settings.RECOMMENDER_CATALOG_DIR} ---")
+        catalog = self._stage('catalog', lambda: load_catalog(settings.RECOMMENDER_CATALOG_DIR, version))
+        print(f" Catalog {catalog.version} mapped ({len(catalog)} movies).")
+        model = self._load_model(catalog.model_name)
+        return self._build(catalog, model)
+
+    def _load_model(self, model_name, stages=None):
+        from .batching import MicroBatchEncoder
+        from .encoders import encoder_class
+        from .threads import get_budget
+
+        encoder_cls = self._stage('import', lambda: encoder_class(settings.RECOMMENDER_ENCODER), stages)
+        print(f"Loading {encoder_cls.__name__} ({model_name})...")
+        model = self._stage('model', lambda: encoder_cls.load(
+            model_name,
+            threads=get_budget().encoder,
+            export_dir=settings.RECOMMENDER_ENCODER_DIR,
+        ), stages)
+
+        if settings.RECOMMENDER_MICROBATCH_WAIT_MS > 0:
+            model = MicroBatchEncoder(
+                model,
+                max_wait_ms=settings.RECOMMENDER_MICROBATCH_WAIT_MS,
+                max_batch_size=settings.RECOMMENDER_MICROBATCH_MAX_SIZE,
+            )
+        return model
+
+    def _build(self, catalog, model, stages=None):
+        """A validated Recommender over a loaded catalog and encoder."""
+        from .cache import LRUCache, QueryEmbeddingCache, SQLiteCache, TTLCache
+        from .lexical import HybridRetriever
+        from .query import QueryComposer
+        from .recommender import Recommender, build_engine
+
+        engine = self._stage('engine', lambda: build_engine(
+            catalog, settings.RECOMMENDER_SEARCH,
+            nprobe=settings.RECOMMENDER_IVF_NPROBE, rerank=settings.RECOMMENDER_RERANK,
+            shards=settings.RECOMMENDER_SHARDS, shard_threads=settings.RECOMMENDER_SHARD_THREADS,
+            affinity=settings.RECOMMENDER_SHARD_AFFINITY,
+        ), stages)
+
+        composer = None
+        if settings.RECOMMENDER_QUERY_MODE == 'composed':
+            composer = QueryComposer.from_catalog(catalog, settings.RECOMMENDER_COMPOSE_WEIGHTS)
+            if composer is None:
+                print(" Catalog has no vocabulary table, encoding full queries.")
+
+        hybrid = None
+        if settings.RECOMMENDER_RETRIEVAL == 'hybrid':
+            hybrid = HybridRetriever.from_catalog(
+                catalog, settings.RECOMMENDER_FUSION,
+                settings.RECOMMENDER_LEXICAL_WEIGHT, settings.RECOMMENDER_FUSION_DEPTH,
+            )
+            if hybrid is None:
+                print(" Catalog has no keyword index, using dense retrieval only.")
+
+        shared_cache = None
+        if settings.RECOMMENDER_QUERY_CACHE_PATH:
+            shared_cache = SQLiteCache(settings.RECOMMENDER_QUERY_CACHE_PATH)
+        query_cache = QueryEmbeddingCache(catalog.version, settings.RECOMMENDER_QUERY_CACHE_SIZE, shared_cache,
+                                          encoder=f'{settings.RECOMMENDER_ENCODER}/{catalog.model_name}')
+
+        recommender = Recommender(
+            catalog, model, composer,
+            query_cache=query_cache,
+            result_cache=LRUCache(settings.RECOMMENDER_RESULT_CACHE_SIZE),
+            engine=engine,
+            hybrid=hybrid,
+            cursor_cache=TTLCache(
+                settings.RECOMMENDER_CURSOR_CACHE_SIZE,
+                settings.RECOMMENDER_CURSOR_CACHE_BYTES,
+                settings.RECOMMENDER_CURSOR_TTL,
+            ),
+            page_depth=settings.RECOMMENDER_PAGE_DEPTH,
+        )
+        self._stage('filters', lambda: recommender.filter_index, stages)
+        self._stage('warmup', lambda: validate(recommender), stages)
+        return recommender
+
+    def reload(self, version=None):
+        """
+        Switches to a catalog version (the CURRENT one by default) once it has
+        loaded and passed validation. Returns True if that version is serving;
+        on failure the old version keeps serving. When nothing is serving yet
+        because the first load failed, this is a full load.
+        """
+        from .artifacts import current_version, load_catalog
+
+        with self._reload_lock:
+            current = self.recommender
+            if current is None:
+                return self._retry_load(version)
+            root = settings.RECOMMENDER_CATALOG_DIR
+            started = time.time()
+            stages = OrderedDict()
+            try:
+                version = version or current_version(root)
+                # a failed engine (e.g. a shard that could not be respawned) is rebuilt from the same version
+                if version == current.version and self.engine_error is None:
+                    return True
+                print(f"--- RELOAD: catalog {version} (serving {current.version}) ---")
+                catalog = self._stage('catalog', lambda: load_catalog(root, version), stages)
+                model = current.model
+                if catalog.model_name != current.catalog.model_name:
+                    model = self._load_model(catalog.model_name, stages)
+                recommender = self._build(catalog, model, stages)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                self.last_reload = {'version': version, 'ok': False, 'error': error, 'at': started}
+                print(f" Reload failed, still serving {current.version}: {error}")
+                return False
+
+            # requests that already read the old reference keep it until they finish
+            self.recommender = recommender
+            self._retired.add(current)
+            if model is not current.model and hasattr(current.model, 'close'):
+                # stops the old micro-batching thread, which would otherwise keep the old model alive
+                current.model.close()
+            self.reloads += 1
+            self.last_reload = {
+                'version': version, 'previous': current.version, 'ok': True, 'at': started,
+                'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+            }
+            print(f" Switched to catalog {version} in {sum(stages.values()):.2f}s.")
+            return True
+
+    def _retry_load(self, version=None):
+        """Full load after the first one failed; caller holds the reload lock."""
+        if self.state != FAILED:
+            # still loading
+            return False
+        started = time.time()
+        self.stages = OrderedDict()
+        try:
+            recommender = self._load(version)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            self.last_reload = {'version': version, 'ok': False, 'error': error, 'at': started}
+            print(f" Load failed again: {error}")
+            return False
+        self.recommender = recommender
+        self.error = None
+        self.state = READY
+        self.finished_at = time.time()
+        self.reloads += 1
+        self.last_reload = {
+            'version': recommender.version, 'previous': None, 'ok': True, 'at': started,
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+        }
+        print(f" Model & Data loaded in {sum(self.stages.values()):.2f}s ({recommender.version}).")
+        return True
+
+    def reload_in_background(self):
+        threading.Thread(target=self.reload, name='catalog-reload', daemon=True).start()
+
+    def watch(self, interval):
+        """Polls the catalog's CURRENT file and reloads when it names another version."""
+        from .artifacts import ArtifactError, current_version
+
+        while True:
+            time.sleep(interval)
+            try:
+                version = current_version(settings.RECOMMENDER_CATALOG_DIR)
+            except ArtifactError:
+                continue
+            failed = self.last_reload is not None and not self.last_reload['ok'] \
+                and self.last_reload['version'] == version
+            recommender = self.recommender
+            if failed:
+                continue
+            if recommender is None or version != recommender.version:
+                self.reload(version)
+            elif self.engine_error is not None and not getattr(recommender.engine, 'recovering', False):
+                # the engine could not recover on its own; build a new one
+                self.reload(version)
+
+    @property
+    def draining(self):
+        """Versions that were replaced but are still held by running requests."""
+        return sorted(r.version for r in self._retired)
+
+    def status(self):
+        status = {
+            'state': self.state,
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+        }
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            status['elapsed_seconds'] = round(end - self.started_at, 4)
+        if self.recommender is not None:
+            status['version'] = self.recommender.version
+        if self.error:
+            status['error'] = self.error
+        if self.engine_error:
+            status['engine_error'] = self.engine_error
+        if self.last_reload is not None:
+            status['reloads'] = self.reloads
+            status['last_reload'] = self.last_reload
+            status['draining'] = self.draining
+        return status
+
+
+loader = ModelLoader()
+
+
+def get_recommender():
+    """The loaded Recommender, or None while loading; kicks off a lazy load if needed."""
+    if loader.state == IDLE:
+        loader.start()
+    return loader.recommender
+
+
+def install_reload_signal(name):
+    """Reloads the catalog in the background on signal ``name`` (e.g. 'SIGPWR'); main thread only."""
+    signum = getattr(signal, name, None) if name else None
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return False
+    signal.signal(signum, lambda signum, frame: loader.reload_in_background())
+    return True
@@ -0,0 +1,56 @@
+import os
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.artifacts import ArtifactError, current_version, list_versions, load_catalog, set_current_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Validates a catalog version and makes it the CURRENT one. Serving workers switch to it "
+        "without a restart (within RECOMMENDER_RELOAD_POLL_SECONDS, or at once with --signal)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', nargs='?', help="version to serve (default: the newest build)")
+        parser.add_argument('--list', action='store_true', help="list the catalog versions and exit")
+        parser.add_argument('--verify', action='store_true', help="re-hash the embeddings against the manifest")
+        parser.add_argument('--signal', type=int, nargs='+', metavar='PID', default=[],
+                            help="also send RECOMMENDER_RELOAD_SIGNAL to these worker processes "
+                                 "(not the gunicorn master)")
+
+    def handle(self, *args, **options):
+        root = settings.RECOMMENDER_CATALOG_DIR
+        versions = list_versions(root)
+        try:
+            serving = current_version(root)
+        except ArtifactError:
+            serving = None
+
+        if options['list']:
+            for version in versions:
+                self.stdout.write(f"{'*' if version == serving else ' '} {version}")
+            return
+
+        version = options['version'] or (versions[-1] if versions else None)
+        if version not in versions:
+            raise CommandError(f"No catalog version {version!r} in {root}.")
+
+        try:
+            catalog = load_catalog(root, version, verify=options['verify'])
+        except ArtifactError as e:
+            raise CommandError(f"Catalog {version} is not loadable: {e}")
+        self.stdout.write(f"Catalog {version}: {len(catalog)} movies, {catalog.model_name}.")
+
+        if version != serving:
+            set_current_version(root, version)
+            self.stdout.write(f"CURRENT: {serving} -> {version}")
+
+        signum = getattr(signal, settings.RECOMMENDER_RELOAD_SIGNAL or '', None)
+        for pid in options['signal']:
+            if signum is None:
+                raise CommandError("RECOMMENDER_RELOAD_SIGNAL is not set.")
+            os.kill(pid, signum)
+            self.stdout.write(f"Sent {settings.RECOMMENDER_RELOAD_SIGNAL} to {pid}.")
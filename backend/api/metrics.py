@@ -0,0 +1,201 @@
+"""
+Lightweight in-process metrics.
+
+``Histogram`` and ``LabeledHistogram`` aggregate observations per worker and
+render in the Prometheus text format; ``Timings`` collects the stage durations
+of a single request for its ``Server-Timing`` header.
+"""
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics: ``le`` upper bounds)."""
+
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets, lock=None):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = lock or threading.Lock()
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        with self._lock:
+            self._observe(value)
+
+    def _observe(self, value):
+        # caller holds the lock
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, sum(counts)
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.buckets + [float('inf')], counts):
+            running += n
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+    def to_dict(self):
+        snap = self.snapshot()
+        return {
+            'buckets': {('+Inf' if b == float('inf') else str(b)): n for b, n in snap['buckets']},
+            'sum': snap['sum'],
+            'count': snap['count'],
+        }
+
+    def prometheus(self, name, labels=''):
+        """Sample lines for ``name``; ``labels`` is a pre-rendered 'key="value"' string."""
+        snap = self.snapshot()
+        prefix = labels + ',' if labels else ''
+        lines = []
+        for bound, n in snap['buckets']:
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {n}')
+        suffix = '{' + labels + '}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {snap["sum"]!r}')
+        lines.append(f'{name}_count{suffix} {snap["count"]}')
+        return lines
+
+
+class LabeledHistogram:
+    """
+    One Histogram per value of a single label (e.g. stage="encode"). The
+    children share one lock, which histograms updated together can also
+    share (``lock``). ``labels`` creates the children of known label values
+    up front.
+    """
+
+    def __init__(self, name, help, label, buckets=LATENCY_BUCKETS, labels=(), lock=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = sorted(buckets)
+        self.lock = lock or threading.Lock()
+        self.children = {value: Histogram(self.buckets, self.lock) for value in labels}
+
+    def labels(self, value):
+        child = self.children.get(value)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(value, Histogram(self.buckets, self.lock))
+        return child
+
+    def observe(self, value, amount):
+        self.labels(value).observe(amount)
+
+    def observe_all(self, amounts):
+        """Observes a {label value: amount} dict."""
+        with self.lock:
+            self._observe_all(amounts)
+
+    def _observe_all(self, amounts):
+        # caller holds the lock; Histogram._observe inlined, this runs for every stage of every request
+        children, buckets = self.children, self.buckets
+        for value, amount in amounts.items():
+            child = children.get(value)
+            if child is None:
+                child = children[value] = Histogram(buckets, self.lock)
+            child.counts[bisect_left(buckets, amount)] += 1
+            child.sum += amount
+
+    def prometheus(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            children = sorted(self.children.items())
+        for value, child in children:
+            lines += child.prometheus(self.name, f'{self.label}="{escape_label(value)}"')
+        return lines
+
+
+class RequestMetrics:
+    """
+    Stage and request latency histograms of the views, recorded together:
+    one lock acquire per request, the children of the known labels already
+    exist and the bucket search is inlined. The two histograms must share
+    their lock.
+    """
+
+    def __init__(self, stage_histogram, request_histogram):
+        self.stages = stage_histogram
+        self.requests = request_histogram
+        self.lock = stage_histogram.lock
+
+    def observe(self, label, stages, total):
+        requests = self.requests
+        with self.lock:
+            self.stages._observe_all(stages)
+            child = requests.children.get(label)
+            if child is None:
+                child = requests.children[label] = Histogram(requests.buckets, self.lock)
+            child._observe(total)
+
+    def prometheus(self):
+        return self.stages.prometheus() + self.requests.prometheus()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def gauge(name, help, samples, kind='gauge'):
+    """Prometheus lines for a gauge/counter; ``samples`` is a list of (labels dict, value)."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        rendered = ','.join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+        lines.append(f'{name}{{{rendered}}} {value!r}' if rendered else f'{name} {value!r}')
+    return lines
+
+
+class Timings:
+    """Stage durations of one request, in order of first use."""
+
+    __slots__ = ('stages', 'started')
+
+    def __init__(self):
+        self.stages = {}
+        self.started = perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def since(self, stage, start):
+        """Records the time from ``start`` (a perf_counter value) until now; returns now."""
+        now = perf_counter()
+        stages = self.stages
+        stages[stage] = stages.get(stage, 0.0) + now - start
+        return now
+
+    def total(self):
+        return perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        stages = self.stages
+        key = (*stages, total is not None)
+        template = _SERVER_TIMING_FORMATS.get(key)
+        if template is None:
+            if len(_SERVER_TIMING_FORMATS) > 1024:
+                _SERVER_TIMING_FORMATS.clear()
+            names = list(stages)
+            if total is not None:
+                names.append('total')
+            template = _SERVER_TIMING_FORMATS[key] = ', '.join(f'{name};dur=%.3f' for name in names)
+        values = [seconds * 1000 for seconds in stages.values()]
+        if total is not None:
+            values.append(total * 1000)
+        return template % tuple(values)
+
+
+# Server-Timing header templates by (stage names..., has total), so a header is one % format
+_SERVER_TIMING_FORMATS = {}
@@ -1,3 +1,31 @@
 from django.db import models
 
-# Create your models here.
+
+class Profile(models.Model):
+    """
+    A recommendation session. ``vector`` is the running preference vector
+    (float32 bytes) for the catalogs of ``model_name``; ``revision`` counts
+    writes, so workers know when their cached seen-set is stale.
+    """
+    key = models.CharField(max_length=32, unique=True)
+    model_name = models.CharField(max_length=200, blank=True)
+    vector = models.BinaryField(default=b'')
+    revision = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Feedback(models.Model):
+    """A movie a profile liked (True), disliked (False) or was shown (None)."""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='feedback')
+    movie_id = models.IntegerField()
+    liked = models.BooleanField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'movie_id'], name='unique_profile_movie'),
+        ]
@@ -0,0 +1,101 @@
+"""
+Precomputed "more like this" neighbours for every movie.
+
+``neighbor_table`` computes the top ``n`` most similar movies of every row
+with blocked matrix products: a block of query rows is scored against one
+block of catalog rows at a time and merged into a running top-n, so memory
+stays at ``worker_bytes()`` per worker (the float32 block of scores and the
+int64 positions argpartition returns for it) instead of N x N. Blocks of
+query rows run on a thread pool (numpy releases the GIL inside the products
+and partitions) of at most ``MAX_WORKERS`` threads unless asked for more.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .engine import top_k_rows
+
+ARRAY_NAMES = ('neighbor_ids', 'neighbor_scores')
+BLOCK_ROWS = 1024
+BLOCK_COLS = 16384
+# default thread cap: each worker holds worker_bytes() (~192 MiB with the default blocks)
+MAX_WORKERS = 4
+# bytes per table entry: an int32 id and a float16 score
+ENTRY_BYTES = 6
+
+
+def worker_bytes(block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS):
+    """Peak scratch memory of one worker: float32 scores plus argpartition's int64 positions."""
+    return block_rows * block_cols * (4 + 8)
+
+
+def _merge(ids, scores, new_ids, new_scores, n):
+    ids = np.concatenate([ids, new_ids], axis=1)
+    scores = np.concatenate([scores, new_scores], axis=1)
+    positions, scores = top_k_rows(scores, n)
+    return np.take_along_axis(ids, positions, axis=1), scores
+
+
+def _block_neighbors(embeddings, start, stop, n, block_cols):
+    queries = np.asarray(embeddings[start:stop], dtype=np.float32)
+    rows = stop - start
+    ids = np.empty((rows, 0), dtype=np.int64)
+    scores = np.empty((rows, 0), dtype=np.float32)
+    own = np.arange(start, stop)
+    for col_start in range(0, embeddings.shape[0], block_cols):
+        col_stop = min(col_start + block_cols, embeddings.shape[0])
+        block_scores = queries @ np.asarray(embeddings[col_start:col_stop], dtype=np.float32).T
+        # a movie is not its own neighbour
+        overlap = (own >= col_start) & (own < col_stop)
+        block_scores[np.flatnonzero(overlap), own[overlap] - col_start] = -np.inf
+        block_ids, block_top = top_k_rows(block_scores, n)
+        ids, scores = _merge(ids, scores, block_ids + col_start, block_top, n)
+    return start, ids, scores
+
+
+def neighbor_table(embeddings, n=50, block_rows=BLOCK_ROWS, block_cols=BLOCK_COLS, workers=None):
+    """
+    (ids int32, scores float16), each (rows, n): the n most similar other
+    rows of every row, best first. ``embeddings`` must be unit length.
+    """
+    total = embeddings.shape[0]
+    n = min(n, max(total - 1, 0))
+    out_ids = np.empty((total, n), dtype=np.int32)
+    out_scores = np.empty((total, n), dtype=np.float16)
+    if n == 0:
+        return out_ids, out_scores
+
+    workers = workers or min(os.cpu_count() or 1, MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_block_neighbors, embeddings, start, min(start + block_rows, total), n, block_cols)
+            for start in range(0, total, block_rows)
+        ]
+        for future in futures:
+            start, ids, scores = future.result()
+            out_ids[start:start + len(ids)] = ids
+            out_scores[start:start + len(ids)] = scores
+    return out_ids, out_scores
+
+
+class NeighborTable:
+
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """The catalog's neighbour table, or None if it was built without one."""
+        if not all(name in catalog.arrays for name in ARRAY_NAMES):
+            return None
+        return cls(catalog.arrays['neighbor_ids'], catalog.arrays['neighbor_scores'])
+
+    @property
+    def width(self):
+        return self.ids.shape[1]
+
+    def neighbors(self, row, k):
+        """(rows, scores) of the k nearest neighbours of a catalog row."""
+        return self.ids[row, :k], self.scores[row, :k].astype(np.float32)
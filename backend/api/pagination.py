@@ -0,0 +1,84 @@
+"""
+Cursor paging for /api/recommend/ ("show more").
+
+The first page ranks the top ``depth`` candidates once and keeps their
+(indices, scores) in a ``TTLCache`` under a random cursor id. Later pages
+are cut from that list, so they never reach the encoder or the embedding
+matrix. Cursors look like ``<id>.<offset>`` but clients should treat them as
+opaque strings.
+"""
+import secrets
+from collections import namedtuple
+
+import numpy as np
+
+Paging = namedtuple('Paging', ['k', 'paged', 'cursor'])
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def parse_k(data, default_k, max_k):
+    k = data.get('k', default_k) if isinstance(data, dict) else default_k
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= max_k:
+        raise ValueError(f"'k' must be an integer between 1 and {max_k}.")
+    return k
+
+
+def parse_paging(data, default_k, max_k):
+    """
+    Paging of a recommend request body. ``"cursor": null`` asks for the
+    first page of a paged response; without a ``cursor`` key the response is
+    the plain list of the top ``k``.
+    """
+    k = parse_k(data, default_k, max_k)
+    if not isinstance(data, dict):
+        return Paging(k, False, None)
+    cursor = data.get('cursor')
+    if cursor is not None and not isinstance(cursor, str):
+        raise ValueError("'cursor' must be a string.")
+    return Paging(k, 'cursor' in data, cursor)
+
+
+def new_cursor_id():
+    return secrets.token_urlsafe(12)
+
+
+def encode_cursor(cursor_id, offset):
+    return f"{cursor_id}.{offset}"
+
+
+def decode_cursor(cursor):
+    """(cursor id, offset); raises ValueError for a malformed cursor."""
+    cursor_id, _, offset = cursor.rpartition('.')
+    if not cursor_id or not offset.isdigit():
+        raise ValueError("Malformed 'cursor'.")
+    return cursor_id, int(offset)
+
+
+class CandidateCache:
+    """Ranked candidate lists of paged searches, keyed by cursor id."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def put(self, cursor_id, indices, scores):
+        indices = np.asarray(indices, dtype=np.int32)
+        scores = np.asarray(scores, dtype=np.float32)
+        self.cache.set(cursor_id, (indices, scores), indices.nbytes + scores.nbytes)
+        return indices, scores
+
+    def get(self, cursor_id):
+        return self.cache.get(cursor_id)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def page(candidates, offset, k, cursor_id):
+    """(indices, scores, next cursor or None) of the k candidates from ``offset``."""
+    indices, scores = candidates
+    end = offset + k
+    next_cursor = encode_cursor(cursor_id, end) if end < len(indices) else None
+    return indices[offset:end], scores[offset:end], next_cursor
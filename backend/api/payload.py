@@ -0,0 +1,100 @@
+"""
+Response payloads assembled from the catalog's typed columns.
+
+Every movie's response object is pre-serialised at build time (without its
+closing brace), so rendering k results is k byte-string joins plus the
+formatted scores; no DataFrame access or per-field casting on the hot path.
+"""
+import json
+
+import numpy as np
+
+
+class MovieStore:
+    """Typed, column-oriented view of the movie metadata in a catalog."""
+
+    def __init__(self, catalog):
+        self.ids = catalog['id']
+        self.titles = catalog['title']
+        self.overviews = catalog['overview']
+        self.years = catalog['year']
+        self.ratings = catalog['rating']
+        self.runtimes = catalog['runtime']
+        self.genre_ids = catalog['genre_id']
+        self.genres = catalog.metadata['genres']
+        self.fragments = catalog['payload_json']
+        self._id_order = None
+
+    def row_for_id(self, movie_id):
+        """Catalog row of a TMDB movie id, or None."""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        position = np.searchsorted(self.ids, movie_id, sorter=self._id_order)
+        if position < len(self._id_order) and self.ids[self._id_order[position]] == movie_id:
+            return int(self._id_order[position])
+        return None
+
+    def rows_for_ids(self, movie_ids):
+        """Catalog rows of the given TMDB movie ids; unknown ids are skipped."""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, movie_ids, sorter=self._id_order), len(self._id_order) - 1)
+        rows = self._id_order[positions]
+        return rows[self.ids[rows] == movie_ids]
+
+    def item(self, index, score):
+        year = int(self.years[index])
+        return {
+            "id": int(self.ids[index]),
+            "title": self.titles[index],
+            "overview": self.overviews[index],
+            "score": round(float(score), 2),
+            "genres": self.genres[self.genre_ids[index]],
+            "year": str(year) if year else "N/A",
+            "rating": round(float(self.ratings[index]), 2),
+            "runtime": int(self.runtimes[index]),
+        }
+
+    def render(self, indices, scores):
+        """JSON array bytes for the given rows, identical in content to ``item``."""
+        fragments = self.fragments
+        parts = [
+            fragments.raw(index) + b',"score":' + repr(round(float(score), 2)).encode() + b'}'
+            for index, score in zip(indices, scores)
+        ]
+        return b'[' + b','.join(parts) + b']'
+
+
+class RankedList:
+    """Ranked catalog rows for one query; rendered lazily."""
+
+    __slots__ = ('store', 'indices', 'scores', '_json')
+
+    def __init__(self, store, indices, scores):
+        self.store = store
+        self.indices = indices
+        self.scores = scores
+        self._json = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def to_list(self):
+        return [self.store.item(i, s) for i, s in zip(self.indices, self.scores)]
+
+    def to_json(self):
+        if self._json is None:
+            self._json = self.store.render(self.indices, self.scores)
+        return self._json
+
+
+def render_batch(items):
+    """JSON bytes for a batch response: [{"results": [...]} | {"error": "..."}, ...]."""
+    parts = []
+    for item in items:
+        if isinstance(item, RankedList):
+            parts.append(b'{"results":' + item.to_json() + b'}')
+        else:
+            parts.append(json.dumps(item).encode())
+    return b'[' + b','.join(parts) + b']'
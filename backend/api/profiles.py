@@ -0,0 +1,145 @@
+"""
+Session profiles for personalised follow-up recommendations.
+
+A profile records likes and dislikes by movie id (``models.Feedback``) and
+keeps a running preference vector: the sum of the liked movies' catalog
+embeddings minus RECOMMENDER_DISLIKE_WEIGHT times the disliked ones. Feedback
+updates it in O(dim) from the embedding rows, nothing is re-encoded.
+
+Every title a profile rated or was already recommended is "seen". Workers
+keep the seen titles of recent profiles as a packed bitset over catalog rows
+(in a size-capped ``TTLCache``), rebuilt from the database only when the
+profile's revision or the catalog version changed. A personalised request is
+then one blend of the query with the preference vector and one scan with the
+seen rows masked out before the top k (``Recommender.rank_personal``).
+"""
+import secrets
+import threading
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .cache import TTLCache
+from .models import Feedback, Profile
+
+ProfileState = namedtuple('ProfileState', ['revision', 'version', 'preference', 'seen'])
+
+
+def new_profile_key():
+    return secrets.token_urlsafe(16)
+
+
+def seen_bitset(rows, n):
+    """Packed bitset (uint8, big-endian bit order like np.packbits) of ``rows`` out of ``n``."""
+    mask = np.zeros(n, dtype=bool)
+    mask[np.asarray(rows, dtype=np.int64)] = True
+    return np.packbits(mask)
+
+
+def set_bits(bits, rows):
+    """Copy of a packed bitset with ``rows`` added."""
+    rows = np.asarray(rows, dtype=np.int64)
+    bits = bits.copy()
+    np.bitwise_or.at(bits, rows >> 3, (128 >> (rows & 7)).astype(np.uint8))
+    return bits
+
+
+class ProfileStore:
+
+    def __init__(self, dislike_weight=0.5, cache_size=1024, cache_bytes=32 * 1024 * 1024, ttl=1800):
+        self.dislike_weight = dislike_weight
+        self._states = TTLCache(cache_size, cache_bytes, ttl)
+
+    def _weight(self, liked):
+        return 1.0 if liked else -self.dislike_weight
+
+    def create(self, recommender):
+        return Profile.objects.create(key=new_profile_key(), model_name=recommender.catalog.model_name)
+
+    def get(self, key):
+        return Profile.objects.filter(key=key).first()
+
+    def _vector(self, profile, recommender):
+        """
+        The profile's preference vector for the recommender's catalog. It is
+        only summed again from the feedback when the profile was built with
+        another model.
+        """
+        catalog = recommender.catalog
+        dim = catalog.embeddings.shape[1]
+        if profile.model_name == catalog.model_name and len(profile.vector) == 4 * dim:
+            return np.frombuffer(profile.vector, dtype=np.float32).copy()
+
+        vector = np.zeros(dim, dtype=np.float32)
+        for movie_id, liked in profile.feedback.exclude(liked=None).values_list('movie_id', 'liked'):
+            row = recommender.movies.row_for_id(movie_id)
+            if row is not None:
+                vector += self._weight(liked) * catalog.embeddings[row]
+        return vector
+
+    def _cache(self, profile, recommender, vector, seen):
+        state = ProfileState(profile.revision, recommender.version, vector, seen)
+        self._states.set(profile.key, state, vector.nbytes + seen.nbytes)
+        return state
+
+    def state(self, profile, recommender):
+        """ProfileState of a profile for the serving catalog, from this worker's cache when it is current."""
+        state = self._states.get(profile.key)
+        if state is not None and state.revision == profile.revision and state.version == recommender.version:
+            return state
+        ids = list(profile.feedback.values_list('movie_id', flat=True))
+        seen = seen_bitset(recommender.movies.rows_for_ids(ids), len(recommender.catalog))
+        return self._cache(profile, recommender, self._vector(profile, recommender), seen)
+
+    def record(self, profile, recommender, row, liked):
+        """Stores a like (True) or dislike (False) of a catalog row and updates the vector in O(dim)."""
+        movie_id = int(recommender.movies.ids[row])
+        embedding = np.asarray(recommender.catalog.embeddings[row], dtype=np.float32)
+        with transaction.atomic():
+            profile = Profile.objects.select_for_update().get(pk=profile.pk)
+            vector = self._vector(profile, recommender)
+            previous = Feedback.objects.filter(profile=profile, movie_id=movie_id).values_list('liked', flat=True).first()
+            if previous is not None:
+                vector -= self._weight(previous) * embedding
+            vector += self._weight(liked) * embedding
+            Feedback.objects.update_or_create(profile=profile, movie_id=movie_id, defaults={'liked': liked})
+            profile.vector = vector.tobytes()
+            profile.model_name = recommender.catalog.model_name
+            profile.revision += 1
+            profile.save()
+
+        cached = self._states.get(profile.key)
+        if cached is not None and cached.revision == profile.revision - 1 and cached.version == recommender.version:
+            self._cache(profile, recommender, vector, set_bits(cached.seen, [row]))
+        return profile
+
+    def mark_seen(self, profile, recommender, state, rows):
+        """Records recommended rows as seen, so later requests of the profile skip them."""
+        if not len(rows):
+            return
+        ids = recommender.movies.ids[np.asarray(rows)]
+        Feedback.objects.bulk_create([Feedback(profile=profile, movie_id=int(i)) for i in ids], ignore_conflicts=True)
+        Profile.objects.filter(pk=profile.pk).update(revision=F('revision') + 1)
+        # if another worker wrote in between, the revisions differ and the next request rebuilds
+        profile.revision = state.revision + 1
+        self._cache(profile, recommender, state.preference, set_bits(state.seen, rows))
+
+    def stats(self):
+        return self._states.stats()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ProfileStore(settings.RECOMMENDER_DISLIKE_WEIGHT, settings.RECOMMENDER_PROFILE_CACHE_SIZE,
+                                      settings.RECOMMENDER_PROFILE_CACHE_BYTES)
+    return _store
@@ -0,0 +1,221 @@
+"""
+Compressed embedding storage with exact re-ranking.
+
+``Int8Quantizer`` stores each dimension as int8 with a per-dimension scale
+(4x smaller than float32). ``ProductQuantizer`` splits vectors into ``m``
+sub-vectors and stores the id of the closest of 256 sub-centroids for each
+(``m`` bytes per vector); queries are scored with a per-query lookup table.
+
+``QuantizedEngine`` scores the whole catalog against the compressed codes,
+keeps the best ``rerank`` candidates and re-scores only those against the
+full-precision (usually memory-mapped) embeddings.
+"""
+import time
+
+import numpy as np
+
+from .engine import normalize_rows, top_k
+
+CHUNK_ROWS = 8192
+# rows of int8 codes widened to float32 at a time when scoring: small enough for the copy to stay in cache
+SCORE_CHUNK_ROWS = 256
+
+
+class Int8Quantizer:
+    kind = 'int8'
+
+    def __init__(self, scale):
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def train(cls, embeddings):
+        scale = np.zeros(embeddings.shape[1], dtype=np.float32)
+        for start in range(0, embeddings.shape[0], CHUNK_ROWS):
+            block = np.asarray(embeddings[start:start + CHUNK_ROWS], dtype=np.float32)
+            np.maximum(scale, np.abs(block).max(axis=0), out=scale)
+        scale /= 127
+        scale[scale == 0] = 1.0
+        return cls(scale)
+
+    def encode(self, embeddings):
+        codes = np.empty(embeddings.shape, dtype=np.int8)
+        for start in range(0, embeddings.shape[0], CHUNK_ROWS):
+            block = np.asarray(embeddings[start:start + CHUNK_ROWS], dtype=np.float32) / self.scale
+            codes[start:start + CHUNK_ROWS] = np.clip(np.rint(block), -127, 127)
+        return codes
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale
+
+    def scores(self, codes, queries):
+        """(queries, rows) approximate scores of a (queries, dim) matrix; a 1D query gives (rows,)."""
+        # (codes * scale) @ q == codes @ (scale * q), without dequantising the catalog. numpy has no
+        # int8 matmul, so each chunk is widened into one reused cache-sized float32 buffer; a batch of
+        # queries shares that conversion.
+        weights = (self.scale * np.atleast_2d(queries)).T
+        out = np.empty((codes.shape[0], weights.shape[1]), dtype=np.float32)
+        block = np.empty((min(SCORE_CHUNK_ROWS, codes.shape[0]), codes.shape[1]), dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_CHUNK_ROWS):
+            chunk = codes[start:start + SCORE_CHUNK_ROWS]
+            widened = block[:chunk.shape[0]]
+            widened[...] = chunk
+            np.matmul(widened, weights, out=out[start:start + SCORE_CHUNK_ROWS])
+        return out.T if np.ndim(queries) == 2 else out[:, 0]
+
+    def to_arrays(self, codes):
+        return {'int8_scale': self.scale, 'int8_codes': codes}
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        if 'int8_scale' not in catalog.arrays or 'int8_codes' not in catalog.arrays:
+            return None, None
+        return cls(catalog.arrays['int8_scale']), catalog.arrays['int8_codes']
+
+
+def _kmeans(points, clusters, iterations, rng):
+    centroids = points[rng.choice(points.shape[0], clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        assignments = np.argmin(distances, axis=1)
+        counts = np.bincount(assignments, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            centroids[empty] = points[rng.choice(points.shape[0], empty.size, replace=False)]
+    return centroids
+
+
+class ProductQuantizer:
+    kind = 'pq'
+
+    def __init__(self, codebooks):
+        # (m, 256, dim // m)
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)
+
+    @property
+    def m(self):
+        return self.codebooks.shape[0]
+
+    @property
+    def sub_dim(self):
+        return self.codebooks.shape[2]
+
+    @classmethod
+    def train(cls, embeddings, m=48, iterations=15, sample_size=20000, seed=0):
+        rows, dim = embeddings.shape
+        if dim % m:
+            raise ValueError(f"Embedding dimension {dim} is not divisible by m={m}")
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(embeddings[np.sort(rng.choice(rows, min(rows, sample_size), replace=False))],
+                            dtype=np.float32)
+        clusters = min(256, sample.shape[0])
+        sub_dim = dim // m
+        codebooks = np.stack([
+            _kmeans(sample[:, j * sub_dim:(j + 1) * sub_dim], clusters, iterations, rng) for j in range(m)
+        ])
+        return cls(codebooks)
+
+    def encode(self, embeddings):
+        rows = embeddings.shape[0]
+        codes = np.empty((rows, self.m), dtype=np.uint8)
+        norms = (self.codebooks ** 2).sum(axis=2)
+        for start in range(0, rows, CHUNK_ROWS):
+            block = np.asarray(embeddings[start:start + CHUNK_ROWS], dtype=np.float32)
+            for j in range(self.m):
+                sub = block[:, j * self.sub_dim:(j + 1) * self.sub_dim]
+                codes[start:start + CHUNK_ROWS, j] = np.argmin(norms[j] - 2 * sub @ self.codebooks[j].T, axis=1)
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def scores(self, codes, queries):
+        """(queries, rows) approximate scores of a (queries, dim) matrix; a 1D query gives (rows,)."""
+        if np.ndim(queries) == 2:
+            return np.stack([self._scores(codes, query) for query in queries])
+        return self._scores(codes, queries)
+
+    def _scores(self, codes, query):
+        # inner product of the query with every sub-centroid, then one table lookup per byte
+        table = np.einsum('jcd,jd->jc', self.codebooks, query.reshape(self.m, self.sub_dim))
+        out = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], CHUNK_ROWS):
+            block = codes[start:start + CHUNK_ROWS]
+            total = np.zeros(block.shape[0], dtype=np.float32)
+            for j in range(self.m):
+                total += table[j][block[:, j]]
+            out[start:start + CHUNK_ROWS] = total
+        return out
+
+    def to_arrays(self, codes):
+        return {'pq_codebooks': self.codebooks, 'pq_codes': codes}
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        if 'pq_codebooks' not in catalog.arrays or 'pq_codes' not in catalog.arrays:
+            return None, None
+        return cls(catalog.arrays['pq_codebooks']), catalog.arrays['pq_codes']
+
+
+QUANTIZERS = {'int8': Int8Quantizer, 'pq': ProductQuantizer}
+
+
+class QuantizedEngine:
+    """Approximate scores from codes, exact re-scoring of the best ``rerank`` rows."""
+
+    def __init__(self, quantizer, codes, embeddings, rerank=256):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.embeddings = embeddings
+        self.rerank = rerank
+
+    @classmethod
+    def from_catalog(cls, catalog, kind, rerank=256):
+        quantizer, codes = QUANTIZERS[kind].from_catalog(catalog)
+        if quantizer is None:
+            return None
+        return cls(quantizer, codes, catalog.embeddings, rerank)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def dim(self):
+        return self.embeddings.shape[1]
+
+    def search(self, query_embedding, k=6, rerank=None, timings=None):
+        """(indices, scores) of the best k rows; ``rerank=0`` skips the exact pass."""
+        indices, scores = self.search_batch(query_embedding, k, rerank, timings)
+        return indices[0], scores[0]
+
+    def search_batch(self, query_embeddings, k=6, rerank=None, timings=None):
+        rerank = self.rerank if rerank is None else rerank
+        start = time.perf_counter()
+        queries = normalize_rows(np.reshape(query_embeddings, (-1, self.dim)))
+        approximate = self.quantizer.scores(self.codes, queries)
+        if timings is not None:
+            start = timings.since('similarity', start)
+        if rerank <= 0:
+            results = [top_k(row, k) for row in approximate]
+            if timings is not None:
+                timings.since('topk', start)
+            return [i for i, _ in results], [s for _, s in results]
+
+        indices, scores = [], []
+        for query, row in zip(queries, approximate):
+            shortlist, _ = top_k(row, max(k, rerank))
+            shortlist = np.sort(shortlist)
+            if timings is not None:
+                start = timings.since('topk', start)
+            exact = np.asarray(self.embeddings[shortlist], dtype=np.float32) @ query
+            if timings is not None:
+                start = timings.since('rerank', start)
+            positions, best = top_k(exact, k)
+            if timings is not None:
+                start = timings.since('topk', start)
+            indices.append(shortlist[positions])
+            scores.append(best)
+        return indices, scores
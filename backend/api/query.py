@@ -0,0 +1,64 @@
+"""
+Compositional query embeddings.
+
+Genre and mood come from a closed vocabulary whose vectors are encoded once at
+build time (see ``vocabulary_texts``). A wizard query is then a weighted sum of
+those vectors plus an encoding of the free-text fields only, and needs no
+model call at all when the free-text fields are empty.
+"""
+import numpy as np
+
+from .engine import normalize_rows
+from .vocabulary import free_text
+
+DEFAULT_WEIGHTS = {'genre': 1.0, 'mood': 1.0, 'text': 1.0}
+
+
+class QueryComposer:
+
+    def __init__(self, keys, vectors, weights=None):
+        self.vectors = normalize_rows(vectors)
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+
+    @classmethod
+    def from_catalog(cls, catalog, weights=None):
+        """Composer for a catalog built with a vocabulary table, else None."""
+        keys = catalog.metadata.get('vocabulary')
+        if not keys or 'vocabulary' not in catalog.arrays:
+            return None
+        return cls(keys, catalog.arrays['vocabulary'], weights)
+
+    def vector(self, key):
+        i = self.index.get(key)
+        return None if i is None else self.vectors[i]
+
+    def text_to_encode(self, genre='', content='', element=''):
+        """The part of a query that still needs the model ("" if none)."""
+        text = free_text(content, element)
+        if self.vector(f"genre:{genre}") is None and str(genre).strip():
+            text = f"A {genre} movie. {text}".strip()
+        return text
+
+    def compose(self, genre='', mood='', content='', element='', encode=None):
+        """
+        Query embedding for a wizard selection. ``encode(text)`` is only called
+        for the free-text part, or for a genre that is not in the vocabulary.
+        """
+        parts = []
+
+        genre_vector = self.vector(f"genre:{genre}")
+        if genre_vector is not None:
+            parts.append(self.weights['genre'] * genre_vector)
+
+        mood_vector = self.vector(f"mood:{mood}")
+        if mood_vector is not None:
+            parts.append(self.weights['mood'] * mood_vector)
+
+        text = self.text_to_encode(genre, content, element)
+        if text:
+            parts.append(self.weights['text'] * normalize_rows(encode(text)))
+
+        if not parts:
+            return np.zeros(self.vectors.shape[1], dtype=np.float32)
+        return normalize_rows(np.sum(parts, axis=0))
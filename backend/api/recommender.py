@@ -0,0 +1,357 @@
+"""
+Python API behind /api/recommend/ and /api/recommend/batch/.
+
+``Recommender`` ties a loaded catalog, its retrieval engine and the sentence
+encoder together. Single and batch requests share the same code path; a batch
+encodes all of its uncached query texts in one ``model.encode`` call and ranks
+all queries with one matrix-matrix product.
+"""
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .ann import IVFIndex
+from .cache import LRUCache, QueryEmbeddingCache, TTLCache, normalize_query
+from .engine import RetrievalEngine, normalize_rows
+from .filters import FilterIndex, parse_filters
+from .layout import CatalogMap
+from .neighbors import NeighborTable
+from .pagination import CandidateCache, CursorExpired, decode_cursor, new_cursor_id, page
+from .payload import MovieStore, RankedList, render_batch
+from .quantization import QuantizedEngine
+from .shards import ShardedEngine, ShardError
+from .vocabulary import build_query_text
+
+DEFAULT_K = 6
+# candidates ranked for the first page of a paged search
+PAGE_DEPTH = 100
+
+TEXT_FIELDS = ('genre', 'mood', 'content', 'element')
+
+WizardQuery = namedtuple('WizardQuery', TEXT_FIELDS + ('filters',), defaults=(None,))
+
+
+def build_engine(catalog, search='exact', nprobe=16, rerank=256, shards=4, shard_threads=1, affinity=None):
+    """
+    Search engine for a catalog: 'exact' scans every row, 'ivf' uses the
+    catalog's IVF index, 'int8'/'pq' scan the quantized codes and re-rank the
+    best ``rerank`` rows exactly, 'sharded' scans ``shards`` slices of the
+    catalog in worker processes. Falls back to exact search when the catalog
+    was built without the requested index.
+    """
+    if search == 'sharded':
+        return ShardedEngine.from_catalog(catalog, shards, shard_threads, affinity)
+    if search == 'ivf':
+        index = IVFIndex.from_catalog(catalog, nprobe)
+        if index is not None:
+            return index
+        print(" Catalog has no IVF index, falling back to exact search.")
+    elif search in ('int8', 'pq'):
+        index = QuantizedEngine.from_catalog(catalog, search, rerank)
+        if index is not None:
+            return index
+        print(f" Catalog has no {search} codes, falling back to exact search.")
+    elif search != 'exact':
+        raise ValueError(f"Unknown search mode '{search}'")
+    return RetrievalEngine(catalog.embeddings, normalized=catalog.manifest.get('normalized', False))
+
+
+def parse_query(data):
+    """WizardQuery from a request payload; raises ValueError for malformed input."""
+    if not isinstance(data, dict):
+        raise ValueError("Each query must be a JSON object.")
+    fields = []
+    for name in TEXT_FIELDS:
+        value = data.get(name, '')
+        if value is None:
+            value = ''
+        if not isinstance(value, str):
+            raise ValueError(f"'{name}' must be a string.")
+        fields.append(value)
+    return WizardQuery(*fields, filters=parse_filters(data.get('filters')))
+
+
+def is_blank(query):
+    return not any(getattr(query, name) for name in TEXT_FIELDS) and query.filters is None
+
+
+class Recommender:
+
+    def __init__(self, catalog, model, composer=None, query_cache=None, result_cache=None, engine=None,
+                 hybrid=None, cursor_cache=None, page_depth=PAGE_DEPTH):
+        self.catalog = catalog
+        self.model = model
+        self.composer = composer
+        self.engine = engine if engine is not None else build_engine(catalog)
+        # filtered searches scan their row subset exactly, whatever the configured engine
+        self.exact_engine = self.engine if isinstance(self.engine, RetrievalEngine) else build_engine(catalog)
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache(catalog.version)
+        self.result_cache = result_cache if result_cache is not None else LRUCache(0)
+        self.movies = MovieStore(catalog)
+        self._filter_index = None
+        self.neighbors = NeighborTable.from_catalog(catalog)
+        self.map = CatalogMap.from_catalog(catalog)
+        # lexical.HybridRetriever, or None for dense-only retrieval
+        self.hybrid = hybrid
+        self.candidates = CandidateCache(cursor_cache if cursor_cache is not None else TTLCache())
+        self.page_depth = page_depth
+
+    @property
+    def filter_index(self):
+        if self._filter_index is None:
+            self._filter_index = FilterIndex.from_catalog(self.catalog)
+        return self._filter_index
+
+    @property
+    def version(self):
+        return self.catalog.version
+
+    def query_text(self, query):
+        return build_query_text(query.genre, query.mood, query.content, query.element)
+
+    def _text_to_encode(self, query):
+        if self.composer is not None:
+            return self.composer.text_to_encode(query.genre, query.content, query.element)
+        return self.query_text(query)
+
+    def encode_texts(self, texts):
+        """
+        {text: embedding} for the given texts. Cache misses are encoded together
+        in a single model call.
+        """
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(t for t in texts if t):
+            cached = self.query_cache.get(text)
+            if cached is None:
+                missing.append(text)
+            else:
+                vectors[text] = cached
+        if missing:
+            encoded = self.model.encode(missing)
+            for text, vector in zip(missing, encoded):
+                vectors[text] = self.query_cache.set(text, vector)
+        return vectors
+
+    def embed_many(self, queries):
+        texts = [self._text_to_encode(q) for q in queries]
+        vectors = self.encode_texts(texts)
+        if self.composer is None:
+            return np.stack([vectors[t] for t in texts])
+        return np.stack([
+            self.composer.compose(q.genre, q.mood, q.content, q.element, encode=vectors.__getitem__) for q in queries
+        ])
+
+    def embed(self, query):
+        return self.embed_many([query])[0]
+
+    def _result_key(self, query, k):
+        return (self.version, self.composer is not None, normalize_query(self.query_text(query)), query.filters, k)
+
+    def recommend(self, query, k=DEFAULT_K):
+        return self.rank_batch([query], k)[0].to_list()
+
+    def recommend_batch(self, queries, k=DEFAULT_K):
+        """Result dicts for a list of WizardQuery, in input order."""
+        return [ranked.to_list() for ranked in self.rank_batch(queries, k)]
+
+    def render(self, query, k=DEFAULT_K, timings=None):
+        """JSON bytes of the results, rendered from the pre-serialised catalog payloads."""
+        ranked = self.rank_batch([query], k, timings)[0]
+        start = time.perf_counter()
+        body = ranked.to_json()
+        if timings is not None:
+            timings.since('serialize', start)
+        return body
+
+    def rank_page(self, query, k=DEFAULT_K, cursor=None, timings=None):
+        """
+        (RankedList, next cursor or None) of one page of results. Without a
+        cursor the top ``page_depth`` candidates are ranked and kept under a
+        new cursor; with one the page is cut from the kept candidates. When a
+        cursor has expired the candidates are ranked again from ``query`` if
+        the request repeated it, else CursorExpired is raised.
+        """
+        candidates, offset = None, 0
+        if cursor is not None:
+            cursor_id, offset = decode_cursor(cursor)
+            start = time.perf_counter()
+            candidates = self.candidates.get(cursor_id)
+            if timings is not None:
+                timings.since('cursor', start)
+            if candidates is None and is_blank(query):
+                raise CursorExpired("Cursor expired, repeat the search.")
+
+        if candidates is None:
+            # an expired cursor's list is kept under a fresh id, never one the client chose
+            cursor_id = new_cursor_id()
+            ranked = self.rank_batch([query], max(k, self.page_depth), timings)[0]
+            candidates = self.candidates.put(cursor_id, ranked.indices, ranked.scores)
+        indices, scores, next_cursor = page(candidates, offset, k, cursor_id)
+        return RankedList(self.movies, indices, scores), next_cursor
+
+    def render_page(self, query, k=DEFAULT_K, cursor=None, timings=None):
+        """JSON bytes of ``rank_page``: {"results": [...], "next_cursor": "..." | null}."""
+        ranked, next_cursor = self.rank_page(query, k, cursor, timings)
+        start = time.perf_counter()
+        body = b'{"results":' + ranked.to_json() + b',"next_cursor":' + json.dumps(next_cursor).encode() + b'}'
+        if timings is not None:
+            timings.since('serialize', start)
+        return body
+
+    def rank_batch(self, queries, k=DEFAULT_K, timings=None):
+        """
+        RankedList per WizardQuery, in input order. Cached rankings are
+        reused; the rest are embedded and ranked together. Stage durations
+        are added to ``timings`` (a metrics.Timings) when given.
+        """
+        results = [None] * len(queries)
+        pending = []
+        for i, query in enumerate(queries):
+            cached = self.result_cache.get(self._result_key(query, k))
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        if pending:
+            start = time.perf_counter()
+            embeddings = self.embed_many([queries[i] for i in pending])
+            if timings is not None:
+                timings.since('encode', start)
+            all_indices, all_scores = self._search([queries[i] for i in pending], embeddings, k, timings)
+            for i, indices, scores in zip(pending, all_indices, all_scores):
+                results[i] = RankedList(self.movies, indices, scores)
+                self.result_cache.set(self._result_key(queries[i], k), results[i])
+        return results
+
+    def rank_personal(self, query, preference, seen, k=DEFAULT_K, weight=0.5, timings=None):
+        """
+        RankedList for a session profile: the query's embedding blended with
+        the profile's ``preference`` vector (``weight`` is the preference
+        share), scored in one scan with the rows of the packed bitset ``seen``
+        masked out. A query without text ranks by the preferences alone.
+        Raises ValueError when there is neither.
+        """
+        parts = []
+        if any(getattr(query, name) for name in TEXT_FIELDS):
+            start = time.perf_counter()
+            parts.append((1 - weight) * normalize_rows(self.embed(query)))
+            if timings is not None:
+                timings.since('encode', start)
+        if np.any(preference):
+            parts.append((weight if parts else 1.0) * normalize_rows(preference))
+        if not parts:
+            raise ValueError("Nothing to rank by: like a movie or fill in the query.")
+
+        rows = None
+        if query.filters is not None:
+            start = time.perf_counter()
+            rows = self.filter_index.rows(query.filters)
+            if timings is not None:
+                timings.since('filter', start)
+        indices, scores = self.exact_engine.search_excluding(sum(parts)[None], seen, k, rows, timings=timings)
+        keep = np.isfinite(scores[0])
+        return RankedList(self.movies, indices[0][keep], scores[0][keep])
+
+    def has_neighbors(self, k):
+        """Whether similar(..., k) is a neighbour-table lookup rather than a catalog scan."""
+        return self.neighbors is not None and k <= self.neighbors.width
+
+    def similar(self, movie_id, k=DEFAULT_K):
+        """
+        RankedList of the movies most similar to a movie, or None for an
+        unknown id. Reads the precomputed neighbour table; catalogs built
+        without one fall back to scanning with the movie's embedding.
+        """
+        row = self.movies.row_for_id(movie_id)
+        if row is None:
+            return None
+        if self.has_neighbors(k):
+            rows, scores = self.neighbors.neighbors(row, k)
+            return RankedList(self.movies, rows, scores)
+
+        embedding = np.asarray(self.catalog.embeddings[row:row + 1], dtype=np.float32)
+        indices, scores = self.exact_engine.search_batch(embedding, k + 1)
+        keep = indices[0] != row
+        return RankedList(self.movies, indices[0][keep][:k], scores[0][keep][:k])
+
+    def _search_all(self, embeddings, k, timings=None):
+        """The configured engine's results; while a sharded engine is down the exact engine answers."""
+        if getattr(self.engine, 'error', None) is None:
+            try:
+                return self.engine.search_batch(embeddings, k, timings=timings)
+            except ShardError:
+                pass
+        return self.exact_engine.search_batch(embeddings, k, timings=timings)
+
+    def _search(self, queries, embeddings, k, timings=None):
+        """
+        Per-query (indices, scores). Unfiltered queries go to the configured
+        engine; filtered ones are scored only over the rows their filters
+        select, one group per distinct filter. In hybrid mode the dense
+        results of queries with content/element words are fused with BM25.
+        """
+        groups = {}
+        for i, query in enumerate(queries):
+            groups.setdefault(query.filters, []).append(i)
+
+        depth = k if self.hybrid is None else max(k, self.hybrid.depth)
+        all_indices, all_scores = [None] * len(queries), [None] * len(queries)
+        for filters, members in groups.items():
+            rows = None
+            if filters is None:
+                found = self._search_all(embeddings[members], depth, timings)
+            else:
+                start = time.perf_counter()
+                rows = self.filter_index.rows(filters)
+                if timings is not None:
+                    timings.since('filter', start)
+                found = self.exact_engine.search_rows(embeddings[members], rows, depth, timings=timings)
+
+            for i, indices, scores in zip(members, *found):
+                words = f"{queries[i].content} {queries[i].element}".strip()
+                if self.hybrid is not None and words:
+                    indices, scores = self.hybrid.combine(
+                        words, (indices, scores), embeddings[i], k, allowed=rows, timings=timings)
+                all_indices[i], all_scores[i] = indices[:k], scores[:k]
+        return all_indices, all_scores
+
+    def _rank_payloads(self, payloads, k, timings=None):
+        start = time.perf_counter()
+        items = [None] * len(payloads)
+        positions, queries = [], []
+        for i, payload in enumerate(payloads):
+            try:
+                queries.append(parse_query(payload))
+                positions.append(i)
+            except ValueError as e:
+                items[i] = {"error": str(e)}
+
+        if timings is not None:
+            timings.since('query', start)
+        for i, ranked in zip(positions, self.rank_batch(queries, k, timings)):
+            items[i] = ranked
+        return items
+
+    def recommend_payloads(self, payloads, k=DEFAULT_K):
+        """
+        Batch API over raw request payloads. Each item becomes either
+        {"results": [...]} or {"error": "..."}, so one bad payload does not
+        fail the rest of the batch.
+        """
+        return [
+            {"results": item.to_list()} if isinstance(item, RankedList) else item
+            for item in self._rank_payloads(payloads, k)
+        ]
+
+    def render_payloads(self, payloads, k=DEFAULT_K, timings=None):
+        """``recommend_payloads`` as JSON bytes."""
+        items = self._rank_payloads(payloads, k, timings)
+        start = time.perf_counter()
+        body = render_batch(items)
+        if timings is not None:
+            timings.since('serialize', start)
+        return body
@@ -0,0 +1,239 @@
+"""
+Scatter-gather search over shard worker processes.
+
+For catalogs of millions of rows one in-process scan per request is too slow,
+and NumPy's BLAS threads compete with the web workers for the same cores.
+``ShardedEngine`` splits the embedding rows into ``n`` contiguous shards and
+starts one long-lived process per shard. Each process maps only its rows of
+the catalog's ``embeddings.npy`` (the page cache is shared, nothing is
+copied), optionally pinned to its own CPUs and limited to ``threads`` BLAS
+threads.
+
+A search sends the normalised query matrix to every shard, each shard
+answers with its own top k, and the n * k candidates are merged into the
+global top k. Messages are raw float32/int32 bytes over a pipe per shard.
+
+When a shard process dies the engine shuts the other shards down (their
+pipes hold unread replies), records ``error`` and respawns all of them on a
+background thread. Searches raise ``ShardError`` until the new processes are
+up; the recommender serves from its exact in-process engine meanwhile.
+"""
+import os
+import struct
+import threading
+import time
+import weakref
+from multiprocessing import get_context
+
+import numpy as np
+
+from .engine import RetrievalEngine, normalize_rows, top_k_rows
+from .threads import thread_env
+
+HEADER = struct.Struct('<ii')
+
+
+def shard_bounds(rows, n):
+    """(start, stop) of each of ``n`` near-equal contiguous shards."""
+    edges = np.linspace(0, rows, n + 1).astype(np.int64)
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def split_cpus(n, cpus=None):
+    """
+    CPU sets for ``n`` shards: the available CPUs split into contiguous
+    groups, or one CPU each round-robin when there are fewer CPUs than shards.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    if len(cpus) < n:
+        return [[cpus[i % len(cpus)]] for i in range(n)]
+    return [group.tolist() for group in np.array_split(np.asarray(cpus), n)]
+
+
+def _serve_shard(conn, path, start, stop, normalized, cpus):
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    engine = RetrievalEngine(np.load(path, mmap_mode='r')[start:stop], normalized=normalized)
+    try:
+        conn.send_bytes(HEADER.pack(len(engine), engine.dim))
+        while True:
+            message = conn.recv_bytes()
+            n, k = HEADER.unpack_from(message)
+            queries = np.frombuffer(message, dtype=np.float32, offset=HEADER.size).reshape(n, engine.dim)
+            indices, scores = top_k_rows(queries @ engine.embeddings.T, k)
+            conn.send_bytes(HEADER.pack(*indices.shape) + indices.astype(np.int32).tobytes()
+                            + scores.astype(np.float32).tobytes())
+    except (EOFError, OSError):
+        # the engine was closed
+        return
+
+
+def _shutdown(conns, processes):
+    for conn in conns:
+        conn.close()
+    for process in processes:
+        process.join(5)
+        if process.is_alive():
+            process.terminate()
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardedEngine:
+
+    def __init__(self, path, rows, dim, n_shards=4, normalized=True, threads=1, affinity=None):
+        """
+        ``path`` is an embeddings .npy of (rows, dim). ``affinity`` is None
+        (no pinning), 'auto' (split the available CPUs between the shards) or
+        a list of CPU lists, one per shard.
+        """
+        n_shards = max(1, min(n_shards, rows))
+        self.path = path
+        self.rows = rows
+        self._dim = dim
+        self.normalized = normalized
+        self.threads = threads
+        self.bounds = shard_bounds(rows, n_shards)
+        if affinity == 'auto':
+            affinity = split_cpus(n_shards)
+        self.affinity = affinity
+        # set while the shards are down after a failure; cleared once they were respawned
+        self.error = None
+        self.restarts = 0
+        # True while a respawn after a failure is under way
+        self.recovering = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._conns, self._processes, self._finalizer = self._spawn()
+
+    def _spawn(self):
+        """Starts one process per shard and waits until each has mapped its rows."""
+        context = get_context('spawn')
+        conns, processes = [], []
+        # spawned children inherit the environment, so BLAS reads it before its first import
+        with thread_env(self.threads):
+            for i, (start, stop) in enumerate(self.bounds):
+                parent, child = context.Pipe()
+                cpus = self.affinity[i] if self.affinity else None
+                process = context.Process(target=_serve_shard,
+                                          args=(child, self.path, start, stop, self.normalized, cpus),
+                                          name=f'shard-{i}', daemon=True)
+                process.start()
+                child.close()
+                conns.append(parent)
+                processes.append(process)
+        # stop the workers when this engine is dropped, e.g. after a catalog reload
+        finalizer = weakref.finalize(self, _shutdown, conns, processes)
+
+        for i, conn in enumerate(conns):
+            try:
+                shard_rows, shard_dim = HEADER.unpack(conn.recv_bytes())
+            except EOFError:
+                finalizer()
+                raise ShardError(f"Shard {i} failed to start (exit code {processes[i].exitcode})")
+            start, stop = self.bounds[i]
+            if (shard_rows, shard_dim) != (stop - start, self.dim):
+                finalizer()
+                raise ShardError(f"Shard {i} mapped {shard_rows}x{shard_dim}, expected {stop - start}x{self.dim}")
+        return conns, processes, finalizer
+
+    def _respawn(self):
+        try:
+            shards = self._spawn()
+        except Exception as e:
+            self.error = f"{self.error}; respawn failed: {e}"
+            self.recovering = False
+            print(f" Sharded engine stays down: {self.error}")
+            return
+        with self._lock:
+            self.recovering = False
+            if self._closed:
+                shards[2]()
+                return
+            self._conns, self._processes, self._finalizer = shards
+            self.error = None
+            self.restarts += 1
+        print(f" Respawned {self.n_shards} shards.")
+
+    @classmethod
+    def from_catalog(cls, catalog, n_shards=4, threads=1, affinity=None):
+        path = os.path.join(catalog.path, catalog.manifest['embeddings']['file'])
+        return cls(path, len(catalog), catalog.embeddings.shape[1], n_shards,
+                   normalized=catalog.manifest.get('normalized', False), threads=threads, affinity=affinity)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def dim(self):
+        return self._dim
+
+    @property
+    def n_shards(self):
+        return len(self.bounds)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._finalizer()
+
+    def search(self, query_embedding, k=6):
+        indices, scores = self.search_batch(np.reshape(query_embedding, (1, -1)), k)
+        return indices[0], scores[0]
+
+    def search_batch(self, query_embeddings, k=6, timings=None):
+        """Scatters the queries to every shard and merges their top k; row i belongs to query i."""
+        start = time.perf_counter()
+        queries = normalize_rows(np.reshape(query_embeddings, (-1, self.dim)))
+        message = HEADER.pack(len(queries), k) + queries.tobytes()
+        # one scatter-gather at a time: replies on a pipe must match their requests
+        with self._lock:
+            if self._closed:
+                raise ShardError("Sharded engine is closed")
+            if self.error is not None:
+                raise ShardError(self.error)
+            replies = []
+            i = 0
+            try:
+                for i, conn in enumerate(self._conns):
+                    conn.send_bytes(message)
+                for i, conn in enumerate(self._conns):
+                    replies.append(conn.recv_bytes())
+            except (EOFError, OSError):
+                # the other shards' replies are still unread, so their pipes are out of step:
+                # shut every shard down rather than hand a later search the wrong reply
+                self.error = f"Shard {i} failed (exit code {self._processes[i].exitcode})"
+                self._finalizer()
+                self.recovering = True
+                print(f" {self.error}, respawning the shards.")
+                threading.Thread(target=self._respawn, name='shard-respawn', daemon=True).start()
+                raise ShardError(self.error)
+        if timings is not None:
+            start = timings.since('similarity', start)
+
+        all_indices, all_scores = [], []
+        for (shard_start, _), reply in zip(self.bounds, replies):
+            n, shard_k = HEADER.unpack_from(reply)
+            indices = np.frombuffer(reply, dtype=np.int32, count=n * shard_k, offset=HEADER.size)
+            scores = np.frombuffer(reply, dtype=np.float32, offset=HEADER.size + indices.nbytes)
+            all_indices.append(indices.reshape(n, shard_k).astype(np.int64) + shard_start)
+            all_scores.append(scores.reshape(n, shard_k))
+        candidates = np.concatenate(all_indices, axis=1)
+        positions, top_scores = top_k_rows(np.concatenate(all_scores, axis=1), k)
+        result = np.take_along_axis(candidates, positions, axis=1), top_scores
+        if timings is not None:
+            timings.since('topk', start)
+        return result
+
+    def stats(self):
+        return {
+            'shards': self.n_shards,
+            'rows': [stop - start for start, stop in self.bounds],
+            'affinity': self.affinity,
+            'alive': sum(process.is_alive() for process in self._processes),
+            'error': self.error,
+            'restarts': self.restarts,
+        }
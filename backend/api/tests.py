@@ -1,3 +1,1351 @@
-from django.test import TestCase
+import asyncio
+import gc
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+
+from . import views
+from .ann import IVFIndex
+from .artifacts import (ArtifactError, CatalogWriter, current_version, list_versions, load_catalog, new_version,
+                        write_catalog)
+from .batching import MicroBatchEncoder
+from .build import IncrementalPlan, Interner, assemble_embeddings, content_hash, parse_json_col, prepare_records
+from .cache import LRUCache, QueryEmbeddingCache, SQLiteCache, TTLCache
+from .encoders import ENCODERS, HASH_MODEL_NAME, HashEncoder, OnnxEncoder, encoder_class, load_encoder, onnx_dir
+from .engine import RetrievalEngine, normalize_rows, top_k, top_k_rows
+from .executor import BoundedExecutor, Overloaded
+from .filters import FilterIndex, parse_filters
+from .layout import GRID, TILE_HEADER, CatalogMap, catalog_map, morton_codes
+from .lexical import HybridRetriever, LexicalIndex, LexicalIndexBuilder, reciprocal_rank_fusion, tokenize
+from .loader import FAILED, LOADING, READY, ModelLoader, install_reload_signal, loader, should_load_on_startup
+from .metrics import Histogram, LabeledHistogram, RequestMetrics, Timings
+from .neighbors import NeighborTable, _block_neighbors, neighbor_table, worker_bytes
+from .models import Profile
+from .pagination import CursorExpired, decode_cursor, encode_cursor, parse_k, parse_paging
+from .payload import MovieStore, RankedList, render_batch
+from .profiles import seen_bitset, set_bits
+from .quantization import Int8Quantizer, ProductQuantizer, QuantizedEngine
+from .query import QueryComposer
+from .recommender import Recommender, WizardQuery, build_engine, parse_query
+from .shards import ShardedEngine, ShardError, shard_bounds, split_cpus
+from .threads import THREAD_ENV, cgroup_cpu_limit, plan, thread_env, web_workers
+from .vocabulary import vocabulary_texts
+
+
+def random_embeddings(rows, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((rows, dim)).astype(np.float32)
+
+
+CATALOG_COLUMNS = ['id', 'title', 'overview', 'keywords_str', 'year', 'rating', 'runtime', 'payload_json',
+                   'content_hash']
+TEST_GENRES = [['Action'], ['Comedy'], ['Drama', 'Romance'], ['Horror', 'Thriller'], ['Science Fiction', 'Adventure']]
+TEST_WORDS = ['heist', 'robot', 'zombie', 'wedding', 'space', 'dog', 'school', 'war', 'ship', 'family', 'city',
+              'detective', 'dragon', 'island', 'music']
+
+
+def movie_records(rows, seed=0):
+    """CSV-like columns of ``rows`` synthetic TMDB movies, ids 1..rows."""
+    rng = np.random.default_rng(seed)
+    words = [' '.join(rng.choice(TEST_WORDS, 6)) for _ in range(rows)]
+    return {
+        'id': list(range(1, rows + 1)),
+        'title': [f'Movie {i}' for i in range(1, rows + 1)],
+        'genres': [json.dumps([{'name': g} for g in TEST_GENRES[i % len(TEST_GENRES)]]) for i in range(rows)],
+        'overview': [f'A story about {w}.' for w in words],
+        'keywords': [json.dumps([{'name': w} for w in text.split()[:2]]) for text in words],
+        'release_date': [f'{1950 + i % 70}-05-01' if i % 13 else '' for i in range(rows)],
+        'vote_average': rng.uniform(1, 9, rows).round(1).tolist(),
+        'runtime': rng.integers(70, 180, rows).astype(float).tolist(),
+    }
+
+
+def write_test_catalog(root, rows=300, version=None, records=None, encoder=None, arrays=None):
+    """Writes a catalog of synthetic movies embedded with the hash encoder; returns the loaded Catalog."""
+    encoder = encoder or HashEncoder()
+    prepared = prepare_records(records or movie_records(rows), HASH_MODEL_NAME)
+    genres = Interner()
+    columns = {name: prepared[name] for name in CATALOG_COLUMNS}
+    columns['genre_id'] = genres(prepared['genres_str'])
+    vocab_keys, vocab_texts = zip(*vocabulary_texts())
+    all_arrays = {'vocabulary': encoder.encode(list(vocab_texts))}
+    all_arrays.update(arrays or {})
+    write_catalog(root, encoder.encode(prepared['semantic_text']), columns, HASH_MODEL_NAME, version=version,
+                  arrays=all_arrays, metadata={'genres': genres.values, 'vocabulary': list(vocab_keys)})
+    return load_catalog(root, version)
+
+
+class CountingEncoder(HashEncoder):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def encode(self, sentences, *args, **kwargs):
+        self.calls.append(sentences)
+        return super().encode(sentences, *args, **kwargs)
+
+
+class TempDirTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+
+class ServingTestCase(TempDirTestCase):
+    """Serves a recommender over a synthetic catalog through the URLconf, without the background loader."""
+
+    rows = 300
+
+    def make_recommender(self, catalog):
+        return Recommender(catalog, CountingEncoder())
+
+    def setUp(self):
+        super().setUp()
+        self.recommender = self.make_recommender(write_test_catalog(self.tmp, self.rows))
+        saved = loader.state, loader.recommender
+        loader.state, loader.recommender = READY, self.recommender
+        self.addCleanup(setattr, loader, 'recommender', saved[1])
+        self.addCleanup(setattr, loader, 'state', saved[0])
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+
+class RetrievalEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.embeddings = random_embeddings(200)
+        self.engine = RetrievalEngine(self.embeddings)
+
+    def brute_force(self, query, k):
+        unit = self.embeddings / np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        scores = unit @ (query / np.linalg.norm(query))
+        return np.argsort(-scores, kind='stable')[:k], np.sort(scores)[::-1][:k]
+
+    def test_search_matches_full_sort(self):
+        query = random_embeddings(1, seed=1)[0]
+        indices, scores = self.engine.search(query, k=10)
+        expected_indices, expected_scores = self.brute_force(query, 10)
+        self.assertEqual(indices.tolist(), expected_indices.tolist())
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_search_batch_rows_match_single_searches(self):
+        queries = random_embeddings(4, seed=2)
+        indices, scores = self.engine.search_batch(queries, k=5)
+        self.assertEqual(indices.shape, (4, 5))
+        for row, query in enumerate(queries):
+            single_indices, single_scores = self.engine.search(query, k=5)
+            self.assertEqual(indices[row].tolist(), single_indices.tolist())
+            np.testing.assert_allclose(scores[row], single_scores, rtol=1e-5)
+
+    def test_search_rows_only_returns_given_rows(self):
+        rows = np.arange(0, 200, 7)
+        query = random_embeddings(1, seed=3)
+        indices, _ = self.engine.search_rows(query, rows, k=5)
+        self.assertTrue(set(indices[0].tolist()) <= set(rows.tolist()))
+        scores = normalize_rows(self.embeddings[rows]) @ normalize_rows(query)[0]
+        self.assertEqual(indices[0].tolist(), rows[np.argsort(-scores, kind='stable')[:5]].tolist())
+
+    def test_k_larger_than_catalog(self):
+        indices, scores = top_k(np.array([0.1, 0.9, 0.5], dtype=np.float32), 10)
+        self.assertEqual(indices.tolist(), [1, 2, 0])
+        indices, _ = top_k_rows(np.array([[0.1, 0.9, 0.5]], dtype=np.float32), 0)
+        self.assertEqual(indices.shape, (1, 0))
+
+    def test_zero_rows_stay_zero(self):
+        normalized = normalize_rows(np.array([[0, 0], [3, 4]], dtype=np.float32))
+        np.testing.assert_allclose(normalized, [[0, 0], [0.6, 0.8]])
+
+    def test_version_names_are_unique_and_sorted(self):
+        versions = [new_version() for _ in range(50)]
+        self.assertEqual(len(set(versions)), len(versions))
+        self.assertEqual(sorted(versions), versions)
+
+
+class FilterIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        genres = ['Action', 'Comedy', 'Action Comedy']
+        self.index = FilterIndex.build(
+            genre_ids=np.array([0, 1, 2, 0, 1], dtype=np.int32),
+            genre_strings=genres,
+            year=np.array([1994, 2001, 0, 1999, 1990], dtype=np.int16),
+            runtime=np.array([100, 130, 90, 0, 95], dtype=np.int16),
+            rating=np.array([7.0, 7.2, 7.3, 5.5, 7.2], dtype=np.float32),
+        )
+
+    def rows(self, data):
+        return self.index.rows(parse_filters(data)).tolist()
+
+    def test_float_bounds_are_inclusive(self):
+        self.assertEqual(self.rows({'rating_min': 7.2}), [1, 2, 4])
+        self.assertEqual(self.rows({'rating_max': 7.2}), [0, 1, 3, 4])
+        self.assertEqual(self.rows({'rating_min': 7.2, 'rating_max': 7.2}), [1, 4])
+
+    def test_integer_bounds_are_inclusive(self):
+        self.assertEqual(self.rows({'year_min': 1990, 'year_max': 1999}), [0, 3, 4])
+        self.assertEqual(self.rows({'runtime_max': 100}), [0, 2, 4])
+
+    def test_unknown_zero_is_excluded_by_any_range(self):
+        self.assertEqual(self.rows({'year_max': 3000}), [0, 1, 3, 4])
+        self.assertEqual(self.rows({'runtime_min': 0}), [0, 1, 2, 4])
+
+    def test_genres_and_ranges_combine(self):
+        self.assertEqual(self.rows({'genres': ['Comedy']}), [1, 2, 4])
+        self.assertEqual(self.rows({'genres': ['Action', 'Comedy']}), [2])
+        self.assertEqual(self.rows({'genres': ['Comedy'], 'rating_min': 7.25}), [2])
+
+    def test_invalid_filters(self):
+        self.assertIsNone(parse_filters({}))
+        for data in ({'genres': ['Western-ish']}, {'rating_min': '7'}, {'stars': 5}, []):
+            with self.assertRaises(ValueError):
+                parse_filters(data)
+
+
+class ArtifactTests(TempDirTestCase):
+
+    def columns(self, rows):
+        return {
+            'id': np.arange(rows, dtype=np.int32) + 100,
+            'title': [f'Movie {i} \u00e9' for i in range(rows)],
+            'rating': np.linspace(0, 10, rows).astype(np.float32),
+        }
+
+    def test_round_trip(self):
+        embeddings = random_embeddings(20)
+        path = write_catalog(self.tmp, embeddings, self.columns(20), 'test-model', version='v1',
+                             arrays={'extra': np.eye(3)}, metadata={'genres': ['Action']})
+        catalog = load_catalog(self.tmp, verify=True)
+
+        self.assertEqual(catalog.path, path)
+        self.assertEqual((catalog.version, catalog.model_name, len(catalog)), ('v1', 'test-model', 20))
+        self.assertIsInstance(catalog.embeddings, np.memmap)
+        np.testing.assert_allclose(catalog.embeddings, normalize_rows(embeddings))
+        self.assertEqual(catalog['id'].tolist(), list(range(100, 120)))
+        self.assertEqual(catalog['title'][3], 'Movie 3 \u00e9')
+        self.assertEqual(list(catalog['title'])[-1], 'Movie 19 \u00e9')
+        np.testing.assert_array_equal(catalog.arrays['extra'], np.eye(3))
+        self.assertEqual(catalog.metadata, {'genres': ['Action']})
+
+    def test_chunked_writes_match_one_write(self):
+        embeddings, columns = random_embeddings(30), self.columns(30)
+        writer = CatalogWriter(self.tmp, 'test-model', 16, version='chunked')
+        for start in (0, 10, 20):
+            writer.append(embeddings[start:start + 10], {k: v[start:start + 10] for k, v in columns.items()})
+        writer.finish()
+        write_catalog(self.tmp, embeddings, columns, 'test-model', version='whole')
+
+        chunked, whole = load_catalog(self.tmp, 'chunked'), load_catalog(self.tmp, 'whole')
+        np.testing.assert_array_equal(chunked.embeddings, whole.embeddings)
+        self.assertEqual(list(chunked['title']), list(whole['title']))
+        self.assertEqual(current_version(self.tmp), 'whole')
+        self.assertEqual(list_versions(self.tmp), ['chunked', 'whole'])
+
+    def test_failed_write_publishes_nothing(self):
+        with self.assertRaises(ArtifactError):
+            write_catalog(self.tmp, random_embeddings(5), {'id': np.arange(4)}, 'test-model', version='bad')
+        self.assertEqual(os.listdir(self.tmp), [])
+        with self.assertRaises(ArtifactError):
+            load_catalog(self.tmp)
+
+    def test_existing_version_is_not_overwritten(self):
+        write_catalog(self.tmp, random_embeddings(5), self.columns(5), 'test-model', version='v1')
+        with self.assertRaises(ArtifactError):
+            CatalogWriter(self.tmp, 'test-model', 16, version='v1')
+
+    def test_checksum_and_format_are_checked(self):
+        path = write_catalog(self.tmp, random_embeddings(5), self.columns(5), 'test-model', version='v1')
+        with open(os.path.join(path, 'embeddings.npy'), 'r+b') as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b'\0\0\0\0')
+        load_catalog(self.tmp)
+        with self.assertRaises(ArtifactError):
+            load_catalog(self.tmp, verify=True)
+
+        manifest_path = os.path.join(path, 'manifest.json')
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest['format'] = 1
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        with self.assertRaises(ArtifactError):
+            load_catalog(self.tmp)
+
+
+class BuildTests(SimpleTestCase):
+
+    def test_parse_json_col(self):
+        self.assertEqual(parse_json_col('[{"id": 28, "name": "Action"}, {"id": 35, "name": "Comedy"}]'),
+                         'Action Comedy')
+        self.assertEqual(parse_json_col("[{'id': 1, 'name': 'Drama'}]"), 'Drama')
+        self.assertEqual(parse_json_col('[]'), '')
+        self.assertEqual(parse_json_col(float('nan')), '')
+        self.assertEqual(parse_json_col('not json'), 'not json')
+
+    def test_parse_json_col_keeps_malformed_items(self):
+        self.assertEqual(parse_json_col('[{"id": 28}]'), '[{"id": 28}]')
+        self.assertEqual(parse_json_col('[1, 2]'), '[1, 2]')
+
+    def test_prepare_records(self):
+        prepared = prepare_records({
+            'id': [5, 6],
+            'title': ['Heat', float('nan')],
+            'genres': ['[{"name": "Crime"}]', '[]'],
+            'overview': ['A heist.', float('nan')],
+            'keywords': ['[{"name": "heist"}]', '[]'],
+            'release_date': ['1995-12-15', float('nan')],
+            'vote_average': [7.9, float('nan')],
+            'runtime': [170.0, float('nan')],
+        }, 'test-model')
+        self.assertEqual(prepared['year'].tolist(), [1995, 0])
+        self.assertEqual(prepared['rating'].tolist(), [np.float32(7.9), 0.0])
+        self.assertEqual(prepared['genres_str'], ['Crime', ''])
+        self.assertEqual(json.loads(prepared['payload_json'][1] + ',"score":0.5}')['year'], 'N/A')
+        self.assertIn('Genre: Crime', prepared['semantic_text'][0])
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CacheTests(TempDirTestCase):
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_ttl_cache_expires_idle_entries_and_caps_bytes(self):
+        clock = FakeClock()
+        cache = TTLCache(max_entries=10, max_bytes=100, ttl=10, clock=clock)
+        cache.set('a', 1, size=40)
+        clock.now = 5
+        cache.set('b', 2, size=40)
+        clock.now = 12
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 2)
+        cache.set('c', 3, size=40)
+        cache.set('d', 4, size=40)
+        self.assertIsNone(cache.get('b'))
+        self.assertLessEqual(cache.bytes, 100)
+        cache.set('huge', 5, size=101)
+        self.assertIsNone(cache.get('huge'))
+
+    def test_sqlite_cache_is_shared_between_instances(self):
+        path = os.path.join(self.tmp, 'cache.sqlite3')
+        SQLiteCache(path).set('key', b'value')
+        self.assertEqual(SQLiteCache(path).get('key'), b'value')
+
+    def test_sqlite_cache_evicts_least_recently_read(self):
+        cache = SQLiteCache(os.path.join(self.tmp, 'cache.sqlite3'), max_entries=5, touch_batch=1, evict_every=4)
+        for i in range(4):
+            cache.set(f'k{i}', b'x')
+        cache.get('k0')
+        for i in range(4, 7):
+            cache.set(f'k{i}', b'x')
+        self.assertEqual(len(cache), 7)
+        cache.set('k7', b'x')
+        self.assertEqual(len(cache), 5)
+        self.assertEqual(cache.get('k0'), b'x')
+        self.assertIsNone(cache.get('k1'))
+
+    def test_sqlite_cache_reads_do_not_write_until_flushed(self):
+        cache = SQLiteCache(os.path.join(self.tmp, 'cache.sqlite3'), touch_batch=100)
+        cache.set('key', b'x')
+        before = cache._connect().total_changes
+        for _ in range(10):
+            cache.get('key')
+        self.assertEqual(cache._connect().total_changes, before)
+        cache.flush()
+        self.assertEqual(cache._connect().total_changes, before + 1)
+
+    def test_query_cache_encodes_each_query_once(self):
+        calls = []
+
+        def encode(text):
+            calls.append(text)
+            return np.ones(4)
+
+        cache = QueryEmbeddingCache('v1')
+        cache.get_or_encode('Space  Adventure', encode)
+        cache.get_or_encode('space adventure', encode)
+        self.assertEqual(calls, ['Space  Adventure'])
+
+    def test_query_cache_key_includes_version_and_encoder(self):
+        shared = SQLiteCache(os.path.join(self.tmp, 'cache.sqlite3'))
+        QueryEmbeddingCache('v1', shared=shared, encoder='hash/hash-bow').set('heist', np.ones(4))
+        self.assertIsNotNone(QueryEmbeddingCache('v1', shared=shared, encoder='hash/hash-bow').get('heist'))
+        self.assertIsNone(QueryEmbeddingCache('v2', shared=shared, encoder='hash/hash-bow').get('heist'))
+        self.assertIsNone(QueryEmbeddingCache('v1', shared=shared, encoder='onnx/hash-bow').get('heist'))
+
+
+class QueryComposerTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalog = write_test_catalog(self.tmp, rows=50)
+        self.composer = QueryComposer.from_catalog(self.catalog)
+        self.encoder = HashEncoder()
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return self.encoder.encode(text)
+
+    def test_vocabulary_only_query_needs_no_encoder(self):
+        vector = self.composer.compose('Comedy', 'Funny', encode=self.encode)
+        self.assertEqual(self.encoded, [])
+        expected = normalize_rows(self.composer.vector('genre:Comedy') + self.composer.vector('mood:Funny'))
+        np.testing.assert_allclose(vector, expected, rtol=1e-5)
+
+    def test_only_free_text_is_encoded(self):
+        self.composer.compose('Action', 'Dark', 'a bank heist', 'robot', encode=self.encode)
+        self.assertEqual(self.encoded, ['About: a bank heist. Contains: robot.'])
+
+    def test_unknown_genre_is_encoded_with_the_text(self):
+        self.assertEqual(self.composer.text_to_encode('Noir', '', ''), 'A Noir movie.')
+
+    def test_empty_query_is_a_zero_vector(self):
+        self.assertFalse(np.any(self.composer.compose(encode=self.encode)))
+
+    def test_catalog_without_vocabulary(self):
+        catalog = write_test_catalog(os.path.join(self.tmp, 'plain'), rows=10)
+        del catalog.arrays['vocabulary']
+        self.assertIsNone(QueryComposer.from_catalog(catalog))
+
+    def test_recommender_with_composer_ranks_by_genre(self):
+        recommender = Recommender(self.catalog, self.encoder, self.composer)
+        results = recommender.recommend(WizardQuery('Horror', '', '', ''), k=5)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all('Horror' in item['genres'] for item in results))
+
+
+class BatchRecommendTests(ServingTestCase):
+
+    def test_batch_matches_single_queries_with_one_encode(self):
+        queries = [WizardQuery('Action', 'Exciting', 'heist', ''), WizardQuery('', '', 'zombie school', 'dog')]
+        batch = self.recommender.recommend_batch(queries, k=4)
+        self.assertEqual(len(self.recommender.model.calls), 1)
+        self.assertEqual(len(self.recommender.model.calls[0]), 2)
+
+        fresh = self.make_recommender(self.recommender.catalog)
+        self.assertEqual(batch, [fresh.recommend(q, k=4) for q in queries])
+
+    def test_results_are_cached(self):
+        query = WizardQuery('Comedy', 'Funny', 'wedding', '')
+        first = self.recommender.recommend(query)
+        calls = len(self.recommender.model.calls)
+        self.assertEqual(self.recommender.recommend(query), first)
+        self.assertEqual(len(self.recommender.model.calls), calls)
+
+    def test_bad_payload_does_not_fail_the_batch(self):
+        items = self.recommender.recommend_payloads([{'genre': 'Action'}, {'genre': 5}, 'nope'], k=3)
+        self.assertEqual(len(items[0]['results']), 3)
+        self.assertEqual(items[1], {'error': "'genre' must be a string."})
+        self.assertIn('error', items[2])
+
+    def test_batch_endpoint(self):
+        response = self.post('/api/recommend/batch/', {'queries': [{'genre': 'Drama'}, {'mood': 'Dark'}], 'k': 2})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([len(item['results']) for item in body], [2, 2])
+        self.assertEqual(body[0]['results'], self.recommender.recommend(WizardQuery('Drama', '', '', ''), k=2))
+
+    def test_batch_endpoint_rejects_bad_bodies(self):
+        self.assertEqual(self.post('/api/recommend/batch/', {'queries': 'Drama'}).status_code, 400)
+        self.assertEqual(self.post('/api/recommend/batch/', {'queries': [{}], 'k': 0}).status_code, 400)
+
+
+class MicroBatchEncoderTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_a_batch(self):
+        model = CountingEncoder()
+        encoder = MicroBatchEncoder(model, max_wait_ms=200, max_batch_size=8)
+        self.addCleanup(encoder.close)
+        texts = [f'movie about {word}' for word in TEST_WORDS[:8]]
+        results = {}
+
+        def call(text):
+            results[text] = encoder.encode([text])
+
+        threads = [threading.Thread(target=call, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(len(model.calls), len(texts))
+        for text in texts:
+            np.testing.assert_allclose(results[text][0], HashEncoder().encode(text), rtol=1e-6)
+
+    def test_errors_reach_every_caller(self):
+        class Broken:
+            def encode(self, texts):
+                raise RuntimeError('model failed')
+
+        encoder = MicroBatchEncoder(Broken(), max_wait_ms=1)
+        self.addCleanup(encoder.close)
+        with self.assertRaisesMessage(RuntimeError, 'model failed'):
+            encoder.encode(['a'])
+
+    def test_close_stops_the_thread(self):
+        model = CountingEncoder()
+        encoder = MicroBatchEncoder(model, max_wait_ms=1)
+        encoder.encode(['before'])
+        encoder.close()
+        self.assertFalse(encoder._thread.is_alive())
+        np.testing.assert_allclose(encoder.encode(['after']), model.encode(['after']))
+
+
+def clustered_embeddings(rows, dim=16, clusters=8, seed=0):
+    """Unit rows scattered around a few centres, so an IVF index has structure to find."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim))
+    return normalize_rows(centres[rng.integers(clusters, size=rows)] + 0.3 * rng.standard_normal((rows, dim)))
+
+
+class IVFIndexTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.embeddings = clustered_embeddings(2000)
+        self.index = IVFIndex.build(self.embeddings, n_lists=16)
+        self.exact = RetrievalEngine(self.embeddings, normalized=True)
+
+    def test_every_row_is_in_one_cell(self):
+        self.assertEqual(sorted(self.index.ids.tolist()), list(range(2000)))
+        self.assertEqual(self.index.offsets[-1], 2000)
+
+    def test_probing_every_cell_is_exact(self):
+        queries = clustered_embeddings(5, seed=1)
+        indices, scores = self.index.search_batch(queries, k=10, nprobe=16)
+        exact_indices, exact_scores = self.exact.search_batch(queries, k=10)
+        for row in range(5):
+            self.assertEqual(indices[row].tolist(), exact_indices[row].tolist())
+            np.testing.assert_allclose(scores[row], exact_scores[row], rtol=1e-5)
+
+    def test_recall_with_few_probes(self):
+        queries = clustered_embeddings(50, seed=2)
+        indices, _ = self.index.search_batch(queries, k=10, nprobe=4)
+        exact_indices, _ = self.exact.search_batch(queries, k=10)
+        recall = np.mean([len(set(a.tolist()) & set(b.tolist())) / 10 for a, b in zip(indices, exact_indices)])
+        self.assertGreater(recall, 0.9)
+
+    def test_catalog_round_trip_and_fallback(self):
+        catalog = write_test_catalog(self.tmp, rows=200)
+        catalog.arrays.update(IVFIndex.build(catalog.embeddings, n_lists=8).to_arrays())
+        engine = build_engine(catalog, 'ivf', nprobe=8)
+        self.assertIsInstance(engine, IVFIndex)
+        self.assertEqual(engine.search(catalog.embeddings[7], k=1)[0].tolist(), [7])
+        plain = write_test_catalog(os.path.join(self.tmp, 'plain'), rows=20)
+        self.assertIsInstance(build_engine(plain, 'ivf'), RetrievalEngine)
+        with self.assertRaises(ValueError):
+            build_engine(plain, 'nearest')
+
+
+class QuantizationTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.embeddings = clustered_embeddings(1000, dim=32)
+        self.queries = clustered_embeddings(20, dim=32, seed=1)
+        self.exact_indices, self.exact_scores = RetrievalEngine(self.embeddings, normalized=True).search_batch(
+            self.queries, k=5)
+
+    def test_int8_round_trip_error_is_small(self):
+        quantizer = Int8Quantizer.train(self.embeddings)
+        codes = quantizer.encode(self.embeddings)
+        self.assertEqual(codes.dtype, np.int8)
+        self.assertLess(np.abs(quantizer.decode(codes) - self.embeddings).max(), quantizer.scale.max())
+        np.testing.assert_allclose(quantizer.scores(codes, self.queries[0]),
+                                   quantizer.decode(codes) @ self.queries[0], rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(quantizer.scores(codes, self.queries[:3]),
+                                   [quantizer.scores(codes, query) for query in self.queries[:3]], rtol=1e-5, atol=1e-6)
+
+    def test_pq_codes_and_table_scores(self):
+        quantizer = ProductQuantizer.train(self.embeddings, m=8, iterations=5)
+        codes = quantizer.encode(self.embeddings)
+        self.assertEqual((codes.shape, codes.dtype), ((1000, 8), np.uint8))
+        np.testing.assert_allclose(quantizer.scores(codes, self.queries[0]),
+                                   quantizer.decode(codes) @ self.queries[0], rtol=1e-4, atol=1e-5)
+        with self.assertRaises(ValueError):
+            ProductQuantizer.train(self.embeddings, m=7)
+
+    def test_reranked_search_matches_exact(self):
+        for quantizer in (Int8Quantizer.train(self.embeddings),
+                          ProductQuantizer.train(self.embeddings, m=8, iterations=5)):
+            engine = QuantizedEngine(quantizer, quantizer.encode(self.embeddings), self.embeddings, rerank=100)
+            indices, scores = engine.search_batch(self.queries, k=5)
+            for row in range(len(self.queries)):
+                self.assertEqual(indices[row].tolist(), self.exact_indices[row].tolist())
+                np.testing.assert_allclose(scores[row], self.exact_scores[row], rtol=1e-5)
+
+    def test_engine_from_catalog(self):
+        catalog = write_test_catalog(self.tmp, rows=100)
+        quantizer = Int8Quantizer.train(catalog.embeddings)
+        catalog.arrays.update(quantizer.to_arrays(quantizer.encode(catalog.embeddings)))
+        self.assertIsInstance(build_engine(catalog, 'int8'), QuantizedEngine)
+        self.assertIsInstance(build_engine(catalog, 'pq'), RetrievalEngine)
+
+
+def serving_settings(catalog_dir, **kwargs):
+    """Settings for a ModelLoader serving ``catalog_dir`` with the hash encoder and no background threads."""
+    values = dict(RECOMMENDER_CATALOG_DIR=catalog_dir, RECOMMENDER_ENCODER='hash', RECOMMENDER_RELOAD_POLL_SECONDS=0,
+                  RECOMMENDER_MICROBATCH_WAIT_MS=0)
+    values.update(kwargs)
+    return override_settings(**values)
+
+
+class ModelLoaderTests(TempDirTestCase):
+
+    def test_loads_validates_and_reports_stages(self):
+        write_test_catalog(self.tmp, rows=50, version='v1')
+        model_loader = ModelLoader()
+        with serving_settings(self.tmp):
+            self.assertTrue(model_loader.wait(30))
+        status = model_loader.status()
+        self.assertEqual((status['state'], status['version']), (READY, 'v1'))
+        self.assertTrue({'catalog', 'model', 'engine', 'warmup'} <= set(status['stages']))
+        self.assertIsInstance(model_loader.recommender.model, HashEncoder)
+
+    def test_missing_catalog_fails(self):
+        model_loader = ModelLoader()
+        with serving_settings(self.tmp):
+            self.assertFalse(model_loader.wait(30))
+        self.assertEqual(model_loader.state, FAILED)
+        self.assertIn('No catalog found', model_loader.status()['error'])
+
+    def test_catalog_built_after_a_failed_load_is_picked_up(self):
+        model_loader = ModelLoader()
+        with serving_settings(self.tmp, RECOMMENDER_RELOAD_POLL_SECONDS=3600):
+            self.assertFalse(model_loader.wait(30))
+            # the watcher runs even though nothing is serving
+            self.assertTrue(model_loader._watcher.is_alive())
+            write_test_catalog(self.tmp, rows=50, version='v1')
+            self.assertTrue(model_loader.reload())
+        self.assertEqual((model_loader.state, model_loader.recommender.version), (READY, 'v1'))
+        self.assertNotIn('error', model_loader.status())
+
+    def test_only_serving_processes_load_on_startup(self):
+        self.assertTrue(should_load_on_startup(['gunicorn']))
+        self.assertFalse(should_load_on_startup(['manage.py', 'migrate']))
+        self.assertTrue(should_load_on_startup(['manage.py', 'runserver', '--noreload']))
+        with override_settings(RECOMMENDER_LOAD_ON_STARTUP=False):
+            self.assertFalse(should_load_on_startup(['gunicorn']))
+
+    def test_endpoints_while_loading(self):
+        saved = loader.state, loader.recommender
+        self.addCleanup(setattr, loader, 'recommender', saved[1])
+        self.addCleanup(setattr, loader, 'state', saved[0])
+        loader.state, loader.recommender = LOADING, None
+
+        self.assertEqual(self.client.get('/api/health/live').status_code, 200)
+        self.assertEqual(self.client.get('/api/health/ready').status_code, 503)
+        response = self.client.post('/api/recommend/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(self.client.get('/api/options/').status_code, 200)
+
+
+class ReloadTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_test_catalog(self.tmp, rows=50, version='v1')
+        self.loader = ModelLoader()
+        with serving_settings(self.tmp):
+            self.assertTrue(self.loader.wait(30))
+
+    def test_reload_switches_to_the_current_version(self):
+        old = self.loader.recommender
+        write_test_catalog(self.tmp, rows=60, version='v2')
+        with serving_settings(self.tmp):
+            self.assertTrue(self.loader.reload())
+        self.assertEqual(self.loader.recommender.version, 'v2')
+        self.assertEqual(len(self.loader.recommender.catalog), 60)
+        # the new catalog reuses the loaded encoder
+        self.assertIs(self.loader.recommender.model, old.model)
+        self.assertEqual(self.loader.draining, ['v1'])
+        del old
+        gc.collect()
+        self.assertEqual(self.loader.draining, [])
+        self.assertEqual(self.loader.status()['last_reload']['previous'], 'v1')
+
+    def test_failed_reload_keeps_serving(self):
+        write_test_catalog(self.tmp, rows=60, version='v2')
+        manifest = os.path.join(self.tmp, 'v2', 'manifest.json')
+        with open(manifest, 'w') as f:
+            f.write('{')
+        with serving_settings(self.tmp):
+            self.assertFalse(self.loader.reload())
+        self.assertEqual(self.loader.recommender.version, 'v1')
+        last = self.loader.status()['last_reload']
+        self.assertEqual((last['version'], last['ok']), ('v2', False))
+        self.assertEqual(self.loader.reloads, 0)
+
+
+class ReloadSignalTests(SimpleTestCase):
+
+    def test_no_handler_by_default(self):
+        self.assertIsNone(settings.RECOMMENDER_RELOAD_SIGNAL)
+        self.assertFalse(install_reload_signal(None))
+
+    def test_signal_reloads_in_the_background(self):
+        saved = signal.getsignal(signal.SIGPWR)
+        self.addCleanup(signal.signal, signal.SIGPWR, saved)
+        with mock.patch.object(loader, 'reload_in_background') as reload:
+            self.assertTrue(install_reload_signal('SIGPWR'))
+            os.kill(os.getpid(), signal.SIGPWR)
+        reload.assert_called_once_with()
+
+
+class IncrementalBuildTests(TempDirTestCase):
+
+    def test_content_hash_covers_text_and_model(self):
+        self.assertEqual(content_hash('Heat', 'model-a'), content_hash('Heat', 'model-a'))
+        self.assertNotEqual(content_hash('Heat', 'model-a'), content_hash('Heat 2', 'model-a'))
+        self.assertNotEqual(content_hash('Heat', 'model-a'), content_hash('Heat', 'model-b'))
+
+    def test_only_new_or_changed_movies_are_encoded(self):
+        records = movie_records(20)
+        previous = write_test_catalog(self.tmp, records=records, version='v1')
+
+        records['overview'][3] = 'A completely different plot.'
+        for column in records.values():
+            del column[5]
+        records['id'].append(99)
+        for name, value in (('title', 'New'), ('genres', '[]'), ('overview', 'New movie.'), ('keywords', '[]'),
+                            ('release_date', ''), ('vote_average', 5.0), ('runtime', 90.0)):
+            records[name].append(value)
+        prepared = prepare_records(records, HASH_MODEL_NAME)
+
+        reuse_from, encode_rows = IncrementalPlan(previous).plan(prepared['id'], prepared['content_hash'])
+        self.assertEqual([int(prepared['id'][row]) for row in encode_rows], [4, 99])
+        self.assertEqual(reuse_from[0], 0)
+        self.assertEqual(reuse_from[5], 6)
+
+        encoded = HashEncoder().encode([prepared['semantic_text'][row] for row in encode_rows])
+        embeddings = assemble_embeddings(previous, reuse_from, encode_rows, encoded, previous.embeddings.shape[1])
+        np.testing.assert_array_equal(embeddings[5], previous.embeddings[6])
+        np.testing.assert_allclose(embeddings[3], normalize_rows(encoded[0]))
+
+    def test_no_previous_catalog_encodes_everything(self):
+        prepared = prepare_records(movie_records(5), HASH_MODEL_NAME)
+        reuse_from, encode_rows = IncrementalPlan(None).plan(prepared['id'], prepared['content_hash'])
+        self.assertEqual(encode_rows.tolist(), [0, 1, 2, 3, 4])
+        self.assertTrue(np.all(reuse_from < 0))
+
+
+class StreamingBuildTests(TempDirTestCase):
+
+    def test_arrays_and_columns_written_in_chunks(self):
+        embeddings = random_embeddings(25)
+        quantizer = Int8Quantizer.train(embeddings)
+        writer = CatalogWriter(self.tmp, 'test-model', 16, version='v1')
+        codes = writer.array('int8_codes', np.int8, (16,))
+        for start in range(0, 25, 10):
+            chunk = embeddings[start:start + 10]
+            writer.append(chunk, {'id': np.arange(start, start + len(chunk), dtype=np.int32)})
+            codes.append(quantizer.encode(normalize_rows(chunk)))
+        self.assertEqual(writer.column('id').tolist(), list(range(25)))
+        writer.finish({'int8_scale': quantizer.scale})
+
+        catalog = load_catalog(self.tmp)
+        np.testing.assert_array_equal(catalog.arrays['int8_codes'], quantizer.encode(catalog.embeddings))
+        self.assertEqual(catalog.manifest['arrays']['int8_codes']['shape'], [25, 16])
+
+    def test_chunk_columns_must_match(self):
+        writer = CatalogWriter(self.tmp, 'test-model', 16, version='v1')
+        self.addCleanup(writer.abort)
+        writer.append(random_embeddings(2), {'id': np.arange(2)})
+        with self.assertRaises(ArtifactError):
+            writer.append(random_embeddings(2), {'title': ['a', 'b']})
+
+    def test_interner_keeps_first_seen_order(self):
+        interner = Interner()
+        self.assertEqual(interner(['Drama', 'Action', 'Drama']).tolist(), [0, 1, 0])
+        self.assertEqual(interner(['Action', 'Comedy']).tolist(), [1, 2])
+        self.assertEqual(interner.values, ['Drama', 'Action', 'Comedy'])
+
+
+class PayloadTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = MovieStore(write_test_catalog(self.tmp, rows=30))
+
+    def test_rendered_json_matches_items(self):
+        rows, scores = np.array([4, 0, 12]), np.array([0.91234, 0.5, -0.25], dtype=np.float32)
+        ranked = RankedList(self.store, rows, scores)
+        self.assertEqual(json.loads(ranked.to_json()), ranked.to_list())
+        self.assertEqual([item['score'] for item in ranked.to_list()], [0.91, 0.5, -0.25])
+
+    def test_unknown_year_renders_as_na(self):
+        row = next(i for i in range(30) if self.store.years[i] == 0)
+        self.assertEqual(json.loads(self.store.render([row], [1.0]))[0]['year'], 'N/A')
+
+    def test_rows_for_ids(self):
+        self.assertEqual(self.store.row_for_id(7), 6)
+        self.assertIsNone(self.store.row_for_id(1000))
+        self.assertEqual(self.store.rows_for_ids([30, 1000, 1, -5]).tolist(), [29, 0])
+
+    def test_render_batch(self):
+        ranked = RankedList(self.store, np.array([1]), np.array([0.5]))
+        body = json.loads(render_batch([ranked, {'error': 'bad'}]))
+        self.assertEqual(body, [{'results': ranked.to_list()}, {'error': 'bad'}])
+
+
+class HashEncoderTests(SimpleTestCase):
+
+    def test_vectors_are_deterministic_and_unit_length(self):
+        first = HashEncoder().encode(['a heist in the city', 'robot dog'])
+        second = HashEncoder().encode(['A heist in the CITY', 'robot dog'])
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-5)
+        self.assertEqual(first.shape, (2, HashEncoder().get_sentence_embedding_dimension()))
+
+    def test_shared_words_score_higher(self):
+        encoder = HashEncoder()
+        query, near, far = encoder.encode(['zombie school', 'zombie school trip', 'wedding on an island'])
+        self.assertGreater(query @ near, query @ far)
+
+    def test_empty_text_is_a_zero_vector(self):
+        self.assertFalse(np.any(HashEncoder().encode('')))
+
+
+class MetricsTests(ServingTestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram([0.1, 1.0])
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.to_dict()['buckets'], {'0.1': 2, '1.0': 3, '+Inf': 4})
+        self.assertEqual(histogram.to_dict()['count'], 4)
+
+    def test_labeled_histogram_renders_prometheus_text(self):
+        histogram = LabeledHistogram('test_seconds', 'Test.', 'stage', buckets=[1.0])
+        histogram.observe_all({'encode': 0.5, 'topk': 2.0})
+        lines = histogram.prometheus()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="encode",le="1.0"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="topk",le="1.0"} 0', lines)
+        self.assertIn('test_seconds_count{stage="topk"} 1', lines)
+
+    def test_request_metrics_share_one_lock(self):
+        stages = LabeledHistogram('stage_seconds', '', 'stage', buckets=[1.0], labels=['encode'])
+        requests = LabeledHistogram('request_seconds', '', 'endpoint', buckets=[1.0], lock=stages.lock)
+        metrics = RequestMetrics(stages, requests)
+        self.assertIs(stages.children['encode']._lock, requests.lock)
+        metrics.observe('recommend', {'encode': 0.5, 'topk': 0.25}, 2.0)
+        metrics.observe('recommend', {'encode': 1.5}, 0.5)
+        self.assertEqual(stages.children['encode'].to_dict()['buckets'], {'1.0': 1, '+Inf': 2})
+        self.assertEqual(requests.children['recommend'].to_dict()['sum'], 2.5)
+        self.assertIn('request_seconds_count{endpoint="recommend"} 2', metrics.prometheus())
+
+    def test_server_timing_header(self):
+        timings = Timings()
+        timings.add('encode', 0.002)
+        timings.add('encode', 0.001)
+        self.assertEqual(timings.server_timing(0.01), 'encode;dur=3.000, total;dur=10.000')
+        self.assertEqual(timings.server_timing(), 'encode;dur=3.000')
+        self.assertEqual(Timings().server_timing(), '')
+
+        response = self.post('/api/recommend/', {'genre': 'Drama', 'content': 'a quiet story'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(response['X-Artifact-Version'], self.recommender.version)
+
+    def test_metrics_endpoint(self):
+        self.post('/api/recommend/', {'content': 'a quiet story'})
+        response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('recommender_ready 1', body)
+        self.assertIn('recommender_request_seconds_count{endpoint="recommend"}', body)
+        self.assertIn(f'recommender_catalog_rows {self.rows}', body)
+
+
+class NeighborTests(ServingTestCase):
+
+    def test_blocked_table_matches_brute_force(self):
+        embeddings = normalize_rows(random_embeddings(90))
+        ids, scores = neighbor_table(embeddings, n=5, block_rows=16, block_cols=32, workers=2)
+        full = embeddings @ embeddings.T
+        np.fill_diagonal(full, -np.inf)
+        expected = np.argsort(-full, axis=1)[:, :5]
+        np.testing.assert_array_equal(ids, expected)
+        np.testing.assert_allclose(scores, np.take_along_axis(full, expected, axis=1), atol=1e-3)
+
+    def test_worker_scratch_stays_within_its_bound(self):
+        embeddings = normalize_rows(random_embeddings(2048))
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        _block_neighbors(embeddings, 0, 256, 10, 1024)
+        self.assertLess(tracemalloc.get_traced_memory()[1], 1.1 * worker_bytes(256, 1024))
+
+    def test_table_and_fallback_agree(self):
+        embeddings = self.recommender.catalog.embeddings
+        ids, scores = neighbor_table(embeddings, n=10)
+        self.recommender.neighbors = NeighborTable(ids, scores)
+        from_table = self.recommender.similar(7, k=5)
+        self.recommender.neighbors = None
+        scanned = self.recommender.similar(7, k=5)
+        np.testing.assert_allclose(from_table.scores, scanned.scores, atol=1e-3)
+        self.assertNotIn(self.recommender.movies.row_for_id(7), scanned.indices)
+
+    def test_similar_endpoint(self):
+        response = self.client.get('/api/movies/7/similar/', {'k': 4})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(len(results), 4)
+        self.assertNotIn(7, [item['id'] for item in results])
+        self.assertEqual(self.client.get('/api/movies/99999/similar/').status_code, 404)
+        self.assertEqual(self.client.get('/api/movies/7/similar/', {'k': 'x'}).status_code, 400)
+
+    def test_only_scans_past_the_table_go_to_the_executor(self):
+        ids, scores = neighbor_table(self.recommender.catalog.embeddings, n=10)
+        self.recommender.neighbors = NeighborTable(ids, scores)
+        full = BoundedExecutor(workers=1, max_queue=0)
+        full.pending = 1
+        with mock.patch.object(views, 'get_executor', return_value=full):
+            self.assertEqual(self.client.get('/api/movies/7/similar/', {'k': 10}).status_code, 200)
+            self.assertEqual(self.client.get('/api/movies/7/similar/', {'k': 11}).status_code, 503)
+        response = self.client.get('/api/movies/7/similar/', {'k': 11})
+        self.assertEqual(len(response.json()), 11)
+        self.assertIn('queue;dur=', response['Server-Timing'])
+
+
+class LexicalTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        builder = LexicalIndexBuilder()
+        builder.add(['zombie', 'heist bank', 'space'], ['Horror', 'Crime', 'Science Fiction'],
+                    ['The dead walk at a high school.', 'A crew robs a bank.', 'A ship in space.'])
+        builder.add(['school'], ['Comedy'], ['A summer at school with the family.'])
+        self.arrays = builder.finish()
+        self.index = LexicalIndex(*(self.arrays[name] for name in ('lex_terms', 'lex_offsets', 'lex_rows',
+                                                                   'lex_weights')))
+
+    def test_tokenize_drops_stopwords(self):
+        self.assertEqual(tokenize('The Zombie movie of 2004'), [b'zombie', b'2004'])
+
+    def test_search_ranks_keyword_matches(self):
+        rows, scores = self.index.search('zombie school', k=5)
+        self.assertEqual(rows.tolist()[0], 0)
+        self.assertEqual(sorted(rows.tolist()), [0, 3])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        self.assertEqual(len(self.index.search('wedding')[0]), 0)
+
+    def test_search_respects_allowed_rows(self):
+        rows, _ = self.index.search('zombie school', allowed=np.array([1, 3]))
+        self.assertEqual(rows.tolist(), [3])
+        self.assertEqual(len(self.index.search('zombie', allowed=np.array([], dtype=np.int64))[0]), 0)
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([3, 4])], [1.0, 1.0])
+        self.assertEqual(fused[0], 3)
+        self.assertEqual(sorted(fused), [1, 2, 3, 4])
+
+    def test_hybrid_adds_keyword_matches_with_cosine_scores(self):
+        embeddings = normalize_rows(random_embeddings(4))
+        hybrid = HybridRetriever(self.index, embeddings, depth=10)
+        query = embeddings[2]
+        dense = np.array([2, 1]), embeddings[[2, 1]] @ query
+        rows, scores = hybrid.combine('zombie', dense, query, k=3)
+        self.assertIn(0, rows.tolist())
+        np.testing.assert_allclose(scores, embeddings[rows] @ query, rtol=1e-5)
+        with self.assertRaises(ValueError):
+            HybridRetriever(self.index, embeddings, fusion='nope')
+
+    def test_catalog_round_trip(self):
+        prepared = prepare_records(movie_records(20), HASH_MODEL_NAME)
+        builder = LexicalIndexBuilder()
+        builder.add(prepared['keywords_str'], prepared['genres_str'], prepared['overview'])
+        catalog = write_test_catalog(self.tmp, rows=20, arrays=builder.finish())
+        rows, _ = HybridRetriever.from_catalog(catalog).index.search('comedy')
+        self.assertEqual(sorted(rows.tolist()), [i for i in range(20) if i % len(TEST_GENRES) == 1])
+        self.assertIsNone(LexicalIndex.from_catalog(write_test_catalog(self.tmp, rows=20, version='bare')))
+
+
+class FakeTokenizer:
+    """Token ids are word lengths, padded to the longest sentence of the batch."""
+
+    def __call__(self, sentences, padding, truncation, max_length, return_tensors):
+        words = [s.split()[:max_length] for s in sentences]
+        width = max(len(w) for w in words)
+        ids = np.zeros((len(words), width), dtype=np.int64)
+        mask = np.zeros((len(words), width), dtype=np.int64)
+        for i, sentence in enumerate(words):
+            ids[i, :len(sentence)] = [len(word) for word in sentence]
+            mask[i, :len(sentence)] = 1
+        return {'input_ids': ids, 'attention_mask': mask}
+
+
+class FakeSession:
+    """Hidden state of a token: [id, 1]; padding gets a large value that pooling must ignore."""
+
+    def get_inputs(self):
+        return [types.SimpleNamespace(name=name) for name in ('input_ids', 'attention_mask')]
+
+    def run(self, outputs, inputs):
+        ids = inputs['input_ids'].astype(np.float32)
+        hidden = np.stack([ids, np.ones_like(ids)], axis=-1)
+        hidden[inputs['attention_mask'] == 0] = 1000.0
+        return [hidden]
+
+
+class EncoderTests(SimpleTestCase):
+
+    def onnx_encoder(self, normalize=False):
+        config = {'dim': 2, 'max_length': 8, 'normalize': normalize}
+        return OnnxEncoder(FakeSession(), FakeTokenizer(), config, 'test-model')
+
+    def test_onnx_mean_pooling_ignores_padding(self):
+        encoder = self.onnx_encoder()
+        vectors = encoder.encode(['ab abcd', 'abc'], batch_size=2)
+        np.testing.assert_allclose(vectors, [[3.0, 1.0], [3.0, 1.0]])
+        np.testing.assert_allclose(encoder.encode(['ab abcd', 'abc'], batch_size=1), vectors)
+        self.assertEqual(encoder.encode([]).shape, (0, 2))
+
+    def test_onnx_normalize(self):
+        vector = self.onnx_encoder(normalize=True).encode('abc')
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=6)
+
+    def test_encoder_names(self):
+        with self.assertRaises(ValueError):
+            encoder_class('nope')
+        self.assertIsInstance(load_encoder('hash', HASH_MODEL_NAME), HashEncoder)
+        self.assertEqual(onnx_dir('/x', 'org/model'), os.path.join('/x', 'org__model'))
+
+    def test_missing_backend_raises_import_error(self):
+        with mock.patch.dict(ENCODERS, {'fake': (HashEncoder, ('no_such_backend_module',))}):
+            with self.assertRaises(ImportError):
+                encoder_class('fake')
+
+
+class AsyncViewTests(ServingTestCase):
+
+    def test_executor_sheds_work_past_its_queue(self):
+        executor = BoundedExecutor(workers=1, max_queue=1)
+        release = threading.Event()
+
+        async def burst():
+            running = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded):
+                await executor.run(release.wait, 5)
+            self.assertEqual(executor.stats()['queued'], 1)
+            release.set()
+            return await asyncio.gather(*running)
+
+        self.assertEqual(asyncio.run(burst()), [True, True])
+        self.assertEqual(executor.stats()['rejected'], 1)
+        self.assertEqual(executor.pending, 0)
+
+    def test_overloaded_executor_answers_503(self):
+        full = BoundedExecutor(workers=1, max_queue=0)
+        full.pending = 1
+        with mock.patch.object(views, 'get_executor', return_value=full):
+            response = self.post('/api/recommend/', {'content': 'a quiet story'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_async_and_sync_views_agree(self):
+        data = {'genre': 'Comedy', 'content': 'a robot dog', 'k': 5}
+        request = RequestFactory().post('/api/recommend/', json.dumps(data), content_type='application/json')
+        sync = views.recommend_movies(request)
+        response = self.post('/api/recommend/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(sync.content))
+        self.assertEqual(self.post('/api/recommend/', {'k': 'x'}).status_code, 400)
+
+    def test_form_posts_parse_like_drf(self):
+        data = {'genre': 'Comedy', 'content': 'a robot dog'}
+        request = RequestFactory().post('/api/recommend/', data)
+        sync = views.recommend_movies(request)
+        response = self.client.post('/api/recommend/', data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(sync.content))
+
+        response = self.client.post('/api/recommend/', '{"genre": ', content_type='application/json')
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Request body must be valid JSON.'}))
+        response = self.client.post('/api/recommend/', 'genre=Comedy', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('send JSON', response.json()['error'])
+
+
+class PaginationTests(ServingTestCase):
+
+    query = {'genre': 'Drama', 'content': 'a family at war'}
+
+    def test_parse_paging(self):
+        self.assertEqual(parse_k({}, 6, 50), 6)
+        for k in (0, 51, True, '5'):
+            with self.assertRaises(ValueError):
+                parse_k({'k': k}, 6, 50)
+        self.assertEqual(parse_paging({'k': 3}, 6, 50), (3, False, None))
+        self.assertEqual(parse_paging({'cursor': None}, 6, 50), (6, True, None))
+        with self.assertRaises(ValueError):
+            parse_paging({'cursor': 5}, 6, 50)
+
+    def test_cursor_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor('ab.c_d', 40)), ('ab.c_d', 40))
+        for cursor in ('nodot', '.5', 'abc.x'):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_pages_follow_the_top_k_with_one_encode(self):
+        seen, cursor = [], None
+        for _ in range(3):
+            body = self.post('/api/recommend/', dict(self.query, k=20, cursor=cursor)).json()
+            seen += body['results']
+            cursor = body['next_cursor']
+        self.assertEqual(len(self.recommender.model.calls), 1)
+        top = self.post('/api/recommend/', dict(self.query, k=50)).json()
+        self.assertEqual([item['id'] for item in seen[:50]], [item['id'] for item in top])
+
+        last = self.post('/api/recommend/', {'k': 50, 'cursor': cursor}).json()
+        self.assertEqual(len(last['results']), self.recommender.page_depth - 60)
+        self.assertIsNone(last['next_cursor'])
+
+    def test_expired_cursor(self):
+        cursor = self.post('/api/recommend/', dict(self.query, k=5, cursor=None)).json()['next_cursor']
+        self.recommender.candidates.cache.clear()
+        self.assertEqual(self.post('/api/recommend/', {'k': 5, 'cursor': cursor}).status_code, 410)
+        with self.assertRaises(CursorExpired):
+            self.recommender.rank_page(parse_query({}), 5, cursor)
+        response = self.post('/api/recommend/', dict(self.query, k=5, cursor=cursor))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertEqual(self.post('/api/recommend/', {'k': 5, 'cursor': 'bad'}).status_code, 400)
+
+
+class ShardTests(TempDirTestCase):
+
+    def test_shard_bounds_and_cpus(self):
+        self.assertEqual(shard_bounds(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(split_cpus(2, [0, 1, 2, 3, 4]), [[0, 1, 2], [3, 4]])
+        self.assertEqual(split_cpus(3, [4, 5]), [[4], [5], [4]])
+
+    def test_sharded_search_matches_exact_and_respawns(self):
+        embeddings = normalize_rows(random_embeddings(400))
+        path = os.path.join(self.tmp, 'embeddings.npy')
+        np.save(path, embeddings)
+        engine = ShardedEngine(path, 400, 16, n_shards=3)
+        self.addCleanup(engine.close)
+
+        queries = random_embeddings(4, seed=1)
+        indices, scores = engine.search_batch(queries, k=7)
+        expected_indices, expected_scores = RetrievalEngine(embeddings, normalized=True).search_batch(queries, k=7)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+        self.assertEqual(engine.stats()['rows'], [133, 133, 134])
+
+        engine._processes[1].kill()
+        engine._processes[1].join(5)
+        with self.assertRaisesRegex(ShardError, 'Shard 1 failed'):
+            engine.search_batch(queries, k=7)
+        wait_for(lambda: engine.error is None)
+        np.testing.assert_array_equal(engine.search_batch(queries, k=7)[0], expected_indices)
+        self.assertEqual((engine.stats()['alive'], engine.restarts), (3, 1))
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the condition")
+        time.sleep(0.05)
+
+
+class ShardedServingTests(ServingTestCase):
+
+    rows = 120
+
+    def make_recommender(self, catalog):
+        engine = ShardedEngine.from_catalog(catalog, n_shards=2)
+        self.addCleanup(engine.close)
+        return Recommender(catalog, CountingEncoder(), engine=engine)
+
+    def ids(self, data):
+        response = self.post('/api/recommend/', data)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()]
+
+    def test_failed_engine_falls_back_and_is_rebuilt(self):
+        engine = self.recommender.engine
+        expected = self.ids({'content': 'a robot dog', 'k': 8})
+        self.assertEqual(self.client.get('/api/health/ready').status_code, 200)
+
+        # the respawn fails too, so the engine stays down
+        with mock.patch.object(ShardedEngine, '_spawn', side_effect=ShardError("no processes")):
+            engine._processes[0].kill()
+            engine._processes[0].join(5)
+            self.assertEqual(self.ids({'content': 'a robot dog', 'k': 7}), expected[:7])
+            wait_for(lambda: not engine.recovering)
+        self.assertIn('respawn failed', loader.engine_error)
+        self.assertEqual(self.ids({'content': 'a robot dog', 'k': 6}), expected[:6])
+        self.assertEqual(self.client.get('/api/health/ready').status_code, 503)
+
+        sharded = {'RECOMMENDER_SEARCH': 'sharded', 'RECOMMENDER_SHARDS': 2}
+        with serving_settings(self.tmp, **sharded):
+            self.assertTrue(loader.reload())
+        self.addCleanup(lambda: loader.recommender.engine.close())
+        self.assertIsNot(loader.recommender.engine, engine)
+        self.assertIsNone(loader.engine_error)
+        self.assertEqual(self.client.get('/api/health/ready').status_code, 200)
+        self.assertEqual(self.ids({'content': 'a robot dog', 'k': 5}), expected[:5])
+
+
+class ThreadBudgetTests(TempDirTestCase):
+
+    def write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_plan_splits_cores_between_workers(self):
+        budget = plan(16, 4)
+        self.assertEqual((budget.per_worker, budget.encoder, budget.executor, budget.blas), (4, 4, 4, 1))
+        budget = plan(16, 4, executor=2)
+        self.assertEqual((budget.executor, budget.blas), (2, 2))
+        self.assertEqual(plan(2, 8).per_worker, 1)
+
+    def test_cgroup_cpu_limit(self):
+        self.assertIsNone(cgroup_cpu_limit(self.tmp))
+        self.write(os.path.join(self.tmp, 'cpu', 'cpu.cfs_quota_us'), '250000\n')
+        self.write(os.path.join(self.tmp, 'cpu', 'cpu.cfs_period_us'), '100000\n')
+        self.assertEqual(cgroup_cpu_limit(self.tmp), 2.5)
+        self.write(os.path.join(self.tmp, 'cpu.max'), 'max 100000\n')
+        self.assertIsNone(cgroup_cpu_limit(self.tmp))
+        self.write(os.path.join(self.tmp, 'cpu.max'), '150000 100000\n')
+        self.assertEqual(cgroup_cpu_limit(self.tmp), 1.5)
+
+    def test_thread_env_is_restored(self):
+        saved = {name: os.environ.get(name) for name in THREAD_ENV}
+        with thread_env(3):
+            self.assertEqual({os.environ[name] for name in THREAD_ENV}, {'3'})
+        self.assertEqual({name: os.environ.get(name) for name in THREAD_ENV}, saved)
+
+    def test_web_workers(self):
+        with override_settings(RECOMMENDER_WEB_WORKERS=None), mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '3'}):
+            self.assertEqual(web_workers(), 3)
+        with override_settings(RECOMMENDER_WEB_WORKERS=5):
+            self.assertEqual(web_workers(), 5)
+
+
+class CatalogMapTests(ServingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        catalog = self.recommender.catalog
+        arrays, _ = catalog_map(catalog.embeddings, catalog['id'], n_clusters=6)
+        self.map = CatalogMap(*(arrays[name] for name in ('map_ids', 'map_xy', 'map_clusters', 'map_codes',
+                                                           'map_centres', 'map_sizes')))
+
+    def test_morton_codes_interleave_bits(self):
+        xy = np.array([[1, 0], [0, 1], [3, 3], [GRID, GRID]], dtype=np.uint16)
+        self.assertEqual(morton_codes(xy).tolist(), [1, 2, 15, 0xFFFFFFFF])
+
+    def test_tiles_partition_the_points(self):
+        self.assertEqual(sorted(self.map.ids.tolist()), list(range(1, self.rows + 1)))
+        self.assertEqual(self.map.tile_range(0, 0, 0), (0, self.rows))
+        half = (GRID + 1) // 2
+        covered = 0
+        for x in range(2):
+            for y in range(2):
+                start, stop = self.map.tile_range(1, x, y)
+                xy = self.map.xy[start:stop].astype(np.int64)
+                self.assertTrue(np.all(xy // half == [x, y]))
+                covered += stop - start
+        self.assertEqual(covered, self.rows)
+        with self.assertRaises(ValueError):
+            self.map.tile_range(1, 2, 0)
+
+    def test_tile_samples_large_tiles(self):
+        body = self.map.tile(0, 0, 0, limit=100)
+        magic, points, total = TILE_HEADER.unpack_from(body)
+        self.assertEqual((magic, points, total), (b'CMAP', 100, self.rows))
+        self.assertEqual(len(body), TILE_HEADER.size + points * (4 + 4 + 2))
+
+    def test_map_endpoints(self):
+        self.assertEqual(self.client.get('/api/map/').status_code, 404)
+        self.recommender.map = self.map
+        info = self.client.get('/api/map/').json()
+        self.assertEqual((info['points'], len(info['clusters'])), (self.rows, 6))
+
+        response = self.client.get('/api/map/0/0/0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TILE_HEADER.unpack_from(response.content)[2], self.rows)
+        cached = self.client.get('/api/map/0/0/0', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.client.get('/api/map/1/5/0').status_code, 400)
+
+
+class ProfileTests(ServingTestCase, TransactionTestCase):
+    """The async profile views run their ORM work on executor threads, so the rows must be committed."""
+
+    def test_seen_bitset(self):
+        bits = seen_bitset([0, 9, 20], 21)
+        self.assertEqual(np.flatnonzero(np.unpackbits(bits)).tolist(), [0, 9, 20])
+        bits = set_bits(bits, [3, 9])
+        self.assertEqual(np.flatnonzero(np.unpackbits(bits)).tolist(), [0, 3, 9, 20])
+
+    def create(self):
+        response = self.post('/api/profiles/', {})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['profile']
+
+    def test_recommendations_skip_seen_titles(self):
+        key = self.create()
+        query = {'genre': 'Action', 'content': 'a heist in the city', 'k': 10}
+        first = [item['id'] for item in self.post(f'/api/profiles/{key}/recommend/', query).json()]
+        second = [item['id'] for item in self.post(f'/api/profiles/{key}/recommend/', query).json()]
+        self.assertEqual(len(first), 10)
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(self.client.get(f'/api/profiles/{key}/').json()['seen'], 20)
+
+    def test_feedback_updates_the_preference_vector(self):
+        key = self.create()
+        embeddings, movies = self.recommender.catalog.embeddings, self.recommender.movies
+        for movie_id, liked in ((3, True), (4, False), (3, False)):
+            response = self.post(f'/api/profiles/{key}/feedback/', {'movie_id': movie_id, 'liked': liked})
+            self.assertEqual(response.status_code, 200)
+        vector = np.frombuffer(Profile.objects.get(key=key).vector, dtype=np.float32)
+        expected = -0.5 * embeddings[movies.row_for_id(3)] - 0.5 * embeddings[movies.row_for_id(4)]
+        np.testing.assert_allclose(vector, expected, atol=1e-6)
+        self.assertEqual(self.client.get(f'/api/profiles/{key}/').json()['dislikes'], [3, 4])
+
+        results = self.post(f'/api/profiles/{key}/recommend/', {'k': 20}).json()
+        self.assertFalse({3, 4} & {item['id'] for item in results})
+
+    def test_bad_requests(self):
+        key = self.create()
+        self.assertEqual(self.post(f'/api/profiles/{key}/feedback/', {'movie_id': 99999, 'liked': True}).status_code,
+                         404)
+        self.assertEqual(self.post(f'/api/profiles/{key}/feedback/', {'movie_id': 3}).status_code, 400)
+        self.assertEqual(self.post('/api/profiles/nope/feedback/', {'movie_id': 3, 'liked': True}).status_code, 404)
+        self.assertEqual(self.post('/api/profiles/nope/recommend/', {}).status_code, 404)
+        self.assertEqual(self.client.get('/api/profiles/nope/').status_code, 404)
@@ -0,0 +1,143 @@
+"""
+CPU thread budget of a serving process.
+
+torch, OpenMP and BLAS each size their thread pools to every core of the
+machine, and so does every web worker. Eight workers on a 16-core node then
+run 8 x 16 threads on 16 cores and tail latency explodes. ``configure`` runs
+once per process from ``ApiConfig.ready``, before numpy or torch are
+imported, and splits the cores this process may actually use (affinity mask
+and cgroup CPU quota) between the web workers:
+
+- ``encoder``: torch / ONNX Runtime intra-op threads. Micro-batching runs
+  one encode at a time, so it gets the worker's whole share.
+- ``executor``: concurrent recommend jobs of the async views.
+- ``blas``: OpenMP / BLAS threads for scoring, so that ``executor`` jobs
+  scoring at once stay within the share.
+
+Explicit RECOMMENDER_ENCODER_THREADS / RECOMMENDER_EXECUTOR_WORKERS win over
+the computed values; RECOMMENDER_THREAD_BUDGET = False leaves every pool at
+its library default.
+"""
+import os
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# thread pools that OpenMP and the BLAS libraries size from the environment when they load
+THREAD_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+ThreadBudget = namedtuple('ThreadBudget', ['cpus', 'workers', 'per_worker', 'encoder', 'executor', 'blas'])
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root='/sys/fs/cgroup'):
+    """CPUs allowed by the cgroup CPU quota (v2 ``cpu.max`` or v1 CFS), or None when unlimited."""
+    fields = _read(os.path.join(root, 'cpu.max'))
+    if fields is None:
+        quota = _read(os.path.join(root, 'cpu', 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(root, 'cpu', 'cpu.cfs_period_us'))
+        fields = quota + period if quota and period else None
+    if not fields or len(fields) < 2 or fields[0] in ('max', '-1'):
+        return None
+    try:
+        return int(fields[0]) / int(fields[1])
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def available_cpus():
+    """Cores this process may run on: its affinity mask, capped by the cgroup quota."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        # a 1.5 CPU quota still throttles two busy threads
+        cpus = min(cpus, max(1, int(limit)))
+    return cpus
+
+
+def web_workers():
+    """Server processes sharing the cores: RECOMMENDER_WEB_WORKERS, else WEB_CONCURRENCY (see gunicorn.conf.py)."""
+    workers = settings.RECOMMENDER_WEB_WORKERS or os.environ.get('WEB_CONCURRENCY') or 1
+    return max(1, int(workers))
+
+
+def plan(cpus, workers, per_worker=None, encoder=None, executor=None):
+    """Splits ``cpus`` cores between ``workers`` processes and the pools inside each."""
+    per_worker = per_worker or max(1, cpus // workers)
+    executor = executor or per_worker
+    return ThreadBudget(cpus, workers, per_worker, encoder or per_worker, executor, max(1, per_worker // executor))
+
+
+def set_blas_threads(threads):
+    """Sizes the OpenMP/BLAS pools: through the environment before numpy loads, with threadpoolctl after."""
+    os.environ.update({name: str(threads) for name in THREAD_ENV})
+    if 'numpy' not in sys.modules:
+        return
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        print(" numpy is already loaded and threadpoolctl is not installed, BLAS threads unchanged.")
+        return
+    threadpool_limits(threads)
+
+
+@contextmanager
+def thread_env(threads):
+    """Child processes started inside the block get ``threads`` OpenMP/BLAS threads."""
+    saved = {name: os.environ.get(name) for name in THREAD_ENV}
+    os.environ.update({name: str(threads) for name in THREAD_ENV})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    """This process's ThreadBudget; the pools follow it once ``configure`` ran."""
+    global _budget
+    if _budget is None:
+        with _budget_lock:
+            if _budget is None:
+                cpus, workers = available_cpus(), web_workers()
+                if settings.RECOMMENDER_THREAD_BUDGET:
+                    _budget = plan(cpus, workers, settings.RECOMMENDER_WORKER_THREADS,
+                                   settings.RECOMMENDER_ENCODER_THREADS, settings.RECOMMENDER_EXECUTOR_WORKERS)
+                else:
+                    # library defaults; the executor keeps one thread per core
+                    _budget = ThreadBudget(cpus, workers, None, settings.RECOMMENDER_ENCODER_THREADS,
+                                           settings.RECOMMENDER_EXECUTOR_WORKERS or os.cpu_count() or 1, None)
+    return _budget
+
+
+def configure():
+    """Applies the budget to this process's BLAS and torch pools; call before the model loads."""
+    budget = get_budget()
+    if budget.blas:
+        set_blas_threads(budget.blas)
+    if budget.encoder and 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(budget.encoder)
+    if settings.RECOMMENDER_THREAD_BUDGET:
+        print(f" Thread budget: {budget.cpus} CPUs / {budget.workers} worker(s), encoder {budget.encoder}, "
+              f"executor {budget.executor}, BLAS {budget.blas}.")
+    return budget
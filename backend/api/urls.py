@@ -1,7 +1,32 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.RECOMMENDER_ASYNC_VIEWS:
+    options, recommend, recommend_batch = (
+        views.get_options_async, views.recommend_movies_async, views.recommend_movies_batch_async)
+    live, ready = views.health_live_async, views.health_ready_async
+    feedback, profile_recommend = views.profile_feedback_async, views.recommend_for_profile_async
+    similar = views.similar_movies_async
+else:
+    options, recommend, recommend_batch = views.get_options, views.recommend_movies, views.recommend_movies_batch
+    live, ready = views.health_live, views.health_ready
+    feedback, profile_recommend = views.profile_feedback, views.recommend_for_profile
+    similar = views.similar_movies
+
 urlpatterns = [
-    path('options/', views.get_options, name='get_options'),
-    path('recommend/', views.recommend_movies, name='recommend_movies'),
-]
\ No newline at end of file
+    path('options/', options, name='get_options'),
+    path('recommend/', recommend, name='recommend_movies'),
+    path('recommend/batch/', recommend_batch, name='recommend_movies_batch'),
+    path('movies/<int:movie_id>/similar/', similar, name='similar_movies'),
+    path('profiles/', views.create_profile, name='create_profile'),
+    path('profiles/<str:key>/', views.profile_detail, name='profile_detail'),
+    path('profiles/<str:key>/feedback/', feedback, name='profile_feedback'),
+    path('profiles/<str:key>/recommend/', profile_recommend, name='recommend_for_profile'),
+    path('map/', views.catalog_map, name='catalog_map'),
+    path('map/<int:z>/<int:x>/<int:y>', views.catalog_map_tile, name='catalog_map_tile'),
+    path('stats/', views.get_stats, name='get_stats'),
+    path('health/live', live, name='health_live'),
+    path('health/ready', ready, name='health_ready'),
+    path('metrics', views.get_metrics, name='get_metrics'),
+]
@@ -1,104 +1,620 @@
+import json
+import logging
+import time
+
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
-import os
-import pickle
-import numpy as np
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from sklearn.metrics.pairwise import cosine_similarity
 from django.conf import settings
-from sentence_transformers import SentenceTransformer
+from django.db import close_old_connections
+
+from .executor import Overloaded, get_executor
+from .layout import GRID, MAX_ZOOM, TILE_HEADER
+from .loader import FAILED, get_recommender, loader
+from .metrics import LabeledHistogram, RequestMetrics, Timings, gauge
+from .pagination import CursorExpired, parse_k, parse_paging
+from .profiles import get_profile_store
+from .recommender import DEFAULT_K, parse_query
+from .threads import get_budget
+from .vocabulary import GENRES, MOOD_MAPPING
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('query', 'queue', 'cursor', 'encode', 'filter', 'similarity', 'topk', 'rerank', 'lexical', 'fusion',
+          'neighbors', 'profile', 'seen', 'tile', 'serialize')
+ENDPOINTS = ('recommend', 'recommend_batch', 'similar', 'profile', 'map')
+STAGE_SECONDS = LabeledHistogram(
+    'recommender_stage_seconds', 'Time spent in each stage of the recommend path.', 'stage', labels=STAGES)
+REQUEST_SECONDS = LabeledHistogram(
+    'recommender_request_seconds', 'Recommend request latency inside the view.', 'endpoint', labels=ENDPOINTS,
+    lock=STAGE_SECONDS.lock)
+REQUEST_METRICS = RequestMetrics(STAGE_SECONDS, REQUEST_SECONDS)
+
+
+def timed(response, timings, endpoint, version):
+    """
+    Adds the Server-Timing header and the catalog version that served the
+    request, and records the request's stages.
+    """
+    total = timings.total()
+    REQUEST_METRICS.observe(endpoint, timings.stages, total)
+    response['Server-Timing'] = timings.server_timing(total)
+    response['X-Artifact-Version'] = version
+    return response
+
+
+def not_ready_response(response_class=Response):
+    if loader.state == FAILED:
+        return response_class({"error": "ML Model failed to load.", "detail": loader.error}, status=500)
+    return response_class({"error": "ML Model not ready."}, status=503, headers={"Retry-After": "5"})
 
-BASE_DIR = settings.BASE_DIR
-ML_DIR = os.path.join(BASE_DIR, 'api', 'ml')
 
-print(f"--- INIT: Loading S-BERT Model from: {ML_DIR} ---")
+def overloaded_response():
+    return JsonResponse({"error": "Server busy, try again."}, status=503, headers={"Retry-After": "1"})
 
 
-movies_df = None
-movie_embeddings = None
-model = None
+def parse_batch(data):
+    """(queries, k) of a batch request body; raises ValueError when it is invalid."""
+    queries = data.get('queries') if isinstance(data, dict) else data
+    if not isinstance(queries, list):
+        raise ValueError("Expected a list of queries or {\"queries\": [...]}.")
+    if len(queries) > settings.RECOMMENDER_MAX_BATCH_SIZE:
+        raise ValueError(f"At most {settings.RECOMMENDER_MAX_BATCH_SIZE} queries per batch.")
 
-try:
+    return queries, parse_k(data, DEFAULT_K, settings.RECOMMENDER_MAX_K)
 
-    movies_path = os.path.join(ML_DIR, 'movies.pkl')
-    movies_df = pickle.load(open(movies_path, 'rb'))
-    emb_path = os.path.join(ML_DIR, 'movie_embeddings.pkl')
-    movie_embeddings = pickle.load(open(emb_path, 'rb'))
 
-    print("Loading SentenceTransformer (all-MiniLM-L6-v2)...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    print(" Model & Data loaded.")
-except FileNotFoundError as e:
-    print(f" Error: .pkl File not found! {e}")
-    print("   Please run 'python scripts/build_engine.py' first.")
-except Exception as e:
-    print(f" Critical Error loading model: {e}")
+def render_recommend(recommender, query, paging, timings):
+    """Response body of /api/recommend/: the top k, or one page of them when the client pages."""
+    if paging.paged:
+        return recommender.render_page(query, paging.k, paging.cursor, timings=timings)
+    return recommender.render(query, paging.k, timings=timings)
 
-MOOD_MAPPING = {
-    "Funny": "comedy, funny, hilarious, parody, spoof, laughing, happy",
-    "Dark": "crime, murder, thriller, horror, noir, dark, tense, gritty",
-    "Exciting": "action, adventure, war, explosion, chase, fast-paced, adrenaline",
-    "Emotional": "drama, romance, love, sad, crying, touching, sentimental, wedding",
-    "Brainy": "mystery, puzzle, psychology, philosophy, mind-bending, complex, sci-fi"
-}
 
 @api_view(['GET'])
 def get_options(request):
-    genres = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama",
-              "Family", "Fantasy", "History", "Horror", "Music", "Mystery", "Romance",
-              "Science Fiction", "Thriller", "War", "Western"]
     moods = list(MOOD_MAPPING.keys())
-    return Response({"genres": genres, "moods": moods})
+    return Response({"genres": GENRES, "moods": moods})
+
+
+@api_view(['GET'])
+def health_live(request):
+    return Response({"status": "ok"})
+
+
+@api_view(['GET'])
+def health_ready(request):
+    status = loader.status()
+    return Response(status, status=200 if loader.healthy else 503)
+
+
+@api_view(['GET'])
+def get_stats(request):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+
+    stats = {
+        "version": recommender.version,
+        "query_cache": recommender.query_cache.stats(),
+        "result_cache": recommender.result_cache.stats(),
+        "cursor_cache": recommender.candidates.stats(),
+    }
+    if hasattr(recommender.model, 'stats'):
+        stats["micro_batching"] = recommender.model.stats()
+    if hasattr(recommender.engine, 'stats'):
+        stats["shards"] = recommender.engine.stats()
+    if settings.RECOMMENDER_ASYNC_VIEWS:
+        stats["executor"] = get_executor().stats()
+    stats["threads"] = get_budget()._asdict()
+    return Response(stats)
+
+
+def cache_samples(recommender):
+    caches = {'result': recommender.result_cache.stats(), 'cursor': recommender.candidates.stats()}
+    for layer, stats in recommender.query_cache.stats().items():
+        caches[f'query_{layer}'] = stats
+    return caches
+
+
+@api_view(['GET'])
+def get_metrics(request):
+    """Prometheus text exposition of this worker's metrics."""
+    lines = REQUEST_METRICS.prometheus()
+    lines += gauge('recommender_ready', 'Whether the model and catalog are loaded.', [({}, int(loader.ready))])
+    lines += gauge('recommender_load_seconds', 'Duration of each model loading stage.',
+                   [({'stage': stage}, seconds) for stage, seconds in loader.stages.items()])
+    lines += gauge('recommender_catalog_reloads_total', 'Catalog versions switched to without a restart.',
+                   [({}, loader.reloads)], 'counter')
+    lines += gauge('recommender_catalog_draining', 'Replaced catalog versions still held by running requests.',
+                   [({}, len(loader.draining))])
+    budget = get_budget()
+    lines += gauge('recommender_cpus_available', 'Cores this worker may use (affinity and cgroup quota).',
+                   [({}, budget.cpus)])
+    lines += gauge('recommender_web_workers', 'Server processes the cores are split between.', [({}, budget.workers)])
+    # pools left at their library default are not reported
+    lines += gauge('recommender_threads', 'Threads configured per pool in this worker.',
+                   [({'pool': pool}, getattr(budget, pool)) for pool in ('encoder', 'executor', 'blas')
+                    if getattr(budget, pool) is not None])
+    if settings.RECOMMENDER_ASYNC_VIEWS:
+        executor = get_executor().stats()
+        lines += gauge('recommender_executor_pending', 'Requests running or queued on the executor.',
+                       [({}, executor['pending'])])
+        lines += gauge('recommender_executor_rejected_total', 'Requests shed with 503 because the executor was full.',
+                       [({}, executor['rejected'])], 'counter')
+
+    recommender = loader.recommender
+    if recommender is not None:
+        catalog = recommender.catalog
+        lines += gauge('recommender_catalog_info', 'Loaded catalog artifact.',
+                       [({'version': catalog.version, 'model': catalog.model_name}, 1)])
+        lines += gauge('recommender_catalog_rows', 'Movies in the loaded catalog.', [({}, len(catalog))])
+
+        caches = cache_samples(recommender)
+        lines += gauge('recommender_cache_hits_total', 'Cache hits.',
+                       [({'cache': name}, stats['hits']) for name, stats in caches.items()], 'counter')
+        lines += gauge('recommender_cache_misses_total', 'Cache misses.',
+                       [({'cache': name}, stats['misses']) for name, stats in caches.items()], 'counter')
+        lines += gauge('recommender_cache_hit_ratio', 'Cache hit rate since startup.',
+                       [({'cache': name}, stats['hit_rate']) for name, stats in caches.items()])
+
+        model = recommender.model
+        if hasattr(model, 'batch_size'):
+            for name, histogram, help in [
+                ('recommender_encode_batch_size', model.batch_size, 'Texts per micro-batched encode call.'),
+                ('recommender_encode_queue_depth', model.queue_depth, 'Encode requests still queued per batch.'),
+                ('recommender_encode_wait_seconds', model.wait_seconds, 'Time a text waited for its batch.'),
+            ]:
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram'] + histogram.prometheus(name)
+
+    return HttpResponse("\n".join(lines) + "\n", content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @api_view(['POST'])
 def recommend_movies(request):
-    if model is None:
-        return Response({"error": "ML Model not ready."}, status=500)
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+
+    timings = Timings()
+    try:
+        query = parse_query(request.data)
+        paging = parse_paging(request.data, DEFAULT_K, settings.RECOMMENDER_MAX_K)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    logger.debug("Search query: %s", recommender.query_text(query))
+    timings.since('query', timings.started)
+
+    try:
+        body = render_recommend(recommender, query, paging, timings)
+        return timed(HttpResponse(body, content_type='application/json'), timings, 'recommend', recommender.version)
+    except CursorExpired as e:
+        return Response({"error": str(e)}, status=410)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    except Exception as e:
+        logger.exception("Recommend request failed")
+        return Response({"error": str(e)}, status=500)
+
+
+def parse_similar_k(params):
+    try:
+        k = int(params.get('k', DEFAULT_K))
+    except ValueError:
+        k = 0
+    if not 1 <= k <= settings.RECOMMENDER_MAX_K:
+        raise ValueError(f"'k' must be an integer between 1 and {settings.RECOMMENDER_MAX_K}.")
+    return k
+
 
-    data = request.data
-    genre = data.get('genre', '')
-    mood_key = data.get('mood', '')
-    content = data.get('content', '')
-    element = data.get('element', '')
+def render_similar(recommender, movie_id, k, timings):
+    """Response body of /api/movies/<id>/similar/, or None for an unknown movie."""
+    start = time.perf_counter()
+    ranked = recommender.similar(movie_id, k)
+    if ranked is None:
+        return None
+    start = timings.since('neighbors', start)
+    body = ranked.to_json()
+    timings.since('serialize', start)
+    return body
 
-    mood_keywords = MOOD_MAPPING.get(mood_key, "")
 
-    # SBERT Query Construction
-    user_query = f"A {genre} movie. Mood: {mood_keywords}. About: {content}. Contains: {element}."
-    print(f"🔍 AI Search Query: {user_query}")
+@api_view(['GET'])
+def similar_movies(request, movie_id):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
 
     try:
-        #  Encode
-        query_embedding = model.encode([user_query])
+        k = parse_similar_k(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    timings = Timings()
+    body = render_similar(recommender, movie_id, k, timings)
+    if body is None:
+        return Response({"error": f"Unknown movie {movie_id}."}, status=404)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'similar', recommender.version)
+
+
+@api_view(['POST'])
+def create_profile(request):
+    """Starts a session profile; its key goes into the /api/profiles/<key>/... URLs."""
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+    profile = get_profile_store().create(recommender)
+    return Response({"profile": profile.key}, status=201)
+
+
+@api_view(['GET'])
+def profile_detail(request, key):
+    profile = get_profile_store().get(key)
+    if profile is None:
+        return Response({"error": "Unknown profile."}, status=404)
+    feedback = {True: [], False: [], None: []}
+    for movie_id, liked in profile.feedback.order_by('created').values_list('movie_id', 'liked'):
+        feedback[liked].append(movie_id)
+    return Response({
+        "profile": profile.key,
+        "likes": feedback[True],
+        "dislikes": feedback[False],
+        "seen": len(feedback[True]) + len(feedback[False]) + len(feedback[None]),
+    })
+
+
+def parse_feedback(data):
+    """(movie_id, liked) of a feedback body; raises ValueError when it is invalid."""
+    data = data if isinstance(data, dict) else {}
+    movie_id, liked = data.get('movie_id'), data.get('liked')
+    if not isinstance(movie_id, int) or isinstance(movie_id, bool) or not isinstance(liked, bool):
+        raise ValueError("Expected {\"movie_id\": <int>, \"liked\": true | false}.")
+    return movie_id, liked
 
-        #  Similarity
-        similarities = cosine_similarity(query_embedding, movie_embeddings)
 
-        #  Sort + Return Top 6
-        scores = list(enumerate(similarities[0]))
-        sorted_scores = sorted(scores, key=lambda x: x[1], reverse=True)
+def save_feedback(recommender, key, movie_id, liked):
+    """Records a like or dislike; raises LookupError for an unknown profile or movie."""
+    store = get_profile_store()
+    profile = store.get(key)
+    if profile is None:
+        raise LookupError("Unknown profile.")
+    row = recommender.movies.row_for_id(movie_id)
+    if row is None:
+        raise LookupError(f"Unknown movie {movie_id}.")
+    store.record(profile, recommender, row, liked)
+    return {"profile": profile.key, "movie_id": movie_id, "liked": liked}
 
-        results = []
-        for index, score in sorted_scores[:6]:
-            row = movies_df.iloc[index]
 
-            release_date = str(row['release_date'])
-            year = release_date.split("-")[0] if "-" in release_date else "N/A"
+def render_profile_recommend(recommender, key, query, k, timings):
+    """
+    Response body of /api/profiles/<key>/recommend/; marks the returned
+    titles as seen. Raises LookupError for an unknown profile.
+    """
+    start = time.perf_counter()
+    store = get_profile_store()
+    profile = store.get(key)
+    if profile is None:
+        raise LookupError("Unknown profile.")
+    state = store.state(profile, recommender)
+    timings.since('profile', start)
 
-            results.append({
-                "id": int(row['id']),
-                "title": row['title'],
-                "overview": row['overview'],
-                "score": round(float(score), 2),
-                "genres": row['genres_str'],
-                "year": year,
-                "rating": float(row['vote_average']),
-                "runtime": int(row['runtime'])
-            })
+    ranked = recommender.rank_personal(query, state.preference, state.seen, k,
+                                       settings.RECOMMENDER_PROFILE_WEIGHT, timings)
+    start = time.perf_counter()
+    store.mark_seen(profile, recommender, state, ranked.indices)
+    start = timings.since('seen', start)
+    body = ranked.to_json()
+    timings.since('serialize', start)
+    return body
 
-        return Response(results)
 
+@api_view(['POST'])
+def profile_feedback(request, key):
+    """Records {"movie_id": ..., "liked": true | false} for a profile."""
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+
+    try:
+        movie_id, liked = parse_feedback(request.data)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    try:
+        return Response(save_feedback(recommender, key, movie_id, liked))
+    except LookupError as e:
+        return Response({"error": str(e)}, status=404)
+
+
+@api_view(['POST'])
+def recommend_for_profile(request, key):
+    """
+    Wizard recommend (every field optional) blended with the profile's likes
+    and dislikes, never returning a title the profile has already seen.
+    """
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+
+    timings = Timings()
+    try:
+        query = parse_query(request.data)
+        k = parse_k(request.data, DEFAULT_K, settings.RECOMMENDER_MAX_K)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    timings.since('query', timings.started)
+
+    try:
+        body = render_profile_recommend(recommender, key, query, k, timings)
+    except LookupError as e:
+        return Response({"error": str(e)}, status=404)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    except Exception as e:
+        logger.exception("Recommend request failed")
+        return Response({"error": str(e)}, status=500)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'profile', recommender.version)
+
+
+@api_view(['GET'])
+def catalog_map(request):
+    """Clusters of the catalog map and how to fetch its tiles."""
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+    if recommender.map is None:
+        return Response({"error": "Catalog was built without a map."}, status=404)
+
+    response = Response({
+        "version": recommender.version,
+        "points": len(recommender.map),
+        "grid": GRID + 1,
+        "max_zoom": MAX_ZOOM,
+        "tile_points": settings.RECOMMENDER_MAP_TILE_POINTS,
+        "tiles": "/api/map/{z}/{x}/{y}",
+        "tile_format": f"little-endian header {TILE_HEADER.format} (magic, points, points in tile), "
+                       "int32 movie ids, uint16 x/y pairs, uint16 cluster ids",
+        "clusters": recommender.map.clusters_json(),
+    })
+    response['X-Artifact-Version'] = recommender.version
+    return response
+
+
+@require_GET
+def catalog_map_tile(request, z, x, y):
+    """Binary tile of the catalog map (see ``CatalogMap.tile``), cacheable per catalog version."""
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+    if recommender.map is None:
+        return JsonResponse({"error": "Catalog was built without a map."}, status=404)
+
+    etag = f'"{recommender.version}-{z}-{x}-{y}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304, headers={'ETag': etag})
+    timings = Timings()
+    try:
+        body = recommender.map.tile(z, x, y, settings.RECOMMENDER_MAP_TILE_POINTS)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    timings.since('tile', timings.started)
+    response = HttpResponse(body, content_type='application/octet-stream',
+                            headers={'ETag': etag, 'Cache-Control': 'public, max-age=3600'})
+    return timed(response, timings, 'map', recommender.version)
+
+
+@api_view(['POST'])
+def recommend_movies_batch(request):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response()
+
+    try:
+        queries, k = parse_batch(request.data)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    timings = Timings()
+    try:
+        body = recommender.render_payloads(queries, k, timings=timings)
+        response = HttpResponse(body, content_type='application/json')
+        return timed(response, timings, 'recommend_batch', recommender.version)
+    except Exception as e:
+        logger.exception("Recommend request failed")
+        return Response({"error": str(e)}, status=500)
+
+
+# Async variants, routed instead of the views above when RECOMMENDER_ASYNC_VIEWS
+# is on. Cheap requests are answered on the event loop; encoding and scoring
+# go through the bounded executor.
+
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def json_body(request):
+    """
+    Request data as the DRF views see it: a JSON body, or the QueryDict of a
+    form post (DRF's default parsers). Raises ValueError otherwise.
+    """
+    if request.content_type in FORM_CONTENT_TYPES:
+        return request.POST
+    if request.content_type not in ('application/json', ''):
+        raise ValueError(f"Unsupported content type '{request.content_type}'; send JSON (application/json).")
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        raise ValueError("Request body must be valid JSON.") from None
+
+
+async def offload(timings, fn, *args):
+    """
+    Runs fn(*args, timings=timings) on the executor, recording the time it
+    waited there as the 'queue' stage.
+    """
+    def job():
+        timings.since('queue', queued)
+        return fn(*args, timings=timings)
+
+    queued = timings.since('query', timings.started)
+    return await get_executor().run(job)
+
+
+def db_job(fn):
+    """
+    fn for the executor, when it uses the ORM: the pool thread's connection
+    is closed afterwards, as Django does at the end of a request.
+    """
+    def job(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return job
+
+
+@require_GET
+async def get_options_async(request):
+    return JsonResponse({"genres": GENRES, "moods": list(MOOD_MAPPING.keys())})
+
+
+@require_GET
+async def health_live_async(request):
+    return JsonResponse({"status": "ok"})
+
+
+@require_GET
+async def health_ready_async(request):
+    return JsonResponse(loader.status(), status=200 if loader.healthy else 503)
+
+
+@require_GET
+async def similar_movies_async(request, movie_id):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+
+    try:
+        k = parse_similar_k(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # a neighbour-table lookup is answered here; a k past the table scans the catalog on the executor
+    timings = Timings()
+    if recommender.has_neighbors(k):
+        body = render_similar(recommender, movie_id, k, timings)
+    else:
+        try:
+            body = await offload(timings, render_similar, recommender, movie_id, k)
+        except Overloaded:
+            return overloaded_response()
+    if body is None:
+        return JsonResponse({"error": f"Unknown movie {movie_id}."}, status=404)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'similar', recommender.version)
+
+
+@csrf_exempt
+@require_POST
+async def recommend_movies_async(request):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+
+    timings = Timings()
+    try:
+        data = json_body(request)
+        query = parse_query(data)
+        paging = parse_paging(data, DEFAULT_K, settings.RECOMMENDER_MAX_K)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    logger.debug("Search query: %s", recommender.query_text(query))
+    try:
+        body = await offload(timings, render_recommend, recommender, query, paging)
+    except Overloaded:
+        return overloaded_response()
+    except CursorExpired as e:
+        return JsonResponse({"error": str(e)}, status=410)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except Exception as e:
+        logger.exception("Recommend request failed")
+        return JsonResponse({"error": str(e)}, status=500)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'recommend', recommender.version)
+
+
+@csrf_exempt
+@require_POST
+async def recommend_movies_batch_async(request):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+
+    try:
+        queries, k = parse_batch(json_body(request))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    timings = Timings()
+    try:
+        body = await offload(timings, recommender.render_payloads, queries, k)
+    except Overloaded:
+        return overloaded_response()
+    except Exception as e:
+        logger.exception("Recommend request failed")
+        return JsonResponse({"error": str(e)}, status=500)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'recommend_batch', recommender.version)
+
+
+@csrf_exempt
+@require_POST
+async def profile_feedback_async(request, key):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+
+    try:
+        movie_id, liked = parse_feedback(json_body(request))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        result = await get_executor().run(db_job(save_feedback), recommender, key, movie_id, liked)
+    except Overloaded:
+        return overloaded_response()
+    except LookupError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except Exception as e:
+        logger.exception("Profile feedback failed")
+        return JsonResponse({"error": str(e)}, status=500)
+    return JsonResponse(result)
+
+
+@csrf_exempt
+@require_POST
+async def recommend_for_profile_async(request, key):
+    recommender = get_recommender()
+    if recommender is None:
+        return not_ready_response(JsonResponse)
+
+    timings = Timings()
+    try:
+        data = json_body(request)
+        query = parse_query(data)
+        k = parse_k(data, DEFAULT_K, settings.RECOMMENDER_MAX_K)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        body = await offload(timings, db_job(render_profile_recommend), recommender, key, query, k)
+    except Overloaded:
+        return overloaded_response()
+    except LookupError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
     except Exception as e:
-        print(f"Error: {e}")
-        return Response({"error": str(e)}, status=500)
\ No newline at end of file
+        logger.exception("Recommend request failed")
+        return JsonResponse({"error": str(e)}, status=500)
+    return timed(HttpResponse(body, content_type='application/json'), timings, 'profile', recommender.version)
@@ -0,0 +1,44 @@
+"""
+The wizard's closed vocabulary and the query text built from it.
+
+Kept free of Django imports so the build scripts can share it with the API.
+"""
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama",
+          "Family", "Fantasy", "History", "Horror", "Music", "Mystery", "Romance",
+          "Science Fiction", "Thriller", "War", "Western"]
+
+MOOD_MAPPING = {
+    "Funny": "comedy, funny, hilarious, parody, spoof, laughing, happy",
+    "Dark": "crime, murder, thriller, horror, noir, dark, tense, gritty",
+    "Exciting": "action, adventure, war, explosion, chase, fast-paced, adrenaline",
+    "Emotional": "drama, romance, love, sad, crying, touching, sentimental, wedding",
+    "Brainy": "mystery, puzzle, psychology, philosophy, mind-bending, complex, sci-fi"
+}
+
+
+def build_query_text(genre='', mood='', content='', element=''):
+    # SBERT Query Construction
+    mood_keywords = MOOD_MAPPING.get(mood, "")
+    return f"A {genre} movie. Mood: {mood_keywords}. About: {content}. Contains: {element}."
+
+
+def genre_text(genre):
+    return f"A {genre} movie."
+
+
+def mood_text(mood):
+    return f"Mood: {MOOD_MAPPING[mood]}."
+
+
+def free_text(content='', element=''):
+    if not str(content).strip() and not str(element).strip():
+        return ""
+    return f"About: {content}. Contains: {element}."
+
+
+def vocabulary_texts():
+    """(key, text) for every option that gets a pre-encoded vector at build time."""
+    entries = [(f"genre:{g}", genre_text(g)) for g in GENRES]
+    entries += [(f"mood:{m}", mood_text(m)) for m in MOOD_MAPPING]
+    return entries
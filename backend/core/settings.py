@@ -128,3 +128,113 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_EXPOSE_HEADERS = ['Server-Timing', 'X-Artifact-Version']
+
+# Recommender
+RECOMMENDER_CATALOG_DIR = BASE_DIR / 'api' / 'ml' / 'catalog'
+
+# Query encoder backend (see api/encoders.py): 'sbert' (fp32 torch),
+# 'torch-int8', 'onnx' / 'onnx-int8' (exported with build_sbert_model.py
+# --export-onnx into RECOMMENDER_ENCODER_DIR), or 'hash', a deterministic
+# offline stand-in for benchmarks. RECOMMENDER_ENCODER_THREADS caps the
+# intra-op threads (None = the thread budget's share, see below).
+RECOMMENDER_ENCODER = 'sbert'
+RECOMMENDER_ENCODER_THREADS = None
+RECOMMENDER_ENCODER_DIR = BASE_DIR / 'api' / 'ml' / 'encoders'
+
+# Split the cores (affinity mask and cgroup CPU quota) between the
+# RECOMMENDER_WEB_WORKERS server processes (None = $WEB_CONCURRENCY, else 1)
+# and size each one's encoder, executor and BLAS pools to its share (see
+# api/threads.py). RECOMMENDER_WORKER_THREADS overrides the share; False
+# leaves every pool at its library default.
+RECOMMENDER_THREAD_BUDGET = True
+RECOMMENDER_WEB_WORKERS = None
+RECOMMENDER_WORKER_THREADS = None
+
+# Start loading the model in the background when a server process starts
+# (management commands other than runserver never load it).
+RECOMMENDER_LOAD_ON_STARTUP = True
+
+# Serving workers switch to a rebuilt catalog without restarting: when its
+# CURRENT file names a new version (checked every RECOMMENDER_RELOAD_POLL_SECONDS,
+# 0 = never), on RECOMMENDER_RELOAD_SIGNAL (None = no handler), or after
+# `manage.py reload_catalog`. The signal must be sent to the worker PIDs, never
+# to the gunicorn master, which acts on HUP, USR1, USR2, TTIN, TTOU and WINCH
+# itself (USR2 starts a second master), so pick one gunicorn leaves alone.
+RECOMMENDER_RELOAD_POLL_SECONDS = 5
+RECOMMENDER_RELOAD_SIGNAL = None
+
+# Query embeddings are cached per worker; set RECOMMENDER_QUERY_CACHE_PATH to a
+# sqlite file to also share them between all workers on the host.
+RECOMMENDER_QUERY_CACHE_SIZE = 1024
+RECOMMENDER_QUERY_CACHE_PATH = None
+RECOMMENDER_RESULT_CACHE_SIZE = 256
+
+# 'full' encodes the whole query sentence; 'composed' adds pre-encoded
+# genre/mood vectors to an encoding of the free text only (fewer model calls,
+# different rankings: check overlap@k with scripts/eval_composed_queries.py on
+# your catalog before switching).
+RECOMMENDER_QUERY_MODE = 'full'
+RECOMMENDER_COMPOSE_WEIGHTS = {'genre': 1.0, 'mood': 1.0, 'text': 1.0}
+
+# Limits for /api/recommend/batch/
+RECOMMENDER_MAX_BATCH_SIZE = 1000
+RECOMMENDER_MAX_K = 100
+
+# Session profiles (/api/profiles/): a personalised request blends the query
+# with the profile's preference vector at RECOMMENDER_PROFILE_WEIGHT; dislikes
+# count RECOMMENDER_DISLIKE_WEIGHT against it. Each worker caches the seen-title
+# bitsets of recently active profiles up to the entry and byte caps.
+RECOMMENDER_PROFILE_WEIGHT = 0.5
+RECOMMENDER_DISLIKE_WEIGHT = 0.5
+RECOMMENDER_PROFILE_CACHE_SIZE = 1024
+RECOMMENDER_PROFILE_CACHE_BYTES = 32 * 1024 * 1024
+
+# Most points in one /api/map/<z>/<x>/<y> tile; denser tiles send an even sample.
+RECOMMENDER_MAP_TILE_POINTS = 20000
+
+# Paged recommend requests ("cursor": null, then the returned next_cursor)
+# rank RECOMMENDER_PAGE_DEPTH candidates once and page through them. The
+# candidate lists are dropped after RECOMMENDER_CURSOR_TTL idle seconds, or
+# least recently used first past the entry or byte caps.
+RECOMMENDER_PAGE_DEPTH = 100
+RECOMMENDER_CURSOR_CACHE_SIZE = 10000
+RECOMMENDER_CURSOR_CACHE_BYTES = 32 * 1024 * 1024
+RECOMMENDER_CURSOR_TTL = 600
+
+# Concurrent encode calls are coalesced for up to this many milliseconds
+# (0 disables micro-batching) or until the batch holds MAX_SIZE texts.
+RECOMMENDER_MICROBATCH_WAIT_MS = 3
+RECOMMENDER_MICROBATCH_MAX_SIZE = 32
+
+# 'exact' scans every embedding; 'ivf' probes the RECOMMENDER_IVF_NPROBE
+# closest cells of the catalog's IVF index; 'int8'/'pq' scan compressed codes
+# and re-score the best RECOMMENDER_RERANK rows at full precision; 'sharded'
+# scans RECOMMENDER_SHARDS slices of the catalog in worker processes (see
+# api/shards.py). Modes whose index was not built fall back to exact search.
+RECOMMENDER_SEARCH = 'exact'
+RECOMMENDER_IVF_NPROBE = 16
+RECOMMENDER_RERANK = 256
+
+# Shard workers use RECOMMENDER_SHARD_THREADS BLAS threads each. Affinity is
+# None (no pinning), 'auto' (split the available CPUs between the shards) or a
+# list of CPU lists, one per shard.
+RECOMMENDER_SHARDS = 4
+RECOMMENDER_SHARD_THREADS = 1
+RECOMMENDER_SHARD_AFFINITY = None
+
+# 'hybrid' fuses the dense top RECOMMENDER_FUSION_DEPTH with a BM25 keyword
+# search over the content/element words ('rrf' = reciprocal rank fusion,
+# 'weighted' = sum of min-max normalised scores); 'dense' is SBERT only.
+RECOMMENDER_RETRIEVAL = 'dense'
+RECOMMENDER_FUSION = 'rrf'
+RECOMMENDER_LEXICAL_WEIGHT = 1.0
+RECOMMENDER_FUSION_DEPTH = 50
+
+# Serve options/recommend/health with the async views (api/views.py). Under
+# ASGI they run encoding and scoring on a pool of RECOMMENDER_EXECUTOR_WORKERS
+# threads (None = the thread budget's share of cores) and answer 503 once RECOMMENDER_EXECUTOR_QUEUE
+# more requests are already waiting for it.
+RECOMMENDER_ASYNC_VIEWS = True
+RECOMMENDER_EXECUTOR_WORKERS = None
+RECOMMENDER_EXECUTOR_QUEUE = 64
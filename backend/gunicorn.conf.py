@@ -0,0 +1,23 @@
+"""
+Production server: gunicorn managing uvicorn workers that serve core.asgi.
+
+    gunicorn core.asgi:application -c gunicorn.conf.py
+
+Every worker loads its own copy of the model and sizes its thread pools to
+its share of the cores (api/threads.py), which it learns from WEB_CONCURRENCY.
+"""
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'uvicorn.workers.UvicornWorker'
+# the model loads in the background, but give slow disks time to map the catalog
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # the thread budget divides the cores by this, also when --workers overrides the default
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
@@ -0,0 +1,68 @@
+"""
+Recall@k versus latency of the IVF index against exact search, on synthetic
+catalogs (no model or dataset needed).
+
+    python scripts/bench_ann.py --scales 100000 1000000 --nprobe 1 4 16 64
+"""
+import argparse
+import time
+
+import numpy as np
+
+from bench_utils import latency_stats, recall_at_k, synthetic_embeddings, synthetic_queries, time_each, write_json
+from api.ann import IVFIndex
+from api.engine import RetrievalEngine
+
+
+def bench_scale(rows, args):
+    print(f"\n=== {rows:,} vectors x {args.dim} dims ===")
+    embeddings = synthetic_embeddings(rows, args.dim, seed=args.seed)
+    queries = synthetic_queries(embeddings, args.queries, seed=args.seed + 1)
+
+    exact = RetrievalEngine(embeddings, normalized=True)
+    truth, exact_seconds = time_each(lambda q: exact.search(q, args.k)[0], queries)
+    exact_stats = latency_stats(exact_seconds)
+    print(f"exact          p50 {exact_stats['p50_ms']:8.3f} ms  p99 {exact_stats['p99_ms']:8.3f} ms  recall 1.000")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(embeddings, n_lists=args.lists, seed=args.seed)
+    build_seconds = time.perf_counter() - start
+    print(f"IVF build: {index.n_lists} lists in {build_seconds:.1f}s")
+
+    runs = []
+    for nprobe in args.nprobe:
+        found, seconds = time_each(lambda q: index.search(q, args.k, nprobe=nprobe)[0], queries)
+        stats = latency_stats(seconds)
+        recall = recall_at_k(truth, found)
+        speedup = exact_stats['p50_ms'] / stats['p50_ms']
+        print(f"ivf nprobe={nprobe:<4} p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms  "
+              f"recall {recall:.3f}  ({speedup:.1f}x)")
+        runs.append(dict(nprobe=nprobe, recall=recall, **stats))
+
+    return {
+        'rows': rows,
+        'n_lists': index.n_lists,
+        'build_seconds': build_seconds,
+        'exact': exact_stats,
+        'ivf': runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--lists', type=int, default=None, help="IVF cells (default ~4*sqrt(rows))")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    results = [bench_scale(rows, args) for rows in args.scales]
+    write_json(args.json, {'k': args.k, 'dim': args.dim, 'results': results})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Load test for /api/options/ and /api/recommend/ on a synthetic catalog with
+the deterministic hash encoder, so it runs offline on a CPU-only box.
+
+    python scripts/bench_api.py --rows 5000 --concurrency 1 4 16 --json bench.json
+    python scripts/bench_api.py --rows 1000000 --modes server --search ivf
+    python scripts/bench_api.py --modes server --views sync async --endpoints mixed --concurrency 16 64
+
+'client' calls the (sync) views in-process through Django's test client;
+'server' starts a real server process per --views and sends HTTP requests to
+it: 'sync' is ``manage.py runserver`` with the DRF views, 'async' is uvicorn
+with the async views and the bounded executor (--server-cmd overrides both).
+The 'mixed' endpoint interleaves options and recommend requests and reports
+them separately, to show whether cheap requests queue behind encoding.
+Synthetic catalogs are kept under --catalog-root and reused by later runs of
+the same size.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import BACKEND_DIR, latency_stats, synthetic_catalog, wizard_queries, write_json
+from api.encoders import HashEncoder
+
+SETTINGS_MODULE = 'bench_settings_{views}'
+SERVER_CMDS = {
+    'sync': "{python} manage.py runserver {host}:{port} --noreload",
+    'async': "{python} -m uvicorn core.asgi:application --host {host} --port {port} --log-level warning",
+}
+
+
+def write_settings(workdir, catalog_root, args, views):
+    """
+    Settings module for the benchmarked processes: the real settings plus the
+    bench catalog and the sync or async views. Returns its name.
+    """
+    name = SETTINGS_MODULE.format(views=views)
+    with open(os.path.join(workdir, name + '.py'), 'w') as f:
+        f.write("from core.settings import *  # noqa\n\n")
+        f.write(f"RECOMMENDER_CATALOG_DIR = {catalog_root!r}\n")
+        f.write("RECOMMENDER_ENCODER = 'hash'\n")
+        f.write(f"RECOMMENDER_SEARCH = {args.search!r}\n")
+        f.write(f"RECOMMENDER_QUERY_MODE = {args.query_mode!r}\n")
+        f.write(f"RECOMMENDER_ASYNC_VIEWS = {views == 'async'!r}\n")
+        f.write(f"RECOMMENDER_EXECUTOR_WORKERS = {args.executor_workers!r}\n")
+        f.write(f"RECOMMENDER_EXECUTOR_QUEUE = {args.executor_queue!r}\n")
+    return name
+
+
+def run_load(send, payloads, concurrency):
+    """
+    Sends every payload with ``concurrency`` threads; returns (latencies,
+    statuses, wall seconds). A status of 0 means the request itself failed.
+    """
+    def timed(payload):
+        start = time.perf_counter()
+        try:
+            status = send(payload)
+        except Exception:
+            status = 0
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, payloads))
+    wall = time.perf_counter() - start
+    return [s for s, _ in results], [status for _, status in results], wall
+
+
+class InProcessTarget:
+    """The views called through Django's test client (one client per thread)."""
+
+    name = 'client'
+
+    def __init__(self, workdir, settings_module, timeout):
+        sys.path.insert(0, workdir)
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+        import django
+        django.setup()
+        from api.loader import loader
+        if not loader.wait(timeout):
+            raise RuntimeError(f"Recommender did not load: {loader.status()}")
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            from django.test import Client
+            self._local.client = Client(HTTP_HOST='localhost')
+        return self._local.client
+
+    def get(self, path):
+        return self._client().get(path).status_code
+
+    def post(self, path, payload):
+        return self._client().post(path, payload, content_type='application/json').status_code
+
+    def close(self):
+        pass
+
+
+def port_in_use(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+class ServerTarget:
+    """A real server process on localhost, driven over HTTP."""
+
+    def __init__(self, name, workdir, settings_module, timeout, command, port):
+        self.name = name
+        self.base = f"http://127.0.0.1:{port}"
+        if port_in_use(port):
+            raise RuntimeError(f"Port {port} is already in use (a leftover server?), pass another --port")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module,
+                   PYTHONPATH=os.pathsep.join([workdir, BACKEND_DIR, os.environ.get('PYTHONPATH', '')]))
+        command = command.format(python=sys.executable, host='127.0.0.1', port=port)
+        self.log = open(os.path.join(workdir, f'{name}.log'), 'w')
+        print(f"Starting server: {command}")
+        # no shell, so terminate() reaches the server itself
+        self.process = subprocess.Popen(shlex.split(command), cwd=BACKEND_DIR, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready(timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log.name}")
+            try:
+                if self.get('/api/health/ready') == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError(f"Server not ready after {timeout}s, see {self.log.name}")
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def get(self, path):
+        return self._send(urllib.request.Request(self.base + path))
+
+    def post(self, path, payload):
+        return self._send(urllib.request.Request(
+            self.base + path, data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST',
+        ))
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def report(target, endpoint, concurrency, seconds, statuses, wall):
+    stats = latency_stats(seconds)
+    throughput = len(seconds) / wall
+    errors = sum(1 for status in statuses if status != 200)
+    shed = sum(1 for status in statuses if status == 503)
+    print(f"{target.name:<12} {endpoint:<16} c={concurrency:<4} {throughput:9.1f} req/s  "
+          f"p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+          f"p99 {stats['p99_ms']:8.2f} ms  errors {errors} (503: {shed})")
+    return dict(mode=target.name, endpoint=endpoint, concurrency=concurrency,
+                requests=len(seconds), errors=errors, shed=shed, seconds=wall,
+                throughput_rps=throughput, **stats)
+
+
+def bench_target(target, args):
+    endpoints = {
+        'options': lambda payload: target.get('/api/options/'),
+        'recommend': lambda payload: target.post('/api/recommend/', payload),
+        # every other request is a cheap options call
+        'mixed': lambda item: target.get('/api/options/') if item[0] else target.post('/api/recommend/', item[1]),
+    }
+    runs = []
+    for run, concurrency in enumerate(args.concurrency):
+        for endpoint in args.endpoints:
+            # a fresh query set per run, so only --distinct makes caches warm
+            seed = args.seed + 1000 * run
+            if args.distinct:
+                distinct = wizard_queries(args.distinct, seed)
+                payloads = [distinct[i % args.distinct] for i in range(args.requests)]
+            else:
+                payloads = wizard_queries(args.requests, seed)
+
+            warmup = wizard_queries(args.warmup, seed + 999)
+            if endpoint == 'mixed':
+                payloads = [(i % 2 == 1, p) for i, p in enumerate(payloads)]
+                warmup = [(False, p) for p in warmup]
+
+            send = endpoints[endpoint]
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                run_load(send, warmup, concurrency)
+                seconds, statuses, wall = run_load(send, payloads, concurrency)
+
+            if endpoint != 'mixed':
+                runs.append(report(target, endpoint, concurrency, seconds, statuses, wall))
+                continue
+            for kind in ('options', 'recommend'):
+                picked = [i for i, (options, _) in enumerate(payloads) if options == (kind == 'options')]
+                runs.append(report(target, f'mixed:{kind}', concurrency, [seconds[i] for i in picked],
+                                   [statuses[i] for i in picked], wall))
+    return runs
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help="synthetic catalog size (e.g. 5000, 100000, 1000000)")
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--modes', nargs='+', choices=['client', 'server'], default=['client', 'server'])
+    parser.add_argument('--views', nargs='+', choices=sorted(SERVER_CMDS), default=['sync', 'async'],
+                        help="server mode: run a runserver/sync and/or a uvicorn/async server")
+    parser.add_argument('--endpoints', nargs='+', choices=['options', 'recommend', 'mixed'],
+                        default=['options', 'recommend'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--distinct', type=int, default=0,
+                        help="cycle through this many distinct queries (0: every query is new)")
+    parser.add_argument('--search', default='exact', help="RECOMMENDER_SEARCH for the benchmarked API")
+    parser.add_argument('--query-mode', default='composed', choices=['composed', 'full'])
+    parser.add_argument('--catalog-root', default=None,
+                        help="where synthetic catalogs are kept (default: <tmp>/movie-bench/<rows>)")
+    parser.add_argument('--server-cmd', default=None,
+                        help="server command for every --views; {python}, {host} and {port} are filled in")
+    parser.add_argument('--executor-workers', type=int, default=None, help="RECOMMENDER_EXECUTOR_WORKERS")
+    parser.add_argument('--executor-queue', type=int, default=64, help="RECOMMENDER_EXECUTOR_QUEUE")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for the model to load")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    catalog_root = args.catalog_root or os.path.join(tempfile.gettempdir(), 'movie-bench', str(args.rows))
+    encoder = HashEncoder(dim=args.dim)
+    version_dir = synthetic_catalog(catalog_root, args.rows, encoder, args.dim, seed=args.seed,
+                                    ivf=args.search == 'ivf')
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        targets = []
+        if 'client' in args.modes:
+            targets.append(lambda: InProcessTarget(workdir, write_settings(workdir, catalog_root, args, 'sync'),
+                                                   args.timeout))
+        if 'server' in args.modes:
+            for views in args.views:
+                targets.append(lambda views=views: ServerTarget(
+                    f'server-{views}', workdir, write_settings(workdir, catalog_root, args, views),
+                    args.timeout, args.server_cmd or SERVER_CMDS[views], args.port))
+        for make_target in targets:
+            target = make_target()
+            try:
+                runs += bench_target(target, args)
+            finally:
+                target.close()
+
+    write_json(args.json, {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'catalog': {'rows': args.rows, 'dim': args.dim, 'version': os.path.basename(version_dir)},
+        'search': args.search,
+        'query_mode': args.query_mode,
+        'encoder': encoder.model_name,
+        'runs': runs,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Query encode latency, throughput and agreement with the fp32 model for each
+encoder backend (RECOMMENDER_ENCODER), on wizard-style query texts.
+
+    python scripts/build_sbert_model.py --export-only --offline   # for the onnx backends
+    python scripts/bench_encoders.py --backends sbert torch-int8 onnx onnx-int8 --threads 4
+
+Agreement is the cosine similarity of every backend's embedding with the
+'sbert' (fp32 torch) embedding of the same text.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from bench_utils import BACKEND_DIR, latency_stats, time_each, wizard_queries, write_json
+from api.encoders import ENCODERS, load_encoder
+from api.vocabulary import build_query_text
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+ENCODER_DIR = os.path.join(BACKEND_DIR, 'api', 'ml', 'encoders')
+
+
+def query_texts(n, seed):
+    return [build_query_text(**q) for q in wizard_queries(n, seed)]
+
+
+def bench_backend(name, texts, reference, args):
+    start = time.perf_counter()
+    encoder = load_encoder(name, args.model, threads=args.threads, export_dir=args.encoder_dir)
+    load_seconds = time.perf_counter() - start
+    encoder.encode(texts[:8])
+
+    _, seconds = time_each(lambda text: encoder.encode([text]), texts[:args.queries])
+    latency = latency_stats(seconds)
+
+    start = time.perf_counter()
+    embeddings = np.asarray(encoder.encode(texts, batch_size=args.batch_size), dtype=np.float32)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    result = dict(backend=name, load_seconds=load_seconds, throughput_per_s=throughput, **latency)
+    if reference is not None:
+        a = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        b = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+        cosine = (a * b).sum(axis=1)
+        result.update(cosine_mean=float(cosine.mean()), cosine_min=float(cosine.min()))
+
+    agreement = f"cos mean {result['cosine_mean']:.4f} min {result['cosine_min']:.4f}" if reference is not None else ""
+    print(f"{name:<11} p50 {latency['p50_ms']:7.2f} ms  p99 {latency['p99_ms']:7.2f} ms  "
+          f"{throughput:8.1f} texts/s  {agreement}")
+    return result, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', choices=sorted(ENCODERS),
+                        default=['sbert', 'torch-int8', 'onnx', 'onnx-int8'])
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--encoder-dir', default=ENCODER_DIR, help="where --export-onnx put the ONNX models")
+    parser.add_argument('--threads', type=int, default=None, help="intra-op threads (default: library default)")
+    parser.add_argument('--texts', type=int, default=512, help="texts for the throughput and agreement runs")
+    parser.add_argument('--queries', type=int, default=200, help="single-text encodes for the latency run")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    texts = query_texts(args.texts, args.seed)
+    backends = list(dict.fromkeys(['sbert'] + args.backends))
+
+    reference = None
+    results = []
+    for name in backends:
+        try:
+            result, embeddings = bench_backend(name, texts, reference, args)
+        except (ImportError, FileNotFoundError) as e:
+            print(f"{name:<11} skipped: {e}")
+            continue
+        if name == 'sbert':
+            reference = embeddings
+            if name not in args.backends:
+                continue
+        results.append(result)
+
+    write_json(args.json, {'model': args.model, 'threads': args.threads, 'texts': len(texts), 'runs': results})
+
+
+if __name__ == "__main__":
+    main()
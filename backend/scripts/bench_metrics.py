@@ -0,0 +1,50 @@
+"""
+Per-request cost of the recommend-path instrumentation: creating the Timings,
+recording the five stages, observing them into the histograms and rendering
+the Server-Timing header (everything the view adds besides the real work).
+
+    python scripts/bench_metrics.py --requests 200000
+"""
+import argparse
+import time
+
+from bench_utils import write_json
+from api.metrics import LATENCY_BUCKETS, LabeledHistogram, RequestMetrics, Timings
+
+STAGES = ['query', 'encode', 'similarity', 'topk', 'serialize']
+
+
+def instrumented_request(metrics):
+    timings = Timings()
+    start = timings.started
+    for stage in STAGES:
+        start = timings.since(stage, start)
+    total = timings.total()
+    metrics.observe('recommend', timings.stages, total)
+    return timings.server_timing(total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200000)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    stage_seconds = LabeledHistogram('stage_seconds', '', 'stage', LATENCY_BUCKETS, labels=STAGES)
+    request_seconds = LabeledHistogram('request_seconds', '', 'endpoint', LATENCY_BUCKETS, labels=['recommend'],
+                                       lock=stage_seconds.lock)
+    metrics = RequestMetrics(stage_seconds, request_seconds)
+    for _ in range(1000):
+        instrumented_request(metrics)
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        instrumented_request(metrics)
+    per_request_us = (time.perf_counter() - start) / args.requests * 1e6
+
+    print(f"instrumentation overhead: {per_request_us:.2f} us/request ({len(STAGES)} stages)")
+    write_json(args.json, {'requests': args.requests, 'stages': len(STAGES), 'overhead_us': per_request_us})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Memory and recall of int8 / product-quantized storage with exact re-ranking,
+against exact float32 search, on a synthetic catalog.
+
+    python scripts/bench_quantization.py --rows 100000 --rerank 0 100 300
+"""
+import argparse
+import time
+
+from bench_utils import latency_stats, recall_at_k, synthetic_embeddings, synthetic_queries, time_each, write_json
+from api.engine import RetrievalEngine
+from api.quantization import Int8Quantizer, ProductQuantizer, QuantizedEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--pq-m', type=int, default=48)
+    parser.add_argument('--rerank', type=int, nargs='+', default=[0, 50, 100, 300])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    embeddings = synthetic_embeddings(args.rows, args.dim, seed=args.seed)
+    queries = synthetic_queries(embeddings, args.queries, seed=args.seed + 1)
+
+    exact = RetrievalEngine(embeddings, normalized=True)
+    truth, seconds = time_each(lambda q: exact.search(q, args.k)[0], queries)
+    exact_stats = latency_stats(seconds)
+    float_bytes = embeddings.nbytes
+    print(f"{args.rows:,} x {args.dim}, k={args.k}")
+    print(f"float32      {float_bytes / 2**20:8.1f} MiB  ({float_bytes // args.rows} B/vector)  "
+          f"p50 {exact_stats['p50_ms']:.3f} ms")
+
+    results = {'rows': args.rows, 'dim': args.dim, 'k': args.k,
+               'float32': dict(bytes=float_bytes, **exact_stats), 'quantized': []}
+
+    for name, train in [('int8', lambda: Int8Quantizer.train(embeddings)),
+                        ('pq', lambda: ProductQuantizer.train(embeddings, m=args.pq_m, seed=args.seed))]:
+        start = time.perf_counter()
+        quantizer = train()
+        codes = quantizer.encode(embeddings)
+        build_seconds = time.perf_counter() - start
+        code_bytes = codes.nbytes
+        print(f"\n{name:<12} {code_bytes / 2**20:8.1f} MiB  ({code_bytes // args.rows} B/vector, "
+              f"{float_bytes / code_bytes:.0f}x smaller)  built in {build_seconds:.1f}s")
+
+        engine = QuantizedEngine(quantizer, codes, embeddings)
+        for rerank in args.rerank:
+            found, seconds = time_each(lambda q: engine.search(q, args.k, rerank=rerank)[0], queries)
+            stats = latency_stats(seconds)
+            recall = recall_at_k(truth, found)
+            print(f"  rerank={rerank:<5} recall@{args.k} {recall:.3f}  p50 {stats['p50_ms']:.3f} ms  "
+                  f"p99 {stats['p99_ms']:.3f} ms")
+            results['quantized'].append(dict(kind=name, bytes=code_bytes, rerank=rerank, recall=recall, **stats))
+
+    write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency and throughput of sharded scatter-gather search (api/shards.py) by
+shard count, against exact in-process search, on a synthetic catalog.
+
+    python scripts/bench_shards.py --rows 2000000 --shards 1 2 4 8 --affinity auto
+
+Shards only help when there are cores for them: on a machine with fewer cores
+than shards the extra processes just take turns.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from bench_utils import latency_stats, recall_at_k, synthetic_embeddings, synthetic_queries, time_each, write_json
+from api.engine import RetrievalEngine
+from api.shards import ShardedEngine
+
+
+def throughput(engine, queries, k, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        engine.search_batch(queries[i:i + batch_size], k)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=1, help="BLAS threads per shard")
+    parser.add_argument('--affinity', choices=['none', 'auto'], default='none')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    embeddings = synthetic_embeddings(args.rows, args.dim, seed=args.seed)
+    queries = synthetic_queries(embeddings, args.queries, seed=args.seed + 1)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print(f"{args.rows:,} x {args.dim}, k={args.k}, {cpus} CPUs, {args.threads} thread(s)/shard, "
+          f"affinity={args.affinity}")
+
+    exact = RetrievalEngine(embeddings, normalized=True)
+    truth, seconds = time_each(lambda q: exact.search(q, args.k)[0], queries)
+    stats = latency_stats(seconds)
+    qps = throughput(exact, queries, args.k, args.batch_size)
+    print(f"{'in-process':<12} p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  "
+          f"p99 {stats['p99_ms']:8.3f} ms  {qps:9.0f} q/s (batch {args.batch_size})")
+    results = {'rows': args.rows, 'dim': args.dim, 'k': args.k, 'cpus': cpus, 'threads': args.threads,
+               'affinity': args.affinity, 'exact': dict(qps=qps, **stats), 'sharded': []}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'embeddings.npy')
+        np.save(path, embeddings)
+        del exact
+
+        for n in args.shards:
+            start = time.perf_counter()
+            engine = ShardedEngine(path, args.rows, args.dim, n, threads=args.threads,
+                                   affinity='auto' if args.affinity == 'auto' else None)
+            started = time.perf_counter() - start
+            try:
+                engine.search_batch(queries[:1], args.k)
+                found, seconds = time_each(lambda q: engine.search(q, args.k)[0], queries)
+                stats = latency_stats(seconds)
+                qps = throughput(engine, queries, args.k, args.batch_size)
+            finally:
+                engine.close()
+            recall = recall_at_k(truth, found)
+            print(f"{f'{n} shard(s)':<12} p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms  "
+                  f"p99 {stats['p99_ms']:8.3f} ms  {qps:9.0f} q/s  recall@{args.k} {recall:.3f}  "
+                  f"(started in {started:.2f}s)")
+            results['sharded'].append(dict(shards=n, qps=qps, recall=recall, start_seconds=started, **stats))
+
+    write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
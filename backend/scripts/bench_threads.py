@@ -0,0 +1,103 @@
+"""
+Throughput and tail latency of /api/recommend/ for combinations of web
+workers (gunicorn + uvicorn) and threads per worker (api/threads.py), on a
+synthetic catalog with the deterministic hash encoder.
+
+    python scripts/bench_threads.py --rows 100000 --workers 1 2 4 --threads off auto 1 2 4
+
+'off' runs without the thread budget (every pool at its library default,
+i.e. oversubscribed as soon as there is more than one worker), 'auto' with
+the budget's own split of the cores, and a number pins the threads each
+worker may use (RECOMMENDER_WORKER_THREADS). The hash encoder does no torch
+work, so the sweep mostly shows the BLAS and executor pools.
+"""
+import argparse
+import contextlib
+import json
+import os
+import tempfile
+import time
+import urllib.request
+
+from bench_api import ServerTarget, git_commit, report, run_load
+from bench_utils import synthetic_catalog, wizard_queries, write_json
+from api.encoders import HashEncoder
+from api.threads import available_cpus, cgroup_cpu_limit
+
+GUNICORN_CMD = "{python} -m gunicorn core.asgi:application -c gunicorn.conf.py --workers {workers} --bind {host}:{port}"
+
+
+def write_settings(workdir, catalog_root, args, threads):
+    name = f"bench_threads_{threads}"
+    with open(os.path.join(workdir, name + '.py'), 'w') as f:
+        f.write("from core.settings import *  # noqa\n\n")
+        f.write(f"RECOMMENDER_CATALOG_DIR = {catalog_root!r}\n")
+        f.write("RECOMMENDER_ENCODER = 'hash'\n")
+        f.write(f"RECOMMENDER_SEARCH = {args.search!r}\n")
+        f.write("RECOMMENDER_RELOAD_POLL_SECONDS = 0\n")
+        f.write(f"RECOMMENDER_THREAD_BUDGET = {threads != 'off'!r}\n")
+        f.write(f"RECOMMENDER_WORKER_THREADS = {int(threads) if threads.isdigit() else None!r}\n")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', nargs='+', default=['off', 'auto', '1', '2'],
+                        help="threads per worker: 'off', 'auto' or a number")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--search', default='exact', help="RECOMMENDER_SEARCH for the benchmarked API")
+    parser.add_argument('--catalog-root', default=None,
+                        help="where synthetic catalogs are kept (default: <tmp>/movie-bench/<rows>)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for the model to load")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    catalog_root = args.catalog_root or os.path.join(tempfile.gettempdir(), 'movie-bench', str(args.rows))
+    synthetic_catalog(catalog_root, args.rows, HashEncoder(dim=args.dim), args.dim, seed=args.seed,
+                      ivf=args.search == 'ivf')
+    print(f"{os.cpu_count()} CPUs, {available_cpus()} available (cgroup quota: {cgroup_cpu_limit()})")
+
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for workers in args.workers:
+            for threads in args.threads:
+                settings_module = write_settings(workdir, catalog_root, args, threads)
+                target = ServerTarget(f'w={workers} t={threads}', workdir, settings_module, args.timeout,
+                                      GUNICORN_CMD.replace('{workers}', str(workers)), args.port)
+                try:
+                    send = lambda payload: target.post('/api/recommend/', payload)
+                    # enough warmup requests to reach every worker once it has loaded
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        run_load(send, wizard_queries(args.warmup, args.seed + 999), args.concurrency)
+                    seconds, statuses, wall = run_load(send, wizard_queries(args.requests, args.seed),
+                                                       args.concurrency)
+                    run = report(target, 'recommend', args.concurrency, seconds, statuses, wall)
+                    with contextlib.suppress(OSError, ValueError, KeyError):
+                        with urllib.request.urlopen(target.base + '/api/stats/', timeout=10) as response:
+                            run['budget'] = json.loads(response.read())['threads']
+                        print(f"  budget of one worker: {run['budget']}")
+                    run.update(workers=workers, threads=threads)
+                    runs.append(run)
+                finally:
+                    target.close()
+                time.sleep(1)
+
+    write_json(args.json, {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'catalog': {'rows': args.rows, 'dim': args.dim},
+        'search': args.search,
+        'concurrency': args.concurrency,
+        'runs': runs,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Shared helpers for the benchmark scripts: synthetic catalogs and timing.
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(CURRENT_SCRIPT_DIR)
+
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def synthetic_embedding_chunks(rows, dim=384, clusters=None, spread=0.35, seed=0, chunk_size=100000):
+    """
+    Unit-length float32 vectors drawn around random topic centres, which is
+    closer to real sentence embeddings than uniform noise (and much harder
+    for a coarse quantizer to get wrong by accident). Yields blocks of at most
+    ``chunk_size`` rows.
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(16, int(np.sqrt(rows)))
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+
+    for start in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - start)
+        noise = rng.standard_normal((n, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        block = centres[rng.integers(0, clusters, n)] + noise
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        yield block
+
+
+def synthetic_embeddings(rows, dim=384, clusters=None, spread=0.35, seed=0, chunk_size=100000):
+    out = np.empty((rows, dim), dtype=np.float32)
+    start = 0
+    for block in synthetic_embedding_chunks(rows, dim, clusters, spread, seed, chunk_size):
+        out[start:start + len(block)] = block
+        start += len(block)
+    return out
+
+
+WORDS = ("space robot heist family dog war love city island ship detective murder school music "
+         "dragon magic prison zombie ghost alien time travel revenge friendship king queen").split()
+
+
+def wizard_queries(n, seed):
+    """Random wizard payloads (genre, mood, content, element)."""
+    from api.vocabulary import GENRES, MOOD_MAPPING
+
+    rng = np.random.default_rng(seed)
+    moods = list(MOOD_MAPPING)
+    return [{
+        'genre': str(rng.choice(GENRES)),
+        'mood': str(rng.choice(moods)),
+        'content': " ".join(rng.choice(WORDS, 2)),
+        'element': str(rng.choice(WORDS)),
+    } for _ in range(n)]
+
+
+def synthetic_movies(start, n, rng):
+    """Catalog columns (as built by api.build.prepare_records) for movies start..start+n."""
+    from api.build import payload_fragment
+    from api.vocabulary import GENRES
+
+    ids = np.arange(start + 1, start + n + 1, dtype=np.int32)
+    titles = [f"Movie {i}" for i in ids]
+    overviews = [" ".join(rng.choice(WORDS, 12)) for _ in range(n)]
+    genres = [" ".join(rng.choice(GENRES, rng.integers(1, 4), replace=False)) for _ in range(n)]
+    year = rng.integers(1950, 2025, n).astype(np.int16)
+    year[rng.random(n) < 0.01] = 0
+    rating = np.round(rng.uniform(1, 9, n), 1).astype(np.float32)
+    runtime = rng.integers(70, 180, n).astype(np.int16)
+    return {
+        'id': ids,
+        'title': titles,
+        'overview': overviews,
+        'genres_str': genres,
+        'keywords_str': ["" for _ in range(n)],
+        'year': year,
+        'rating': rating,
+        'runtime': runtime,
+        'payload_json': [
+            payload_fragment(*row) for row in zip(ids, titles, overviews, genres, year, rating, runtime)
+        ],
+        'content_hash': np.zeros(n, dtype=np.uint64),
+    }
+
+
+def synthetic_catalog(root, rows, encoder, dim=384, seed=0, chunk_size=100000, ivf=False):
+    """
+    Writes a servable catalog of ``rows`` synthetic movies under ``root`` and
+    returns its version directory. Movie embeddings are clustered noise; the
+    genre/mood vocabulary is encoded with ``encoder`` (usually a HashEncoder).
+    An existing catalog of the same size is reused.
+    """
+    from api.ann import IVFIndex
+    from api.artifacts import ArtifactError, CatalogWriter, load_catalog
+    from api.build import Interner
+    from api.vocabulary import vocabulary_texts
+
+    try:
+        existing = load_catalog(root)
+        same = len(existing) == rows and existing.model_name == encoder.model_name
+        if same and (not ivf or 'ivf_ids' in existing.arrays):
+            print(f"Reusing synthetic catalog {existing.path} ({rows:,} movies)")
+            return existing.path
+    except ArtifactError:
+        pass
+
+    print(f"Writing synthetic catalog of {rows:,} movies to {root}...")
+    rng = np.random.default_rng(seed + 1)
+    writer = CatalogWriter(root, encoder.model_name, dim)
+    genres = Interner()
+    try:
+        for block in synthetic_embedding_chunks(rows, dim, seed=seed, chunk_size=chunk_size):
+            columns = synthetic_movies(writer.rows, len(block), rng)
+            columns['genre_id'] = genres(columns.pop('genres_str'))
+            writer.append(block, columns, normalized=True)
+
+        keys, texts = zip(*vocabulary_texts())
+        arrays = {'vocabulary': np.asarray(encoder.encode(list(texts)), dtype=np.float32)}
+        metadata = {'vocabulary': list(keys), 'genres': genres.values}
+        if ivf:
+            index = IVFIndex.build(writer.embeddings())
+            arrays.update(index.to_arrays())
+            metadata['ivf_lists'] = index.n_lists
+        return writer.finish(arrays, metadata)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def synthetic_queries(embeddings, n, noise=0.5, seed=1):
+    """Perturbed catalog rows, so every query has real near neighbours."""
+    rng = np.random.default_rng(seed)
+    base = embeddings[rng.choice(embeddings.shape[0], n, replace=False)]
+    queries = base + rng.standard_normal(base.shape).astype(np.float32) * (noise / np.sqrt(base.shape[1]))
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def recall_at_k(truth, found):
+    """Mean fraction of the exact top-k ids that the approximate result recovered."""
+    hits = [len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]
+    return float(np.mean(hits))
+
+
+def latency_stats(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+    }
+
+
+def time_each(fn, items):
+    """Calls fn(item) for every item; returns (results, per-call seconds)."""
+    results, seconds = [], []
+    for item in items:
+        start = time.perf_counter()
+        results.append(fn(item))
+        seconds.append(time.perf_counter() - start)
+    return results, seconds
+
+
+def write_json(path, payload):
+    if not path:
+        return
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
+    print(f"Wrote {path}")
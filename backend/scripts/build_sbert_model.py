@@ -1,102 +1,272 @@
+import argparse
 import os
-import pandas as pd
-import pickle
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-from sklearn.feature_extraction.text import CountVectorizer
-from ast import literal_eval
-from sentence_transformers import SentenceTransformer
+import numpy as np
+import pandas as pd
 
 CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKEND_DIR = os.path.dirname(CURRENT_SCRIPT_DIR)
 CSV_PATH = os.path.join(CURRENT_SCRIPT_DIR, 'tmdb_5000_movies.csv')
 ML_DIR = os.path.join(BACKEND_DIR, 'api', 'ml')
+CATALOG_DIR = os.path.join(ML_DIR, 'catalog')
+ENCODER_DIR = os.path.join(ML_DIR, 'encoders')
 MODEL_NAME = 'all-MiniLM-L6-v2'
 
-print("1. load dataset...")
+sys.path.insert(0, BACKEND_DIR)
+from api.ann import IVFIndex
+from api.artifacts import ArtifactError, CatalogWriter, load_catalog
+from api.build import CSV_COLUMNS, IncrementalPlan, Interner, StageTimer, assemble_embeddings, prepare_records
+from api.encoders import export_onnx
+from api.filters import RANGE_COLUMNS, FilterIndex
+from api.layout import catalog_map, cluster_names
+from api.lexical import LexicalIndexBuilder
+from api.neighbors import ENTRY_BYTES, MAX_WORKERS, neighbor_table, worker_bytes
+from api.quantization import CHUNK_ROWS, QUANTIZERS, Int8Quantizer, ProductQuantizer
+from api.vocabulary import vocabulary_texts
+
+CATALOG_COLUMNS = ['id', 'title', 'overview', 'keywords_str', 'year', 'rating', 'runtime',
+                   'payload_json', 'content_hash']
+
 
-if not os.path.exists(CSV_PATH):
-    print(f"Error: Dataset not found at {CSV_PATH}")
-    exit()
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the SBERT movie catalog.")
+    parser.add_argument('--csv', default=CSV_PATH, help="TMDB movies CSV")
+    parser.add_argument('--ivf-lists', type=int, default=None, help="cells of the IVF index (default ~4*sqrt(rows))")
+    parser.add_argument('--no-ivf', action='store_true', help="skip building the approximate nearest-neighbour index")
+    parser.add_argument('--quantize', nargs='*', choices=sorted(QUANTIZERS), default=[],
+                        help="also store compressed codes (int8 and/or pq) for RECOMMENDER_SEARCH")
+    parser.add_argument('--pq-m', type=int, default=48, help="sub-vectors per embedding for --quantize pq")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse embeddings of unchanged movies from the current catalog")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the CSV in chunks, prepare text on a process pool and write embeddings, "
+                             "columns and quantized codes to disk as they are encoded. Memory then grows "
+                             "with the indexes built at the end, not with the embeddings: the BM25 postings "
+                             "(~12 bytes per distinct word of a movie), "
+                             f"{ENTRY_BYTES} bytes per --neighbors entry, a few dozen bytes per movie for the "
+                             f"filter, IVF and map arrays, and {worker_bytes() // 2**20} MiB per "
+                             "--neighbor-workers thread while the neighbour table is built")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="CSV rows per chunk with --stream")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="text preparation processes with --stream")
+    parser.add_argument('--batch-size', type=int, default=64, help="texts per model.encode batch")
+    parser.add_argument('--no-lexical', action='store_true',
+                        help="skip the BM25 keyword index used by RECOMMENDER_RETRIEVAL = 'hybrid'")
+    parser.add_argument('--neighbors', type=int, default=50,
+                        help="precomputed similar movies per movie for /api/movies/<id>/similar/ (0 to skip)")
+    parser.add_argument('--neighbor-workers', type=int, default=min(os.cpu_count() or 1, MAX_WORKERS),
+                        help=f"threads computing the neighbour table, {worker_bytes() // 2**20} MiB of scratch each")
+    parser.add_argument('--map-clusters', type=int, default=None,
+                        help="clusters of the 2D catalog map for /api/map/ (default ~sqrt(rows)/4, at most 256)")
+    parser.add_argument('--no-map', action='store_true', help="skip the 2D catalog map")
+    parser.add_argument('--export-onnx', action='store_true',
+                        help="also export the model to ONNX (fp32 + int8) for RECOMMENDER_ENCODER = 'onnx'")
+    parser.add_argument('--export-only', action='store_true', help="only export the ONNX encoder, skip the catalog")
+    parser.add_argument('--offline', action='store_true',
+                        help="use the locally cached model only (no Hugging Face downloads)")
+    return parser.parse_args()
 
-df = pd.read_csv(CSV_PATH)
 
-#features = ['keywords', 'genres', 'overview', 'title', 'release_date', 'vote_average', 'runtime']
-#df_clean = df[features].copy()
+def read_chunks(path, chunk_size, timer):
+    start = time.perf_counter()
+    if chunk_size:
+        reader = pd.read_csv(path, usecols=CSV_COLUMNS, chunksize=chunk_size)
+    else:
+        reader = iter([pd.read_csv(path, usecols=CSV_COLUMNS)])
+    for chunk in reader:
+        timer.add('read', time.perf_counter() - start, len(chunk))
+        yield {column: chunk[column].tolist() for column in CSV_COLUMNS}
+        start = time.perf_counter()
 
-df = df[['id', 'title', 'genres', 'overview', 'keywords', 'release_date', 'vote_average', 'runtime']].copy()
 
+def _timed_prepare(records):
+    start = time.perf_counter()
+    return prepare_records(records, MODEL_NAME), time.perf_counter() - start
 
-print("2. Cleaning Data")
-df['overview'] = df['overview'].fillna('')
-df['genres'] = df['genres'].fillna('[]')
-df['keywords'] = df['keywords'].fillna('[]')
 
+def prepare_chunks(chunks, workers, timer):
+    """Prepared chunks in input order; with workers > 1 they are built ahead on a process pool."""
+    if workers <= 1:
+        for records in chunks:
+            prepared, seconds = _timed_prepare(records)
+            timer.add('prepare', seconds, len(prepared['id']))
+            yield prepared
+        return
 
-def parse_json_col(x):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for records in chunks:
+            pending.append(pool.submit(_timed_prepare, records))
+            # bounded read-ahead keeps memory constant
+            if len(pending) >= 2 * workers:
+                prepared, seconds = pending.popleft().result()
+                timer.add('prepare', seconds, len(prepared['id']))
+                yield prepared
+        while pending:
+            prepared, seconds = pending.popleft().result()
+            timer.add('prepare', seconds, len(prepared['id']))
+            yield prepared
+
+
+def load_previous(incremental):
+    if not incremental:
+        return None
     try:
-        items = literal_eval(x)
-        if isinstance(items, list):
-            return " ".join([i['name'] for i in items])
-        return ""
-    except:
-        return str(x)
+        previous = load_catalog(CATALOG_DIR)
+    except ArtifactError:
+        print("   No previous catalog, encoding everything.")
+        return None
+    if previous.model_name != MODEL_NAME:
+        print(f"   Previous catalog used {previous.model_name}, encoding everything.")
+        return None
+    return previous
+
+
+def write_codes(writer, name, quantizer, embeddings):
+    """Encodes the embeddings chunk by chunk straight into the catalog's ``name`` array."""
+    codes = None
+    for start in range(0, embeddings.shape[0], CHUNK_ROWS):
+        block = quantizer.encode(embeddings[start:start + CHUNK_ROWS])
+        if codes is None:
+            codes = writer.array(name, block.dtype, block.shape[1:])
+        codes.append(block)
 
-df['genres_str'] = df['genres'].apply(parse_json_col)
-df['keywords_str'] = df['keywords'].apply(parse_json_col)
 
-#  "Rich Context String", that the transformer reads
-df['semantic_text'] = df.apply(
-    lambda row: f"Title: {row['title']}. Genre: {row['genres_str']}. Plot: {row['overview']}",
-    axis=1
-)
+def build_arrays(model, writer, args):
+    """Vocabulary table and optional indexes, all computed from the written embeddings."""
+    embeddings = writer.embeddings()
+    # Genre/mood vectors, so the API only has to encode the free-text part of a query
+    vocab_keys, vocab_texts = zip(*vocabulary_texts())
+    arrays = {'vocabulary': np.asarray(model.encode(list(vocab_texts)), dtype=np.float32)}
+    metadata = {'vocabulary': list(vocab_keys)}
 
-print(f"   Sample Input: {df['semantic_text'].iloc[0][:80]}...")
+    if not args.no_ivf:
+        print("   building IVF index...")
+        ivf = IVFIndex.build(embeddings, n_lists=args.ivf_lists)
+        arrays.update(ivf.to_arrays())
+        metadata['ivf_lists'] = ivf.n_lists
 
-print(f"3. Loading Model {MODEL_NAME}")
-model = SentenceTransformer(MODEL_NAME)
+    for kind in args.quantize:
+        print(f"   quantizing embeddings ({kind})...")
+        if kind == 'pq':
+            quantizer = ProductQuantizer.train(embeddings, m=args.pq_m)
+        else:
+            quantizer = Int8Quantizer.train(embeddings)
+        name = f'{quantizer.kind}_codes'
+        write_codes(writer, name, quantizer, embeddings)
+        arrays.update({key: value for key, value in quantizer.to_arrays(None).items() if key != name})
 
-print("4. Encoding Movie Overviews")
-embeddings = model.encode(df['semantic_text'].tolist(), show_progress_bar=True)
+    return arrays, metadata
 
 
+def export_encoder():
+    print(f"Exporting {MODEL_NAME} to ONNX...")
+    path = export_onnx(MODEL_NAME, ENCODER_DIR)
+    print(f"DONE. Saved ONNX encoder to {path}")
 
-#df_clean['genres'] = df_clean['genres'].apply(parse_features)
-#df_clean['keywords'] = df_clean['keywords'].apply(parse_features)
-#df_clean['overview'] = df_clean['overview'].fillna('')
-#df_clean['release_date'] = df_clean['release_date'].fillna('')
-#df_clean['runtime'] = df_clean['runtime'].fillna(0)
-#df_clean['vote_average'] = df_clean['vote_average'].fillna(0)
-#print("   Example genre (cleaned):", df_clean['genres'].iloc[0])
 
+def main():
+    args = parse_args()
+    timer = StageTimer()
 
-def combine_features(row):
+    if args.offline:
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['TRANSFORMERS_OFFLINE'] = '1'
+    if args.export_only:
+        export_encoder()
+        return
+
+    print("1. load dataset...")
+
+    if not os.path.exists(args.csv):
+        print(f"Error: Dataset not found at {args.csv}")
+        exit()
+
+    from sentence_transformers import SentenceTransformer
+
+    print(f"2. Loading Model {MODEL_NAME}")
+    model = SentenceTransformer(MODEL_NAME)
+    dim = model.get_sentence_embedding_dimension()
+
+    previous = load_previous(args.incremental)
+    plan = IncrementalPlan(previous)
+    writer = CatalogWriter(CATALOG_DIR, MODEL_NAME, dim)
+    genres = Interner()
+    lexical = None if args.no_lexical else LexicalIndexBuilder()
+
+    print("3. Cleaning Data + Encoding Movie Overviews")
+    chunk_size = args.chunk_size if args.stream else None
+    workers = args.workers if args.stream else 1
+    reused = 0
     try:
-        return row['keywords'] + " " + row['genres'] + " " + row['overview']
-    except:
-        print("Error:", row)
-        return ""
+        for prepared in prepare_chunks(read_chunks(args.csv, chunk_size, timer), workers, timer):
+            if writer.rows == 0:
+                print(f"   Sample Input: {prepared['semantic_text'][0][:80]}...")
+
+            reuse_from, encode_rows = plan.plan(prepared['id'], prepared['content_hash'])
+            texts = [prepared['semantic_text'][i] for i in encode_rows]
+            encoded = timer.time('encode', len(texts), lambda: model.encode(
+                texts, batch_size=args.batch_size, show_progress_bar=not args.stream,
+            )) if texts else np.empty((0, dim), dtype=np.float32)
+            embeddings = assemble_embeddings(previous, reuse_from, encode_rows, encoded, dim)
+            reused += len(reuse_from) - len(encode_rows)
+
+            columns = {name: prepared[name] for name in CATALOG_COLUMNS}
+            columns['genre_id'] = genres(prepared['genres_str'])
+            if lexical is not None:
+                timer.time('lexical', len(embeddings), lexical.add,
+                           prepared['keywords_str'], prepared['genres_str'], prepared['overview'])
+            timer.time('write', len(embeddings), writer.append, embeddings, columns, True)
+            if args.stream:
+                print(f"   {writer.rows} movies written...")
 
+        if previous is not None:
+            print(f"   Reused {reused} embeddings from {previous.version}, encoded {writer.rows - reused}.")
 
-#print("3. creating combined features...")
-#df_clean['combined_features'] = df_clean.apply(combine_features, axis=1)
+        print("4. Building indexes")
+        start = time.perf_counter()
+        arrays, metadata = build_arrays(model, writer, args)
+        metadata['genres'] = genres.values
+        # read back from the written columns instead of collecting them in memory
+        columns = {name: writer.column(name) for name in ('id', 'genre_id') + RANGE_COLUMNS}
+        filters = FilterIndex.build(columns['genre_id'], genres.values,
+                                    columns['year'], columns['runtime'], columns['rating'])
+        arrays.update(filters.to_arrays())
+        if lexical is not None:
+            arrays.update(lexical.finish())
+        timer.add('indexes', time.perf_counter() - start, writer.rows)
 
-#print("4. train vectorizer (das dauert kurz)...")
-#cv = CountVectorizer(max_features=5000, stop_words='english')
-#count_matrix = cv.fit_transform(df_clean['combined_features'])
+        if args.neighbors:
+            print(f"   computing {args.neighbors} neighbours per movie...")
+            start = time.perf_counter()
+            arrays['neighbor_ids'], arrays['neighbor_scores'] = neighbor_table(
+                writer.embeddings(), args.neighbors, workers=args.neighbor_workers)
+            timer.add('neighbors', time.perf_counter() - start, writer.rows)
 
-print("5. store .pkl files...")
+        if not args.no_map:
+            print("   laying out the catalog map...")
+            start = time.perf_counter()
+            map_arrays, labels = catalog_map(writer.embeddings(), columns['id'], args.map_clusters)
+            arrays.update(map_arrays)
+            metadata['map_clusters'] = cluster_names(labels, columns['genre_id'], genres.values,
+                                                     len(map_arrays['map_sizes']))
+            timer.add('map', time.perf_counter() - start, writer.rows)
 
-if not os.path.exists(ML_DIR):
-    os.makedirs(ML_DIR)
-    print(f"  Created directory: {ML_DIR}")
+        print("5. store catalog artifacts...")
+        version_dir = writer.finish(arrays, metadata)
+    except BaseException:
+        writer.abort()
+        raise
 
-#pickle.dump(df_clean, open(os.path.join(ML_DIR, 'movies.pkl'), 'wb'))
-#pickle.dump(count_matrix, open(os.path.join(ML_DIR, 'similarity_matrix.pkl'), 'wb'))
-#pickle.dump(cv, open(os.path.join(ML_DIR, 'vectorizer.pkl'), 'wb'))
+    print(timer.report())
+    print(f"DONE. Saved SBERT catalog to {version_dir}")
 
-pickle.dump(df, open(os.path.join(ML_DIR, 'movies.pkl'), 'wb'))
+    if args.export_onnx:
+        export_encoder()
 
-# Embeddings speichern (Die "Intelligenz" des Modells)
-pickle.dump(embeddings, open(os.path.join(ML_DIR, 'movie_embeddings.pkl'), 'wb'))
 
-print(f"DONE. Saved SBERT models to {ML_DIR}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compares composed query embeddings (pre-encoded genre/mood vectors + free text)
+against encoding the full query sentence, the way recommend_movies used to.
+
+For every genre x mood x element combination it reports overlap@k of the two
+top-k lists and how many model calls the composed path needed.
+
+    python scripts/eval_composed_queries.py --k 6 --text-weight 1.0
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(CURRENT_SCRIPT_DIR)
+CATALOG_DIR = os.path.join(BACKEND_DIR, 'api', 'ml', 'catalog')
+
+sys.path.insert(0, BACKEND_DIR)
+from api.artifacts import load_catalog
+from api.engine import RetrievalEngine
+from api.query import QueryComposer
+from api.vocabulary import GENRES, MOOD_MAPPING, build_query_text
+
+ELEMENTS = ["", "future", "alien", "magic", "police", "high school", "robot", "zombie"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--k', type=int, default=6)
+    parser.add_argument('--genre-weight', type=float, default=1.0)
+    parser.add_argument('--mood-weight', type=float, default=1.0)
+    parser.add_argument('--text-weight', type=float, default=1.0)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    catalog = load_catalog(CATALOG_DIR)
+    engine = RetrievalEngine(catalog.embeddings, normalized=True)
+    weights = {'genre': args.genre_weight, 'mood': args.mood_weight, 'text': args.text_weight}
+    composer = QueryComposer.from_catalog(catalog, weights)
+    if composer is None:
+        print("Catalog has no vocabulary table, rebuild it with build_sbert_model.py first.")
+        return
+
+    print(f"Loading {catalog.model_name}...")
+    model = SentenceTransformer(catalog.model_name)
+
+    combos = list(itertools.product(GENRES, MOOD_MAPPING, ELEMENTS))
+    full_queries = [build_query_text(g, m, '', e) for g, m, e in combos]
+
+    start = time.perf_counter()
+    full_embeddings = model.encode(full_queries, batch_size=64)
+    full_time = time.perf_counter() - start
+
+    calls = 0
+    text_cache = {}
+
+    def encode(text):
+        nonlocal calls
+        if text not in text_cache:
+            calls += 1
+            text_cache[text] = model.encode([text])[0]
+        return text_cache[text]
+
+    start = time.perf_counter()
+    composed_embeddings = [composer.compose(g, m, '', e, encode) for g, m, e in combos]
+    composed_time = time.perf_counter() - start
+
+    overlaps = []
+    top1_agree = 0
+    for full, composed in zip(full_embeddings, composed_embeddings):
+        full_idx, _ = engine.search(full, args.k)
+        composed_idx, _ = engine.search(composed, args.k)
+        overlaps.append(len(set(full_idx) & set(composed_idx)) / args.k)
+        top1_agree += full_idx[0] == composed_idx[0]
+
+    overlaps = np.array(overlaps)
+    no_text = np.array([e == "" for _, _, e in combos])
+    print(f"\n{len(combos)} queries, k={args.k}, weights={weights}")
+    print(f"  overlap@{args.k}: mean {overlaps.mean():.3f}  median {np.median(overlaps):.3f}  min {overlaps.min():.3f}")
+    print(f"  overlap@{args.k} without free text: {overlaps[no_text].mean():.3f}")
+    print(f"  overlap@{args.k} with free text:    {overlaps[~no_text].mean():.3f}")
+    print(f"  top-1 agreement: {top1_agree / len(combos):.3f}")
+    print(f"  model calls: full {len(combos)}, composed {calls} (distinct free-text strings)")
+    print(f"  encode time: full {full_time:.2f}s (batched), composed {composed_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,54 @@
-import pickle
+import argparse
 import os
+import sys
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-from sklearn.manifold import TSNE
-
 # Pfade
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 ML_DIR = os.path.join(BASE_DIR, 'api', 'ml')
+CATALOG_DIR = os.path.join(ML_DIR, 'catalog')
+
+sys.path.insert(0, BASE_DIR)
+from api.artifacts import ArtifactError, load_catalog
+from api.layout import CatalogMap
 
-def plot_clusters():
+def plot_clusters(output=None):
     print(" load Daten...")
     try:
-        movies = pickle.load(open(os.path.join(ML_DIR, 'movies.pkl'), 'rb'))
-        embeddings = pickle.load(open(os.path.join(ML_DIR, 'movie_embeddings.pkl'), 'rb'))
-    except FileNotFoundError:
+        catalog = load_catalog(CATALOG_DIR)
+    except ArtifactError:
         print("firstly run build_sbert_model.py!")
         return
 
-    # only take first 1000 movies for plotting, else plot will be too big and slow
-    limit = 1000
-    subset_embeddings = embeddings[:limit]
-    subset_movies = movies.iloc[:limit].copy()
-
-    # main-genre for all movies
-    def get_main_genre(genre_str):
-        if not genre_str: return "Unknown"
-        return genre_str.split(" ")[0] # Das erste Wort ist meist das Hauptgenre
-
-    subset_movies['main_genre'] = subset_movies['genres_str'].apply(get_main_genre)
-
-    print("2. calc 2D-Projection (t-SNE)...")
-    # t-SNE reduces 384 dimension to 2
-    tsne = TSNE(n_components=2, random_state=42, perplexity=30, init='pca', learning_rate='auto')
-    vis_dims = tsne.fit_transform(subset_embeddings)
+    # the 2D layout of every movie is computed by build_sbert_model.py, no t-SNE here
+    catalog_map = CatalogMap.from_catalog(catalog)
+    if catalog_map is None:
+        print("catalog has no map, rebuild it without --no-map!")
+        return
 
-    x = [x for x,y in vis_dims]
-    y = [y for x,y in vis_dims]
+    print(f"2. plot {len(catalog_map)} movies...")
+    xy = np.asarray(catalog_map.xy)
+    names = np.asarray(catalog_map.names, dtype=object)[np.asarray(catalog_map.clusters)]
 
     plt.figure(figsize=(16, 10))
-    sns.scatterplot(x=x, y=y, hue=subset_movies['main_genre'], palette="tab10", s=60, alpha=0.8)
+    # small points, else a big catalog turns into one blob
+    size = max(1, 60 * min(1.0, 1000 / len(xy)))
+    sns.scatterplot(x=xy[:, 0], y=xy[:, 1], hue=names, palette="tab20", s=size, alpha=0.6, linewidth=0)
 
-    plt.title("SBERT Movie Embeddings", fontsize=20)
+    plt.title(f"SBERT Movie Embeddings ({catalog.version})", fontsize=20)
     plt.xlabel("Semantic dimension 1")
     plt.ylabel("Semantic dimension 2")
     plt.legend(bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
     plt.tight_layout()
-    plt.show()
+    if output:
+        plt.savefig(output, dpi=150)
+        print(f"Saved {output}")
+    else:
+        plt.show()
 
 if __name__ == "__main__":
-    plot_clusters()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Plot the catalog map built by build_sbert_model.py.")
+    parser.add_argument('--output', help="save the plot to this file instead of showing it")
+    plot_clusters(parser.parse_args().output)